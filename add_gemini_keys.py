@@ -254,6 +254,10 @@ def add_gemini_keys():
     # Commit changes
     conn.commit()
     conn.close()
+
+    # Let running API servers know the key list changed
+    if added_count > 0:
+        db.bump_gemini_keys_version()
     
     print(f"\n🎉 Hoàn thành!")
     print(f"✅ Đã thêm: {added_count} keys")
@@ -0,0 +1,343 @@
+import math
+import threading
+import time
+from collections import deque
+from latency_tracker import LatencyTracker
+
+# Priority classes, highest first
+PRIORITY_CLASSES = ('high', 'normal', 'low')
+DEFAULT_PRIORITY = 'normal'
+
+class AdmissionRejected(Exception):
+    """Raised when a request cannot be admitted; retry_after is a hint in seconds"""
+
+    def __init__(self, message, retry_after, status=429):
+        super().__init__(message)
+        self.retry_after = retry_after
+        self.status = status
+
+class _Waiter:
+    def __init__(self, key, priority, limit, start_tag, bounded):
+        self.key = key
+        self.priority = priority
+        self.limit = limit
+        self.start_tag = start_tag
+        self.bounded = bounded
+        self.event = threading.Event()
+        self.granted = False
+        self.enqueued_at = time.monotonic()
+
+class _Flow:
+    """Waiters of one API key in one lane plus its fair-queuing finish tag"""
+
+    def __init__(self):
+        self.waiters = deque()
+        self.last_finish = 0.0
+
+class _Lane:
+    """Queue, reserved slots and latency figures of one priority class"""
+
+    def __init__(self, reserved):
+        self.reserved = reserved
+        self.flows = {}  # key -> _Flow
+        self.queued = 0
+        self.in_flight = 0
+        self.virtual_time = 0.0
+        self.admitted = 0
+        self.rejected = 0
+        self.timed_out = 0
+        self.wait_times = LatencyTracker(window_size=500, min_samples=1)
+        self.service_times = LatencyTracker(window_size=500, min_samples=1)
+
+class AdmissionTicket:
+    """A held slot; pass it back to AdmissionQueue.release when the work is done"""
+
+    def __init__(self, key, priority, waited):
+        self.key = key
+        self.priority = priority
+        self.waited = waited
+        self.started_at = time.monotonic()
+        self.released = False
+
+class AdmissionQueue:
+    """Bounded admission control in front of a fixed number of processing slots.
+
+    Requests that find every slot busy wait for up to max_wait seconds instead
+    of failing immediately. Each request belongs to a priority class with its
+    own queue; free slots always go to the highest class with an eligible
+    waiter, and running requests are never preempted. reserved maps a class to
+    slots only that class may use, so lower classes keep a guaranteed share.
+
+    Within a class each API key (flow) may hold at most its own concurrency
+    limit of slots, and free slots go to waiting flows by start-time fair
+    queuing: every admitted request advances its flow's tag by 1/weight, so a
+    key flooding the queue is served in turn with light users rather than
+    ahead of them. Requests of one key and class stay FIFO.
+
+    Only when max_queue requests are already waiting (or max_queue_per_key for
+    the caller's key), or the wait times out, is the request rejected with a
+    Retry-After hint derived from queue depth and observed service time.
+    Unbounded (background) waiters are not counted against max_queue, so a
+    backlog of jobs and batch rows never locks interactive requests out.
+    """
+
+    def __init__(self, capacity, max_queue=50, max_wait=30, max_queue_per_key=10, reserved=None):
+        self.capacity = capacity
+        self.max_queue = max_queue
+        self.max_wait = max_wait
+        self.max_queue_per_key = max_queue_per_key
+        self._lock = threading.Lock()
+        self._lanes = {priority: _Lane((reserved or {}).get(priority, 0)) for priority in PRIORITY_CLASSES}
+        self.active = {}  # key -> slots currently held across all classes
+        self.queue_depth = 0
+        self.background_depth = 0  # Unbounded waiters, not counted against max_queue
+        self.in_flight = 0
+        self.admitted = 0
+        self.rejected = 0
+        self.timed_out = 0
+        self.wait_times = LatencyTracker(window_size=500, min_samples=1)
+        self.service_times = LatencyTracker(window_size=200, min_samples=1)
+        self._avg_service = None  # EWMA of slot hold time in seconds
+
+    def acquire(self, key=None, weight=1, limit=None, priority=DEFAULT_PRIORITY, max_wait=None, bounded=True):
+        """Wait for a slot and return an AdmissionTicket.
+
+        key identifies the caller's flow (API key id), weight is its fair share
+        and limit the most slots it may hold at once (None for no cap).
+        priority is one of PRIORITY_CLASSES. max_wait overrides the configured
+        wait (0 never waits); bounded=False lets background workers wait
+        indefinitely without counting against max_queue. Raises AdmissionRejected when the
+        queue is full or the wait times out.
+        """
+        if priority not in self._lanes:
+            raise ValueError(f"Unknown priority class: {priority}")
+        if max_wait is None:
+            max_wait = self.max_wait if bounded else None
+        limit = limit or float('inf')
+        weight = max(weight or 1, 0.01)
+
+        with self._lock:
+            lane = self._lanes[priority]
+            flow = lane.flows.get(key)
+            if flow is None:
+                flow = lane.flows[key] = _Flow()
+            start_tag = max(lane.virtual_time, flow.last_finish)
+
+            if not flow.waiters and self.active.get(key, 0) < limit and self._free_slots_locked(priority) > 0:
+                flow.last_finish = start_tag + 1.0 / weight
+                lane.virtual_time = max(lane.virtual_time, start_tag)
+                self._admit_locked(key, priority)
+                return self._ticket(key, priority, 0)
+
+            if bounded:
+                reason = None
+                waiting = self.queue_depth - self.background_depth
+                if max_wait == 0 or waiting >= self.max_queue:
+                    reason = f"Server busy ({waiting} requests queued)"
+                elif self.max_queue_per_key and len(flow.waiters) >= self.max_queue_per_key:
+                    reason = f"Too many concurrent requests for this API key ({len(flow.waiters)} queued)"
+                if reason:
+                    self.rejected += 1
+                    lane.rejected += 1
+                    retry_after = self._retry_after_locked(flow, limit)
+                    self._prune_locked(priority, key)
+                    raise AdmissionRejected(reason, retry_after)
+
+            waiter = _Waiter(key, priority, limit, start_tag, bounded)
+            flow.waiters.append(waiter)
+            flow.last_finish = start_tag + 1.0 / weight
+            lane.queued += 1
+            self._count_waiter_locked(waiter, 1)
+
+        waiter.event.wait(max_wait)
+
+        with self._lock:
+            if waiter.granted:
+                return self._ticket(key, priority, time.monotonic() - waiter.enqueued_at)
+            if flow.waiters and flow.waiters[-1] is waiter:
+                # Give back the share reserved by the abandoned request
+                flow.last_finish = waiter.start_tag
+            flow.waiters.remove(waiter)
+            lane.queued -= 1
+            self._count_waiter_locked(waiter, -1)
+            self.timed_out += 1
+            lane.timed_out += 1
+            retry_after = self._retry_after_locked(flow, limit)
+            self._prune_locked(priority, key)
+        raise AdmissionRejected(f"Timed out after waiting {max_wait}s for a free slot", retry_after, status=503)
+
+    def _free_slots_locked(self, priority):
+        # Slots reserved for other classes and not in use by them are held back,
+        # but never so many that nothing is left for this class
+        held_back = sum(max(0, lane.reserved - lane.in_flight)
+                        for name, lane in self._lanes.items() if name != priority)
+        held_back = min(held_back, max(0, self.capacity - 1))
+        return self.capacity - self.in_flight - held_back
+
+    def _count_waiter_locked(self, waiter, delta):
+        self.queue_depth += delta
+        if not waiter.bounded:
+            self.background_depth += delta
+
+    def _admit_locked(self, key, priority):
+        self.in_flight += 1
+        self.active[key] = self.active.get(key, 0) + 1
+        self.admitted += 1
+        lane = self._lanes[priority]
+        lane.in_flight += 1
+        lane.admitted += 1
+
+    def _ticket(self, key, priority, waited):
+        self.wait_times.record(waited)
+        self._lanes[priority].wait_times.record(waited)
+        return AdmissionTicket(key, priority, waited)
+
+    def release(self, ticket):
+        """Return a slot and hand it to the next waiting request in priority and fair-queuing order"""
+        with self._lock:
+            if ticket.released:
+                return
+            ticket.released = True
+            held = time.monotonic() - ticket.started_at
+            self.service_times.record(held)
+            self._avg_service = held if self._avg_service is None else 0.8 * self._avg_service + 0.2 * held
+            lane = self._lanes[ticket.priority]
+            lane.service_times.record(held)
+            lane.in_flight -= 1
+            self.in_flight -= 1
+            self.active[ticket.key] -= 1
+            if not self.active[ticket.key]:
+                del self.active[ticket.key]
+            self._grant_locked()
+            self._prune_locked(ticket.priority, ticket.key)
+
+    def _grant_locked(self):
+        granted = True
+        while granted and self.in_flight < self.capacity:
+            granted = False
+            for priority in PRIORITY_CLASSES:
+                if self._free_slots_locked(priority) <= 0:
+                    continue
+                waiter = self._next_waiter_locked(self._lanes[priority])
+                if waiter is None:
+                    continue
+                lane = self._lanes[priority]
+                lane.flows[waiter.key].waiters.popleft()
+                lane.queued -= 1
+                self._count_waiter_locked(waiter, -1)
+                lane.virtual_time = max(lane.virtual_time, waiter.start_tag)
+                waiter.granted = True
+                self._admit_locked(waiter.key, priority)
+                waiter.event.set()
+                granted = True
+                break
+
+    def _next_waiter_locked(self, lane):
+        # Head of every flow that is below its own limit; the smallest start tag goes first
+        best = None
+        for key, flow in lane.flows.items():
+            if not flow.waiters:
+                continue
+            head = flow.waiters[0]
+            if self.active.get(key, 0) >= head.limit:
+                continue
+            if best is None or (head.start_tag, head.enqueued_at) < (best.start_tag, best.enqueued_at):
+                best = head
+        return best
+
+    def _prune_locked(self, priority, key):
+        # Forget idle flows whose tag carries no credit or debt against the others
+        lane = self._lanes[priority]
+        flow = lane.flows.get(key)
+        if flow and not flow.waiters and key not in self.active and flow.last_finish <= lane.virtual_time:
+            del lane.flows[key]
+
+    def set_capacity(self, capacity):
+        """Change the number of slots; running requests above a lowered capacity finish normally"""
+        with self._lock:
+            self.capacity = max(1, capacity)
+            self._grant_locked()
+
+    def is_saturated(self):
+        """True when every slot is taken or requests are waiting"""
+        with self._lock:
+            return self.in_flight >= self.capacity or self.queue_depth > 0
+
+    def slot(self, **kwargs):
+        """Context manager holding a slot for the duration of the block"""
+        return _AdmissionSlot(self, kwargs)
+
+    def _retry_after_locked(self, flow=None, limit=None):
+        # Time for the queue ahead (plus this request) to drain through the slots
+        avg_service = self._avg_service if self._avg_service is not None else 1.0
+        seconds = (self.queue_depth + 1) * avg_service / max(1, self.capacity)
+        if flow is not None and limit:
+            seconds = max(seconds, (len(flow.waiters) + 1) * avg_service / limit)
+        return max(1, int(math.ceil(seconds)))
+
+    def retry_after(self):
+        with self._lock:
+            return self._retry_after_locked()
+
+    def stats(self):
+        with self._lock:
+            now = time.monotonic()
+            oldest = None
+            keys = {}
+            classes = {}
+            for priority, lane in self._lanes.items():
+                lane_oldest = min((flow.waiters[0].enqueued_at for flow in lane.flows.values() if flow.waiters),
+                                  default=None)
+                if lane_oldest is not None and (oldest is None or lane_oldest < oldest):
+                    oldest = lane_oldest
+                for key, flow in lane.flows.items():
+                    if flow.waiters:
+                        keys.setdefault(str(key), {'in_flight': 0, 'queued': 0})['queued'] += len(flow.waiters)
+                classes[priority] = {
+                    'reserved': lane.reserved,
+                    'in_flight': lane.in_flight,
+                    'queued': lane.queued,
+                    'oldest_wait': round(now - lane_oldest, 3) if lane_oldest is not None else 0,
+                    'admitted': lane.admitted,
+                    'rejected': lane.rejected,
+                    'timed_out': lane.timed_out,
+                    'wait_time': lane.wait_times.stats(),
+                    'service_time': lane.service_times.stats()
+                }
+            for key, count in self.active.items():
+                keys.setdefault(str(key), {'in_flight': 0, 'queued': 0})['in_flight'] = count
+
+            stats = {
+                'capacity': self.capacity,
+                'in_flight': self.in_flight,
+                'queue_depth': self.queue_depth,
+                'background_queued': self.background_depth,
+                'max_queue': self.max_queue,
+                'max_queue_per_key': self.max_queue_per_key,
+                'max_wait': self.max_wait,
+                'oldest_wait': round(now - oldest, 3) if oldest is not None else 0,
+                'admitted': self.admitted,
+                'rejected': self.rejected,
+                'timed_out': self.timed_out,
+                'avg_service_time': round(self._avg_service, 3) if self._avg_service is not None else None,
+                'retry_after': self._retry_after_locked(),
+                'classes': classes,
+                'keys': keys
+            }
+        stats['wait_time'] = self.wait_times.stats()
+        stats['service_time'] = self.service_times.stats()
+        return stats
+
+class _AdmissionSlot:
+    def __init__(self, admission, kwargs):
+        self.admission = admission
+        self.kwargs = kwargs
+        self.ticket = None
+
+    def __enter__(self):
+        self.ticket = self.admission.acquire(**self.kwargs)
+        return self.ticket
+
+    def __exit__(self, exc_type, exc, tb):
+        self.admission.release(self.ticket)
+        return False
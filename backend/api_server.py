@@ -1,77 +1,320 @@
 from flask import Flask, request, jsonify, render_template, session, redirect, url_for, flash, send_file
 from flask_cors import CORS
+from werkzeug.serving import is_running_from_reloader
+from werkzeug.exceptions import HTTPException
 import os
-import base64
-import random
 import time
 import requests
-import ffmpeg
 import sqlite3
 from mutagen.mp3 import MP3
+from mutagen import File as MutagenFile
 from requests.adapters import HTTPAdapter
-from urllib3.util.retry import Retry
 from functools import lru_cache
 import jwt
 from datetime import datetime, timedelta
 from database import DatabaseManager
+from audio_cache import AudioCache, link_or_copy
 import schedule
 import threading
 from collections import defaultdict
-import time
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED, TimeoutError as FutureTimeoutError
+from latency_tracker import LatencyTracker
+from key_scheduler import KeyScheduler
+from key_pool import GeminiKeyPool
+from audio_pipeline import (GeminiAudioDecoder, StreamingEncoder, PcmBuffer, AudioStream, AudioEncodeError,
+                            WavWriter, TeeSink,
+                            OUTPUT_FORMATS, SUPPORTED_SAMPLE_RATES, OPUS_SAMPLE_RATES,
+                            PCM_SAMPLE_RATE, PCM_CHANNELS, pcm_sample_count, pcm_duration, pcm_silence)
+from text_chunker import split_text
+from audio_encoders import EncoderManager, ENCODER_BACKENDS, run_benchmark
+from job_queue import VoiceJobQueue, QueueFullError
+from admission import AdmissionQueue, AdmissionRejected, PRIORITY_CLASSES
+from concurrency_limit import AdaptiveConcurrencyLimit
+from deadline import Deadline, DeadlineExceeded, deadline_scope
+from retry_budget import RetryBudget, BudgetedRetry
+from session_pool import SessionPool
+from output_janitor import OutputJanitor
+from output_store import OutputStore
+from voice_catalog import VoiceCatalog
+from proxy_pool import ProxyPool, parse_proxy_list, mask_proxy
+from single_flight import SingleFlight, CoalesceTimeout
+import secrets
+import socket
+import multiprocessing
+import json
+import hashlib
 
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
 VOICE_OUTPUT_DIR = os.path.join(BASE_DIR, "voices")
 
-# Rate limiting: Track active requests per API key
-active_requests = defaultdict(int)
-request_lock = threading.Lock()
-
-# Global rate limiting: Max 5 concurrent requests
-MAX_CONCURRENT_REQUESTS = 5
-global_semaphore = threading.Semaphore(MAX_CONCURRENT_REQUESTS)
+# Global rate limiting: an adaptive number of concurrent requests (see below).
+# Requests beyond that wait in a bounded admission queue instead of failing straight away; each API key
+# is capped at its api_keys.max_concurrent slots and free slots are shared
+# between keys by weighted fair queuing (api_keys.queue_weight). Each key has
+# a priority class (api_keys.priority, high/normal/low) with its own queue;
+# higher classes are served first and requests may ask for a lower class
+INITIAL_CONCURRENT_REQUESTS = 5
+MIN_CONCURRENT_REQUESTS = 2
+MAX_CONCURRENT_REQUESTS = 20  # Upper bound; thread pools are sized for it
+ADMISSION_MAX_QUEUE = 50  # Requests allowed to wait for a slot before new ones are rejected
+ADMISSION_MAX_QUEUE_PER_KEY = 10  # Requests one API key may have waiting
+ADMISSION_MAX_WAIT = 30  # Seconds a request waits for a slot before giving up
+PRIORITY_RESERVED_SLOTS = {'high': 1, 'normal': 0, 'low': 0}  # Slots only that class may use
+admission_queue = AdmissionQueue(INITIAL_CONCURRENT_REQUESTS, max_queue=ADMISSION_MAX_QUEUE,
+                                 max_wait=ADMISSION_MAX_WAIT, max_queue_per_key=ADMISSION_MAX_QUEUE_PER_KEY,
+                                 reserved=PRIORITY_RESERVED_SLOTS)
+
+# Adaptive concurrency (AIMD): every Gemini call reports its outcome. The
+# admission queue's slot count grows by one while latency stays near its
+# baseline and slots are busy, and is cut on 5xx/timeouts or latency spikes,
+# staying within MIN/MAX_CONCURRENT_REQUESTS. A 429 is usually one key's
+# quota, which the key scheduler's cooldown handles, so it only cuts the limit
+# once at least CONCURRENCY_THROTTLED_KEY_FRACTION of the keys are cooling down
+CONCURRENCY_DECREASE_FACTOR = 0.5
+CONCURRENCY_THROTTLED_KEY_FRACTION = 0.5
+CONCURRENCY_LATENCY_TOLERANCE = 2.0  # Spike when recent latency exceeds baseline by this factor
+CONCURRENCY_DECREASE_COOLDOWN = 5  # Seconds between two cuts
+concurrency_limit = AdaptiveConcurrencyLimit(INITIAL_CONCURRENT_REQUESTS, MIN_CONCURRENT_REQUESTS,
+                                             MAX_CONCURRENT_REQUESTS, on_change=admission_queue.set_capacity,
+                                             decrease_factor=CONCURRENCY_DECREASE_FACTOR,
+                                             latency_tolerance=CONCURRENCY_LATENCY_TOLERANCE,
+                                             cooldown=CONCURRENCY_DECREASE_COOLDOWN)
 
 app = Flask(__name__)
 app.secret_key = 'your-secret-key-change-in-production'
 CORS(app)
 
-# Initialize database
-db = DatabaseManager()
+# Database; tables are created and migrated by init_app()
+db = DatabaseManager(init=False)
 
 # Configuration
 UPLOAD_FOLDER = 'uploads'
 OUTPUT_FOLDER = 'outputs'
 WED_EXTENSIONS = {'mp3', 'wav', 'ogg'}
 
-# Ensure directories exist
-os.makedirs(UPLOAD_FOLDER, exist_ok=True)
-os.makedirs(OUTPUT_FOLDER, exist_ok=True)
+# Audio downloads carry a content-hash ETag and support conditional and Range
+# requests. Output files never change once written, so clients may cache them
+# for a year; voice samples can be replaced and are revalidated daily
+OUTPUT_CACHE_MAX_AGE = 365 * 24 * 3600
+VOICE_SAMPLE_CACHE_MAX_AGE = 24 * 3600
+USE_X_SENDFILE = False  # True when a fronting Apache (mod_xsendfile) or lighttpd should send the files
+app.config['USE_X_SENDFILE'] = USE_X_SENDFILE
+
+# Generated audio is written to a temp file and renamed into a content-addressed,
+# sharded layout (outputs/ab/cd/abcd....mp3); the file name is the download id
+output_store = OutputStore(OUTPUT_FOLDER)
+
+# Gemini TTS configuration
+GEMINI_TTS_MODEL = "gemini-2.5-flash-preview-tts"
+AUDIO_OUTPUT_SETTINGS = {'format': 'mp3', 'sample_rate': 24000, 'channels': 1}
+
+# Output format negotiation: clients may ask for format, bitrate (kbps) and
+# sample_rate. The synthesized PCM is kept once in the audio cache as a
+# canonical WAV and other formats are transcoded from it and cached as well.
+BITRATE_RANGE = (8, 320)
+STORE_CANONICAL_AUDIO = True
+CANONICAL_AUDIO_SETTINGS = {'format': 'pcm', 'sample_rate': PCM_SAMPLE_RATE, 'channels': PCM_CHANNELS}
+
+# Encoder backend: 'ffmpeg' (one process per file), 'inprocess' (lameenc in the
+# request thread) or 'pool' (long-lived lameenc worker processes). Output the
+# chosen backend can't produce falls back to ffmpeg, and so does everything
+# when lameenc is not installed. Compare them with `python audio_encoders.py`
+# or POST /api/admin/encoders/benchmark.
+ENCODER_BACKEND = 'pool'
+ENCODER_MAX_PROCESSES = max((os.cpu_count() or 1) * 2, MAX_CONCURRENT_REQUESTS)  # ffmpeg processes at once
+ENCODER_POOL_WORKERS = os.cpu_count() or 1
+encoder_manager = EncoderManager(ENCODER_BACKEND, max_ffmpeg_processes=ENCODER_MAX_PROCESSES,
+                                 pool_workers=ENCODER_POOL_WORKERS)
+encoder_benchmark = {'status': 'idle'}  # Last benchmark started from the admin API
+encoder_benchmark_lock = threading.Lock()
+
+GEMINI_REQUEST_TIMEOUT = (10, 120)  # (connect, read) seconds
+STREAM_CHUNK_SIZE = 64 * 1024  # Response bytes decoded and piped to the encoder at a time
+DURATION_FROM_PCM = True  # Exact duration from decoded PCM length instead of re-parsing the MP3
+
+# Hedged requests: when the first key is slower than the observed latency
+# percentile, try the next key in parallel and keep whichever answers first
+HEDGE_ENABLED = True
+HEDGE_LATENCY_PERCENTILE = 0.95
+HEDGE_DEFAULT_DELAY = 8.0  # Used until enough latency samples are collected
+HEDGE_MIN_DELAY = 2.0
+HEDGE_MAX_EXTRA_CALLS = 2  # Max extra parallel upstream calls per request, shared by all its chunks
+gemini_latency = LatencyTracker()
+
+# Long texts are split at sentence boundaries and the chunks synthesized in
+# parallel on different keys, then joined in order with a short silence
+CHUNKING_ENABLED = True
+CHUNK_MAX_CHARS = 400  # Default chunk size; requests may override with chunk_size
+CHUNK_SIZE_RANGE = (100, 2000)
+CHUNK_SILENCE_MS = 250
+CHUNK_MAX_PARALLEL = 4  # Max chunks of one request synthesized at the same time
+GEMINI_MAX_PARALLEL_CALLS = MAX_CONCURRENT_REQUESTS * (CHUNK_MAX_PARALLEL + HEDGE_MAX_EXTRA_CALLS)
+chunk_executor = ThreadPoolExecutor(max_workers=MAX_CONCURRENT_REQUESTS * CHUNK_MAX_PARALLEL,
+                                    thread_name_prefix='chunk')
+hedge_executor = ThreadPoolExecutor(max_workers=GEMINI_MAX_PARALLEL_CALLS, thread_name_prefix='gemini')
+
+# Streaming voice creation: encoded audio is sent as soon as the first chunk
+# is ready while the file is persisted to OUTPUT_FOLDER in the background
+STREAM_FIRST_AUDIO_TIMEOUT = 120  # Seconds to wait for the first audio bytes before giving up
+live_streams = {}  # filename -> AudioStream for voices still being generated
+live_streams_lock = threading.Lock()
+
+# Request coalescing: identical requests (same audio cache key) arriving while
+# one is being synthesized wait for that result instead of calling Gemini
+# again; streaming duplicates follow the same live stream. Gemini usage is
+# logged once; COALESCE_BILL_FOLLOWERS decides whether every caller is still
+# billed in its own usage log
+COALESCE_ENABLED = True
+COALESCE_BILL_FOLLOWERS = True
+voice_flights = SingleFlight()
+coalesced_streams = {}  # cache key -> {'filename', 'stream', 'followers'} of streams in progress
+coalesced_stream_followers = 0
+
+# Asynchronous voice jobs: persisted in the voice_jobs table and processed by
+# a bounded worker pool that waits for an admission slot without a time limit
+VOICE_JOB_WORKERS = MAX_CONCURRENT_REQUESTS
+VOICE_JOB_MAX_QUEUED = 500
+VOICE_JOB_MAX_WAIT = 30  # Longest long-poll on /api/voice/jobs/<id>?wait=N, in seconds
+VOICE_JOB_RETENTION_DAYS = 7
+# Several server processes may share the voice_jobs table: a worker claims a
+# job atomically before running it and sends heartbeats while it runs; jobs
+# whose process stopped sending them are requeued and picked up by the others
+VOICE_JOB_HEARTBEAT_INTERVAL = 30  # Seconds
+VOICE_JOB_STALE_AFTER = 300  # Seconds without heartbeat before a running job is requeued
+voice_job_worker_id = None  # host:pid:random, set when the workers start
+voice_jobs = VoiceJobQueue(lambda job_id: run_voice_job(job_id), workers=VOICE_JOB_WORKERS,
+                           max_queued=VOICE_JOB_MAX_QUEUED)
+voice_jobs_started = False
+voice_jobs_lock = threading.Lock()
+
+# Batch voice creation: one validation and quota reservation for all rows,
+# rows synthesized in parallel and results streamed back as NDJSON lines
+BATCH_MAX_ROWS = 500
+BATCH_MAX_PARALLEL = MAX_CONCURRENT_REQUESTS  # Rows of one batch in flight at a time
+batch_executor = ThreadPoolExecutor(max_workers=MAX_CONCURRENT_REQUESTS * 2, thread_name_prefix='batch')
+quota_reservations = defaultdict(int)  # api key id -> requests reserved by running batches
+quota_reservations_lock = threading.Lock()
+batch_admission_lock = threading.Lock()
+
+# In-memory Gemini key pool, reloaded only when the admin_settings version stamp changes
+gemini_key_pool = GeminiKeyPool(db)
+
+# Health-scored Gemini key ordering (latency, errors, 429 cooldowns, remaining budget)
+key_scheduler = KeyScheduler(budget_loader=db.get_gemini_key_budgets)
+
+# Audio cache: identical (text, voice, model, output) requests are served from disk
+AUDIO_CACHE_DIR = os.path.join(OUTPUT_FOLDER, 'cache')
+AUDIO_CACHE_MAX_BYTES = 2 * 1024 * 1024 * 1024  # 2 GB
+AUDIO_CACHE_TTL = 30 * 24 * 3600  # 30 days
+audio_cache = AudioCache(AUDIO_CACHE_DIR, max_bytes=AUDIO_CACHE_MAX_BYTES, ttl_seconds=AUDIO_CACHE_TTL, load=False)
+
+# Output retention: generated files not downloaded for OUTPUT_MAX_AGE are
+# removed, then the least recently downloaded ones while OUTPUT_FOLDER holds
+# more than OUTPUT_MAX_BYTES; temp files left by failed requests go after
+# OUTPUT_ORPHAN_GRACE. The audio cache keeps its own limits and is skipped
+OUTPUT_MAX_BYTES = 5 * 1024 * 1024 * 1024  # 5 GB
+OUTPUT_MAX_AGE = 7 * 24 * 3600  # 7 days since the last download
+OUTPUT_ORPHAN_GRACE = 3600  # Seconds before a temp file counts as orphaned
+OUTPUT_MIN_AGE = 600  # Files younger than this are never evicted
+OUTPUT_JANITOR_INTERVAL = 15  # Minutes
+output_janitor = OutputJanitor(OUTPUT_FOLDER, max_bytes=OUTPUT_MAX_BYTES, max_age=OUTPUT_MAX_AGE,
+                               orphan_grace=OUTPUT_ORPHAN_GRACE, min_age=OUTPUT_MIN_AGE,
+                               exclude_dirs=[AUDIO_CACHE_DIR])
+
+# Voice catalog for /api/voice/list; sample metadata is rebuilt only when
+# VOICE_OUTPUT_DIR changes and the JSON is served with an ETag
+VOICES = [
+    {"name": "Voice 1 - Alpha", "code": "achernar"},
+    {"name": "Voice 2 - Beta", "code": "achird"},
+    {"name": "Voice 3 - Gamma", "code": "algenib"},
+    {"name": "Voice 4 - Delta", "code": "algieba"},
+    {"name": "Voice 5 - Epsilon", "code": "alnilam"},
+    {"name": "Voice 6 - Zeta", "code": "aoede"},
+    {"name": "Voice 7 - Eta", "code": "autonoe"},
+    {"name": "Voice 8 - Theta", "code": "callirrhoe"},
+    {"name": "Voice 9 - Iota", "code": "charon"},
+    {"name": "Voice 10 - Kappa", "code": "despina"},
+    {"name": "Voice 11 - Lambda", "code": "enceladus"},
+    {"name": "Voice 12 - Mu", "code": "erinome"},
+    {"name": "Voice 13 - Nu", "code": "fenrir"},
+    {"name": "Voice 14 - Xi", "code": "gacrux"},
+    {"name": "Voice 15 - Omicron", "code": "iapetus"},
+    {"name": "Voice 16 - Pi", "code": "kore"},
+    {"name": "Voice 17 - Rho", "code": "laomedeia"},
+    {"name": "Voice 18 - Sigma", "code": "leda"},
+    {"name": "Voice 19 - Tau", "code": "orus"},
+    {"name": "Voice 20 - Upsilon", "code": "puck"},
+    {"name": "Voice 21 - Phi", "code": "pulcherrima"},
+    {"name": "Voice 22 - Chi", "code": "rasalgethi"},
+    {"name": "Voice 23 - Psi", "code": "sadachbia"},
+    {"name": "Voice 24 - Omega", "code": "sadaltager"},
+    {"name": "Voice 25 - Alpha Prime", "code": "schedar"},
+    {"name": "Voice 26 - Beta Prime", "code": "sulafat"},
+    {"name": "Voice 27 - Gamma Prime", "code": "umbriel"},
+    {"name": "Voice 28 - Delta Prime", "code": "vindemiatrix"},
+    {"name": "Voice 29 - Epsilon Prime", "code": "zephyr"},
+    {"name": "Voice 30 - Zeta Prime", "code": "zubenelgenubi"},
+]
+VOICE_CATALOG_MAX_AGE = 300  # Seconds clients may reuse the list without revalidating
+
+# Voice samples are preloaded into memory together with a low-bitrate preview
+# variant (?variant=preview); versioned sample URLs (?v=<hash>) are immutable
+VOICE_PREVIEW_SETTINGS = {'format': 'mp3', 'sample_rate': 16000, 'channels': 1, 'bitrate': 16}
+voice_catalog = VoiceCatalog(VOICES, VOICE_OUTPUT_DIR,
+                             transcode=lambda source, output: encoder_manager.transcode(source, output,
+                                                                                        VOICE_PREVIEW_SETTINGS))
 
 # JWT Configuration
 JWT_SECRET = 'jwt-secret-key-change-in-production'
 JWT_ALGORITHM = 'HS256'
 JWT_EXPIRATION_DELTA = timedelta(hours=24)
 
-# Performance optimizations
-_session_cache = {}
-_session_cache_timestamp = {}
-SESSION_CACHE_TTL = 600  # Cache sessions for 10 minutes
-
-def create_session_with_retry():
+# Request deadlines: every voice request gets a deadline (from the
+# X-Request-Timeout header in seconds, or the default) that bounds the wait
+# for a slot, every Gemini key attempt and retry, and the wait for an encoder
+REQUEST_DEADLINE_HEADER = 'X-Request-Timeout'
+REQUEST_DEFAULT_DEADLINE = 120  # Seconds
+REQUEST_MAX_DEADLINE = 600
+
+# Retry budget: retries (adapter retries, falling back to another key, hedged
+# calls) may add at most this fraction on top of original upstream requests
+RETRY_BUDGET_RATIO = 0.2
+RETRY_BUDGET_MIN_PER_SECOND = 1  # Always allowed, so a quiet server can still retry
+RETRY_BUDGET_WINDOW = 10  # Seconds
+retry_budget = RetryBudget(ratio=RETRY_BUDGET_RATIO, min_per_second=RETRY_BUDGET_MIN_PER_SECOND,
+                           window=RETRY_BUDGET_WINDOW)
+
+# HTTP sessions: one per proxy, kept in a thread-safe LRU that closes the
+# connection pools of evicted sessions. Each pool keeps enough connections
+# for every Gemini call the concurrency limit allows at its upper bound
+SESSION_POOL_MAX_SESSIONS = 32
+SESSION_IDLE_TTL = 600  # Close sessions unused for 10 minutes
+HTTP_POOL_MAXSIZE = GEMINI_MAX_PARALLEL_CALLS
+
+def create_session_with_retry(proxy_dict=None):
     """Create requests session with retry strategy and connection pooling"""
     session = requests.Session()
-    
-    # Configure retry strategy
-    retry_strategy = Retry(
+    if proxy_dict:
+        session.proxies.update(proxy_dict)
+    
+    # Configure retry strategy; retries also stop when the retry budget is
+    # spent or the backoff would pass the request deadline, and the last
+    # response is then returned so 5xx are handled like any other. A 429 is
+    # returned at once so the key scheduler cools the key down and the next
+    # attempt (or hedge) uses another key instead of retrying the same one
+    retry_strategy = BudgetedRetry(
         total=3,
         backoff_factor=1,
-        status_forcelist=[429, 500, 502, 503, 504],
+        status_forcelist=[500, 502, 503, 504],
+        raise_on_status=False,
+        budget=retry_budget
     )
     
     # Configure adapter with connection pooling
     adapter = HTTPAdapter(
         max_retries=retry_strategy,
         pool_connections=10,
-        pool_maxsize=20
+        pool_maxsize=HTTP_POOL_MAXSIZE
     )
     
     session.mount("http://", adapter)
@@ -79,27 +322,71 @@ def create_session_with_retry():
     
     return session
 
+session_pool = SessionPool(create_session_with_retry, max_sessions=SESSION_POOL_MAX_SESSIONS,
+                           idle_ttl=SESSION_IDLE_TTL)
+
 def get_session(proxy_dict=None):
-    """Get or create session with caching"""
-    cache_key = str(proxy_dict) if proxy_dict else "default"
-    current_time = time.time()
-    
-    # Check if cache is valid
-    if (cache_key in _session_cache and 
-        current_time - _session_cache_timestamp.get(cache_key, 0) < SESSION_CACHE_TTL):
-        return _session_cache[cache_key]
-    
-    # Create new session
-    session = create_session_with_retry()
-    _session_cache[cache_key] = session
-    _session_cache_timestamp[cache_key] = current_time
-    
-    return session
+    """Get the pooled session for a proxy (or direct connections)"""
+    return session_pool.get(proxy_dict)
+
+# Outbound proxies for Gemini calls, read from PROXY_FILE and from the admin
+# panel (admin_settings 'proxy_list'), in the same line formats as the tool's
+# proxies.txt. Each Gemini key is pinned to one proxy; proxies failing
+# PROXY_EJECT_AFTER times in a row are ejected for a growing cooldown, and
+# without any usable proxy calls go direct
+PROXY_FILE = os.path.join(BASE_DIR, 'proxies.txt')
+PROXY_FILE_TYPE = 'http'  # Scheme for ip:port lines in PROXY_FILE
+PROXY_EJECT_AFTER = 3
+PROXY_EJECT_COOLDOWN = 60  # Seconds, doubled on every further ejection
+PROXY_MAX_EJECT_COOLDOWN = 30 * 60
+PROXY_ALLOW_DIRECT = True
+PROXY_PIN_KEYS = True
+PROXY_HEALTH_CHECK_URL = 'https://generativelanguage.googleapis.com/'  # Any HTTP answer means the proxy works
+PROXY_HEALTH_CHECK_TIMEOUT = 10
+PROXY_HEALTH_CHECK_INTERVAL = 5  # Minutes
+proxy_pool = ProxyPool(eject_after=PROXY_EJECT_AFTER, cooldown=PROXY_EJECT_COOLDOWN,
+                       max_cooldown=PROXY_MAX_EJECT_COOLDOWN, allow_direct=PROXY_ALLOW_DIRECT,
+                       pin_keys=PROXY_PIN_KEYS)
+
+def load_proxy_sources():
+    """(Re)load proxies from PROXY_FILE and the admin panel list"""
+    file_proxies = []
+    if os.path.exists(PROXY_FILE):
+        try:
+            with open(PROXY_FILE, 'r', encoding='utf-8') as f:
+                file_proxies, invalid = parse_proxy_list(f.read(), PROXY_FILE_TYPE)
+            if invalid:
+                print(f"[PROXY] Ignored {len(invalid)} invalid lines in {PROXY_FILE}")
+        except Exception as e:
+            print(f"[PROXY] Failed to read {PROXY_FILE}: {e}")
+            file_proxies = proxy_pool.urls('file')
+    proxy_pool.set_source('file', file_proxies)
+    admin_proxies = (db.get_setting('proxy_list') or '').split()
+    return proxy_pool.set_source('admin', admin_proxies)
+
+def probe_proxy(proxy_url):
+    """Round trip through a proxy to the Gemini host, in seconds"""
+    started = time.time()
+    response = requests.get(PROXY_HEALTH_CHECK_URL, proxies=proxy_pool.proxy_dict(proxy_url),
+                            timeout=PROXY_HEALTH_CHECK_TIMEOUT)
+    response.close()
+    return time.time() - started
+
+def check_proxies():
+    """Reload proxy sources and health check them"""
+    try:
+        if load_proxy_sources():
+            healthy, failed = proxy_pool.check_health(probe_proxy)
+            print(f"[PROXY] Health check: {healthy} healthy, {failed} failed")
+    except Exception as e:
+        print(f"[PROXY] Health check failed: {e}")
 
 def get_audio_duration(file_path):
     """Get audio duration with better error handling"""
     try:
-        return round(MP3(file_path).info.length, 2)
+        if file_path.lower().endswith('.mp3'):
+            return round(MP3(file_path).info.length, 2)
+        return round(MutagenFile(file_path).info.length, 2)
     except Exception as e:
         print(f"Error getting audio duration: {e}")
         return 0
@@ -173,96 +460,467 @@ def log_failed_gemini_key(api_key, error_message):
     except Exception as e:
         print(f"[ERROR] Failed to log failed key attempt: {e}")
 
-def gemini_tts_request(text, voice_name, api_key_list):
-    def task(api_key):
-        try:
-            url = "https://generativelanguage.googleapis.com/v1beta/models/gemini-2.5-flash-preview-tts:generateContent"
-            headers = {
-                "x-goog-api-key": api_key,
-                "Content-Type": "application/json"
-            }
-            data = {
-                "contents": [{"parts": [{"text": text}]}],
-                "generationConfig": {
-                    "responseModalities": ["AUDIO"],
-                    "speechConfig": {
-                        "voiceConfig": {
-                            "prebuiltVoiceConfig": {
-                                "voiceName": voice_name
-                            }
-                        }
+class HedgeCancelled(Exception):
+    """Raised inside a losing hedged attempt once another key has won"""
+    pass
+
+class GeminiQuotaError(Exception):
+    """Raised when Gemini answers 429 for a key"""
+    pass
+
+class GeminiServerError(Exception):
+    """Raised when Gemini answers with a 5xx status"""
+    def __init__(self, message, status):
+        super().__init__(message)
+        self.status = status
+
+class GeminiProxyError(Exception):
+    """Raised when the outbound proxy, not Gemini, failed the request"""
+    pass
+
+class StreamInterrupted(Exception):
+    """Raised when an attempt fails after its audio already reached a live listener,
+    so another key's audio can't be appended and the stream has to fail"""
+    pass
+
+PROXY_GATEWAY_STATUSES = (502, 503, 504)
+
+def is_proxy_error_response(response):
+    """Whether a response through a proxy was produced by the proxy itself:
+    407, or a gateway error that isn't one of Gemini's JSON error bodies"""
+    if response.status_code == 407:
+        return True
+    return (response.status_code in PROXY_GATEWAY_STATUSES
+            and 'json' not in response.headers.get('Content-Type', ''))
+
+class AudioRace:
+    """First attempt to produce audio claims the encoder; the others stand down"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.winner = None
+        self.closed = False
+
+    def claim(self, api_key):
+        with self._lock:
+            if self.winner is None and not self.closed:
+                self.winner = api_key
+            return self.winner == api_key
+
+    def release(self, api_key):
+        with self._lock:
+            if self.winner == api_key:
+                self.winner = None
+
+    def lost(self, api_key):
+        return self.closed or (self.winner is not None and self.winner != api_key)
+
+    def close(self):
+        """Stop all remaining attempts once the request has its result (or gave up)"""
+        with self._lock:
+            self.closed = True
+
+class HedgeBudget:
+    """Extra (hedged) Gemini calls one request may still start, shared by all its chunks"""
+
+    def __init__(self, max_calls=HEDGE_MAX_EXTRA_CALLS):
+        self._lock = threading.Lock()
+        self.remaining = max_calls
+
+    def try_spend(self):
+        with self._lock:
+            if self.remaining <= 0:
+                return False
+            self.remaining -= 1
+            return True
+
+    def refund(self):
+        with self._lock:
+            self.remaining += 1
+
+# Errors raised before Gemini answers. Through a proxy all of them but a read
+# timeout are the proxy's fault; InvalidSchema/InvalidProxyURL mean the proxy URL
+# cannot be used at all (e.g. socks without PySocks)
+PROXY_TRANSPORT_ERRORS = (requests.exceptions.ConnectionError, requests.exceptions.Timeout,
+                          requests.exceptions.InvalidSchema, requests.exceptions.InvalidProxyURL)
+
+def post_gemini_tts(text, voice_name, api_key, deadline=None):
+    """Send the Gemini TTS request and return the streamed response once status is OK"""
+    url = f"https://generativelanguage.googleapis.com/v1beta/models/{GEMINI_TTS_MODEL}:generateContent"
+    headers = {
+        "x-goog-api-key": api_key,
+        "Content-Type": "application/json"
+    }
+    data = {
+        "contents": [{"parts": [{"text": text}]}],
+        "generationConfig": {
+            "responseModalities": ["AUDIO"],
+            "speechConfig": {
+                "voiceConfig": {
+                    "prebuiltVoiceConfig": {
+                        "voiceName": voice_name
                     }
-                },
-                "model": "gemini-2.5-flash-preview-tts",
+                }
             }
+        },
+        "model": GEMINI_TTS_MODEL,
+    }
 
-            session = get_session()
-            response = session.post(url, headers=headers, json=data)
-            
-            if response.status_code == 429:
-                # Quota exceeded - just raise exception without disabling key
-                print(f"[QUOTA] Key {api_key[:20]} exceeded quota")
-                raise Exception(f"Quota exceeded for key {api_key[:20]}")
-            
-            if response.status_code != 200:
-                print(f"[ERROR] Key {api_key[:20]} failed with status {response.status_code}: {response.text[:200]}")
-                raise Exception(f"HTTP Error {response.status_code} from Gemini: {response.text[:300]}")
+    timeout = GEMINI_REQUEST_TIMEOUT
+    if deadline is not None:
+        deadline.check('Gemini request')
+        timeout = tuple(deadline.cap(part) for part in GEMINI_REQUEST_TIMEOUT)
 
-            res_json = response.json()
-            
-            # Check if response has valid audio data
-            if 'candidates' not in res_json or not res_json['candidates']:
-                print(f"[ERROR] Key {api_key[:20]} returned invalid response structure")
-                raise Exception("Invalid response structure from Gemini")
-            
-            candidate = res_json['candidates'][0]
-            if 'content' not in candidate or 'parts' not in candidate['content']:
-                print(f"[ERROR] Key {api_key[:20]} returned invalid content structure")
-                raise Exception("Invalid content structure from Gemini")
-            
-            audio_data = candidate['content']['parts'][0]['inlineData']['data']
-            
-            if not audio_data:
-                print(f"[ERROR] Key {api_key[:20]} returned empty audio data")
-                raise Exception("Empty audio data from Gemini")
+    proxy = proxy_pool.choose(api_key)
+    session = get_session(proxy_pool.proxy_dict(proxy))
+    try:
+        response = session.post(url, headers=headers, json=data, timeout=timeout, stream=True)
+    except PROXY_TRANSPORT_ERRORS as e:
+        # Timeouts cut short by the deadline are not the proxy's fault
+        if deadline is None or not deadline.expired():
+            proxy_pool.report_failure(proxy, type(e).__name__)
+            if proxy and not isinstance(e, requests.exceptions.ReadTimeout):
+                # Never reached Gemini (proxy refused, broken tunnel, connect timeout):
+                # not a sign of upstream overload
+                raise GeminiProxyError(f"Proxy {mask_proxy(proxy)} failed: {e}") from e
+        raise
+
+    if proxy and is_proxy_error_response(response):
+        response.close()
+        proxy_pool.report_failure(proxy, f"HTTP {response.status_code}")
+        raise GeminiProxyError(f"Proxy {mask_proxy(proxy)} answered HTTP {response.status_code}")
+
+    # Any other answer from Gemini means the proxy works
+    if response.status_code != 429:
+        proxy_pool.report_success(proxy)
+
+    if response.status_code == 429:
+        proxy_pool.report_throttled(proxy)
+        response.close()
+        # Quota exceeded - just raise exception without disabling key
+        print(f"[QUOTA] Key {api_key[:20]} exceeded quota")
+        raise GeminiQuotaError(f"Quota exceeded for key {api_key[:20]}")
+
+    if response.status_code != 200:
+        error_text = response.text
+        response.close()
+        print(f"[ERROR] Key {api_key[:20]} failed with status {response.status_code}: {error_text[:200]}")
+        if response.status_code >= 500:
+            raise GeminiServerError(f"HTTP Error {response.status_code} from Gemini: {error_text[:300]}",
+                                    response.status_code)
+        raise Exception(f"HTTP Error {response.status_code} from Gemini: {error_text[:300]}")
+
+    return response
+
+def stream_gemini_audio(text, voice_name, api_key, race, open_sink, deadline=None, output_started=None):
+    """Stream Gemini audio for one key straight into a PCM sink.
+
+    The base64 payload is decoded incrementally, so no temp PCM file is
+    written and only one response chunk is held in memory at a time.
+    open_sink() is called only once this attempt has won the race and must
+    return an object with write(pcm)/abort(), e.g. a StreamingEncoder.
+    output_started() tells whether encoded audio already left the sink (live
+    streams); a failure after that raises StreamInterrupted instead of
+    handing the race to another key.
+    Returns (sink, pcm_bytes, time_to_first_audio).
+    """
+    started = time.time()
+    response = post_gemini_tts(text, voice_name, api_key, deadline)
+    sink = None
+    try:
+        decoder = GeminiAudioDecoder()
+        chunks = response.iter_content(chunk_size=STREAM_CHUNK_SIZE)
+
+        first_pcm = b''
+        for chunk in chunks:
+            if race.lost(api_key):
+                raise HedgeCancelled(f"Key {api_key[:20]} cancelled, another key won")
+            if deadline is not None:
+                deadline.check('Gemini response')
+            first_pcm = decoder.feed(chunk)
+            if first_pcm:
+                break
+        if not first_pcm:
+            decoder.finish()
+
+        first_audio_latency = time.time() - started
+        if not race.claim(api_key):
+            raise HedgeCancelled(f"Key {api_key[:20]} cancelled, another key won")
+
+        sink = open_sink()
+        sink.write(first_pcm)
+        for chunk in chunks:
+            if deadline is not None:
+                deadline.check('Gemini response')
+            sink.write(decoder.feed(chunk))
+        decoder.finish()
+
+        return sink, decoder.pcm_bytes, first_audio_latency
+    except Exception as e:
+        if sink is not None:
+            sink.abort()
+            if (output_started is not None and output_started()
+                    and not isinstance(e, (DeadlineExceeded, AudioEncodeError))):
+                # Keep the race claimed so no other attempt writes into the same stream
+                raise StreamInterrupted(f"Key {api_key[:20]} failed after audio was sent: {e}") from e
+        race.release(api_key)
+        raise
+    finally:
+        response.close()
 
-            uid = f"{int(time.time())}_{random.randint(1000,9999)}"
-            temp_pcm = os.path.join(OUTPUT_FOLDER, f"{uid}.pcm")
-            
-            with open(temp_pcm, "wb") as f:
-                f.write(base64.b64decode(audio_data))
+def synthesize_pcm(text, voice_name, api_key_list, open_sink, deadline=None, hedge_budget=None,
+                   output_started=None):
+    """Synthesize text with the first Gemini key that works, writing PCM into a sink.
 
-            mp3_file = os.path.join(OUTPUT_FOLDER, f"{uid}.mp3")
-            try:
-                ffmpeg.input(temp_pcm, f='s16le', ar='24000', ac='1') \
-                    .output(mp3_file, **{'y': None}) \
-                    .run(overwrite_output=True, quiet=True)
-                os.remove(temp_pcm)
-                duration = get_audio_duration(mp3_file)
-                
-                # Only return success if everything worked
-                print(f"[SUCCESS] Key {api_key[:20]} generated voice successfully")
-                return mp3_file, duration, api_key
-                
-            except Exception as e:
-                print(f"[ERROR] Key {api_key[:20]} failed during audio conversion: {e}")
-                raise Exception(f"Convert error or duration measurement: {e}")
+    Attempts after the first draw on the retry budget, and no attempt starts
+    or keeps running past the deadline (DeadlineExceeded). Hedged calls also
+    draw on hedge_budget, which the chunks of one request share. Once
+    output_started() is true, a failing attempt ends the request
+    (StreamInterrupted) instead of falling back to the next key.
+    Returns (sink, pcm_bytes, api_key). The caller closes the sink.
+    """
+    race = AudioRace()
 
+    def task(api_key):
+        key_scheduler.on_start(api_key)
+        try:
+            with deadline_scope(deadline):
+                sink, pcm_bytes, first_audio_latency = stream_gemini_audio(text, voice_name, api_key, race,
+                                                                           open_sink, deadline, output_started)
+            gemini_latency.record(first_audio_latency)
+            key_scheduler.on_success(api_key, first_audio_latency)
+            # Gemini answers once the whole chunk is synthesized, so compare latency per 100 characters
+            concurrency_limit.on_success(first_audio_latency * 100 / max(len(text), 100),
+                                         saturated=admission_queue.is_saturated())
+            return sink, pcm_bytes, api_key
+        except HedgeCancelled as e:
+            key_scheduler.on_cancel(api_key)
+            print(f"[HEDGE] {e}")
+            return None
+        except DeadlineExceeded:
+            key_scheduler.on_cancel(api_key)
+            raise
+        except StreamInterrupted as e:
+            key_scheduler.on_failure(api_key)
+            print(f"[STREAM] {e}")
+            log_failed_gemini_key(api_key, str(e))
+            raise
+        except GeminiProxyError as e:
+            # Neither the key's fault nor upstream overload; the next attempt may use another proxy
+            key_scheduler.on_cancel(api_key)
+            print(f"[PROXY] {e}")
+            return None
+        except AudioEncodeError as e:
+            # Encoder failures are not the key's fault and retrying another key won't help
+            key_scheduler.on_cancel(api_key)
+            print(f"[ERROR] Key {api_key[:20]} failed during audio conversion: {e}")
+            raise Exception(f"Convert error or duration measurement: {e}")
         except Exception as e:
+            if deadline is not None and deadline.expired():
+                # Timeouts cut short by the deadline are not the key's fault
+                key_scheduler.on_cancel(api_key)
+                raise DeadlineExceeded(f"Request deadline of {deadline.seconds:g}s exceeded during Gemini request")
+            if isinstance(e, GeminiQuotaError):
+                key_scheduler.on_throttled(api_key)
+                active_keys = [key for _, key in gemini_key_pool.active_keys()]
+                if key_scheduler.throttled_fraction(active_keys) >= CONCURRENCY_THROTTLED_KEY_FRACTION:
+                    concurrency_limit.on_overload('429')
+            else:
+                key_scheduler.on_failure(api_key)
+                if isinstance(e, GeminiServerError):
+                    concurrency_limit.on_overload(f'http {e.status}')
+                elif isinstance(e, (requests.exceptions.Timeout, requests.exceptions.ConnectionError)):
+                    concurrency_limit.on_overload('timeout')
             print(f"[ERROR] Key {api_key[:20]} failed: {e}")
             # Log failed attempt for debugging (but don't count as usage)
             log_failed_gemini_key(api_key, str(e))
             return None
 
-    # Try each API key
-    for i, api_key in enumerate(api_key_list):
-        print(f"[VOICE] Trying key {i+1}/{len(api_key_list)}: {api_key[:20]}")
-        result = task(api_key)
-        if result:
-            return result
+    if not HEDGE_ENABLED:
+        # Try each API key
+        for i, api_key in enumerate(api_key_list):
+            if deadline is not None:
+                deadline.check('key attempts')
+            if i == 0:
+                retry_budget.record_request()
+            elif not retry_budget.try_spend():
+                raise Exception("Retry budget exhausted, not trying more keys.")
+            print(f"[VOICE] Trying key {i+1}/{len(api_key_list)}: {api_key[:20]}")
+            result = task(api_key)
+            if result:
+                return result
+
+        raise Exception("No available keys to create voice.")
+
+    # Hedged mode: if the current attempt has not produced audio within the
+    # observed latency percentile, fire the next key in parallel; the first
+    # attempt to produce audio claims the sink and the others stand down
+    pending = {}
+    next_index = 0
+    hedging = True
+    if hedge_budget is None:
+        hedge_budget = HedgeBudget()
+
+    def launch():
+        nonlocal next_index
+        api_key = api_key_list[next_index]
+        next_index += 1
+        print(f"[VOICE] Trying key {next_index}/{len(api_key_list)}: {api_key[:20]}")
+        pending[hedge_executor.submit(task, api_key)] = api_key
+
+    try:
+        while next_index < len(api_key_list) or pending:
+            if not pending:
+                if deadline is not None:
+                    deadline.check('key attempts')
+                if next_index == 0:
+                    retry_budget.record_request()
+                elif not retry_budget.try_spend():
+                    raise Exception("Retry budget exhausted, not trying more keys.")
+                launch()
+
+            can_hedge = (hedging and hedge_budget.remaining > 0 and next_index < len(api_key_list)
+                         and race.winner is None)
+            hedge_delay = get_hedge_delay() if can_hedge else None
+            timeout = deadline.cap(hedge_delay) if deadline is not None else hedge_delay
+            done, _ = wait(list(pending), timeout=timeout, return_when=FIRST_COMPLETED)
+
+            if not done:
+                if deadline is not None:
+                    deadline.check('key attempts')
+                if race.winner is None and hedge_delay is not None:
+                    if not hedge_budget.try_spend():
+                        # Other chunks of this request used up its extra calls
+                        hedging = False
+                        continue
+                    if not retry_budget.try_spend():
+                        # No budget for extra calls right now; let the current attempt finish
+                        hedge_budget.refund()
+                        hedging = False
+                        print("[HEDGE] Retry budget exhausted, not hedging")
+                        continue
+                    print(f"[HEDGE] No audio after {hedge_delay:.2f}s, firing extra key "
+                          f"({hedge_budget.remaining} extra calls left for this request)")
+                    launch()
+                continue
+
+            for future in done:
+                pending.pop(future)
+                result = future.result()
+                if result:
+                    return result
+    finally:
+        # Losing attempts notice the closed race and stop reading their response
+        race.close()
+        for future in pending:
+            future.cancel()
 
     raise Exception("No available keys to create voice.")
 
+def measure_audio(mp3_file, pcm_bytes):
+    """Get (duration, samples) for an encoded file from its PCM length"""
+    samples = pcm_sample_count(pcm_bytes)
+    if DURATION_FROM_PCM:
+        duration = round(pcm_duration(pcm_bytes), 3)
+    else:
+        duration = get_audio_duration(mp3_file)
+    return duration, samples
+
+def close_encoder(encoder):
+    try:
+        encoder.close()
+    except AudioEncodeError as e:
+        print(f"[ERROR] Audio conversion failed: {e}")
+        raise Exception(f"Convert error or duration measurement: {e}")
+
+def gemini_tts_request(text, voice_name, api_key_list, open_encoder=StreamingEncoder, mp3_file=None,
+                       deadline=None, output_started=None):
+    """Synthesize text into an MP3 in OUTPUT_FOLDER.
+
+    Returns (mp3_file, duration, samples, usages) where usages lists the
+    (gemini_key, text_length) pairs to bill.
+    """
+    mp3_file = mp3_file or output_store.temp_path('mp3')
+    encoder, pcm_bytes, api_key = synthesize_pcm(text, voice_name, api_key_list,
+                                                 lambda: open_encoder(mp3_file), deadline,
+                                                 output_started=output_started)
+    close_encoder(encoder)
+    duration, samples = measure_audio(mp3_file, pcm_bytes)
+
+    # Only return success if everything worked
+    print(f"[SUCCESS] Key {api_key[:20]} generated voice successfully")
+    return mp3_file, duration, samples, [(api_key, len(text))]
+
+def gemini_tts_chunked(chunks, voice_name, gemini_keys_data, silence_ms=CHUNK_SILENCE_MS,
+                       open_encoder=StreamingEncoder, mp3_file=None, deadline=None):
+    """Synthesize text chunks in parallel across keys and encode them in order.
+
+    Each chunk gets its own key ordering so parallel chunks land on different
+    keys, and a failed chunk is retried on other keys without losing the rest.
+    Finished chunks are written to the encoder as soon as every earlier chunk
+    is done, separated by silence_ms of silence. All chunks share one hedge
+    budget, so a long text starts no more extra calls than a short one.
+    """
+    futures = []
+    hedge_budget = HedgeBudget()
+
+    def submit_next():
+        chunk = chunks[len(futures)]
+        futures.append(chunk_executor.submit(synthesize_pcm, chunk, voice_name,
+                                             key_scheduler.order(gemini_keys_data), PcmBuffer, deadline,
+                                             hedge_budget))
+
+    # Keep at most CHUNK_MAX_PARALLEL chunks of this request in flight
+    while len(futures) < min(len(chunks), CHUNK_MAX_PARALLEL):
+        submit_next()
+
+    mp3_file = mp3_file or output_store.temp_path('mp3')
+    silence = pcm_silence(silence_ms)
+    total_pcm_bytes = 0
+    usages = []
+    encoder = None
+    try:
+        for index in range(len(chunks)):
+            try:
+                buffer, pcm_bytes, api_key = futures[index].result(
+                    timeout=deadline.remaining() if deadline is not None else None)
+            except FutureTimeoutError:
+                raise DeadlineExceeded(f"Request deadline of {deadline.seconds:g}s exceeded during chunk synthesis")
+            if len(futures) < len(chunks):
+                submit_next()
+            if encoder is None:
+                # Opened only once audio exists so encoder slots aren't held while waiting on Gemini
+                encoder = open_encoder(mp3_file)
+            if index > 0 and silence:
+                encoder.write(silence)
+                total_pcm_bytes += len(silence)
+            encoder.write(bytes(buffer.data))
+            total_pcm_bytes += pcm_bytes
+            buffer.abort()  # Release chunk memory as soon as it is encoded
+            usages.append((api_key, len(chunks[index])))
+            print(f"[CHUNK] {index + 1}/{len(chunks)} encoded (key {api_key[:20]})")
+    except AudioEncodeError as e:
+        for future in futures:
+            future.cancel()
+        print(f"[ERROR] Audio conversion failed: {e}")
+        raise Exception(f"Convert error or duration measurement: {e}")
+    except Exception:
+        if encoder is not None:
+            encoder.abort()
+        for future in futures:
+            future.cancel()
+        raise
+
+    close_encoder(encoder)
+    duration, samples = measure_audio(mp3_file, total_pcm_bytes)
+    print(f"[SUCCESS] Generated voice from {len(chunks)} chunks using {len(set(k for k, _ in usages))} keys")
+    return mp3_file, duration, samples, usages
+
+def get_hedge_delay():
+    """Delay before firing a hedged attempt, based on observed Gemini latency"""
+    observed = gemini_latency.percentile(HEDGE_LATENCY_PERCENTILE, default=HEDGE_DEFAULT_DELAY)
+    return max(HEDGE_MIN_DELAY, observed)
+
 # API Routes
 
 @app.route('/')
@@ -404,6 +1062,438 @@ def list_api_keys():
     """List user's API keys - DISABLED"""
     return jsonify({'success': False, 'error': 'API Keys feature is disabled'}), 403
 
+class VoiceRequestError(Exception):
+    """Raised with an HTTP status when a voice request cannot be served"""
+    def __init__(self, message, status=500):
+        super().__init__(message)
+        self.status = status
+
+def log_user_usage(validation, text, voice_name, mp3_file, duration, remote_addr, user_agent):
+    """Log user usage for a generated voice file"""
+    # Log usage for API key (this will automatically increment daily/monthly usage)
+    key_id = validation.get('key_id')
+    user_id = validation.get('user_id')
+    if key_id and user_id:
+        try:
+            # Generate unique request ID to prevent duplicate processing
+            request_id = f"{key_id}_{user_id}_{int(time.time() * 1000)}_{hash(text[:50])}"
+            print(f"[DEBUG] Processing request {request_id} for key_id={key_id}, user_id={user_id}, text_length={len(text)}, voice_name={voice_name}")
+
+            db.log_usage(key_id, user_id, len(text), voice_name, duration,
+                        os.path.getsize(mp3_file), remote_addr, user_agent)
+            print(f"[DEBUG] Usage logged successfully for request {request_id}")
+        except Exception as e:
+            print(f"[ERROR] Failed to log usage for key_id={key_id}: {e}")
+            # Don't fail the request if logging fails
+
+def voice_success_response(validation, text, voice_name, mp3_file, duration, samples=None, cached=False,
+                           coalesced=False):
+    """Log user usage for a generated voice file and build the success response"""
+    filename = os.path.basename(mp3_file)
+    if not coalesced or COALESCE_BILL_FOLLOWERS:
+        log_user_usage(validation, text, voice_name, mp3_file, duration,
+                       request.remote_addr, request.headers.get('User-Agent'))
+
+    return jsonify({
+        'success': True,
+        'filename': filename,
+        'duration': duration,
+        'samples': samples,
+        'sample_rate': PCM_SAMPLE_RATE if samples is not None else None,
+        'format': os.path.splitext(filename)[1].lstrip('.'),
+        'cached': cached,
+        'coalesced': coalesced,
+        'download_url': f'/api/voice/download/{filename}'
+    })
+
+def get_chunk_settings(data):
+    """Read optional chunk_size / chunk_silence_ms overrides; returns an error string if invalid"""
+    try:
+        chunk_size = int(data.get('chunk_size') or CHUNK_MAX_CHARS)
+        chunk_silence_ms = int(data.get('chunk_silence_ms', CHUNK_SILENCE_MS))
+    except (TypeError, ValueError):
+        return 'chunk_size and chunk_silence_ms must be integers'
+    if not CHUNK_SIZE_RANGE[0] <= chunk_size <= CHUNK_SIZE_RANGE[1]:
+        return f'chunk_size must be between {CHUNK_SIZE_RANGE[0]} and {CHUNK_SIZE_RANGE[1]}'
+    if not 0 <= chunk_silence_ms <= 5000:
+        return 'chunk_silence_ms must be between 0 and 5000'
+    return {'chunk_size': chunk_size, 'chunk_silence_ms': chunk_silence_ms}
+
+def validate_voice_api_key(api_key, needed=1):
+    """Validate an API key and check it has quota left for `needed` requests.
+
+    Requests already reserved by running batches count against the quota.
+    Returns the validation dict; raises VoiceRequestError otherwise.
+    """
+    validation = db.validate_api_key(api_key)
+    if validation is None:
+        print(f"[VALIDATE] Invalid API key: {api_key[:10]}...")
+        raise VoiceRequestError('Invalid API key', 401)
+
+    if isinstance(validation, dict) and 'error' in validation:
+        print(f"[VALIDATE] API key validation failed: {validation['error']}")
+        raise VoiceRequestError(validation['error'], 403)
+
+    reserved = get_reserved_quota(validation.get('key_id'))
+    if needed + reserved > validation.get('daily_remaining', 0):
+        print(f"[VALIDATE] Not enough daily quota: needed {needed}, reserved {reserved}, remaining {validation.get('daily_remaining', 0)}")
+        raise VoiceRequestError('Daily limit exceeded', 403)
+    if needed + reserved > validation.get('monthly_remaining', 0):
+        raise VoiceRequestError('Monthly limit exceeded', 403)
+
+    print(f"[VALIDATE] API key validated successfully - Remaining: {validation.get('daily_remaining', 0)}")
+    return validation
+
+def get_output_settings(data):
+    """Read optional format / bitrate / sample_rate; returns an error string if invalid"""
+    output_format = str(data.get('format') or AUDIO_OUTPUT_SETTINGS['format']).lower()
+    if output_format not in OUTPUT_FORMATS:
+        return f"format must be one of: {', '.join(OUTPUT_FORMATS)}"
+
+    try:
+        sample_rate = int(data.get('sample_rate') or AUDIO_OUTPUT_SETTINGS['sample_rate'])
+        bitrate = int(data['bitrate']) if data.get('bitrate') else None
+    except (TypeError, ValueError):
+        return 'bitrate and sample_rate must be integers'
+
+    allowed_rates = OPUS_SAMPLE_RATES if output_format == 'opus' else SUPPORTED_SAMPLE_RATES
+    if sample_rate not in allowed_rates:
+        return f"sample_rate for {output_format} must be one of: {', '.join(map(str, allowed_rates))}"
+    if bitrate is not None:
+        if not OUTPUT_FORMATS[output_format]['bitrate']:
+            return f'bitrate is not supported for {output_format}'
+        if not BITRATE_RANGE[0] <= bitrate <= BITRATE_RANGE[1]:
+            return f'bitrate must be between {BITRATE_RANGE[0]} and {BITRATE_RANGE[1]} kbps'
+
+    output_settings = {'format': output_format, 'sample_rate': sample_rate, 'channels': PCM_CHANNELS}
+    if bitrate is not None:
+        output_settings['bitrate'] = bitrate
+    return output_settings
+
+def is_wav_passthrough(output_settings):
+    """True when the requested output is the canonical PCM in a WAV container (no encoder needed)"""
+    return output_settings['format'] == 'wav' and output_settings['sample_rate'] == PCM_SAMPLE_RATE
+
+def output_ext(output_settings):
+    return OUTPUT_FORMATS[output_settings['format']]['ext']
+
+def new_output_file(output_settings):
+    """Temp path for a new output; output_store.commit() moves it to its download path"""
+    return output_store.temp_path(output_ext(output_settings))
+
+@lru_cache(maxsize=4096)
+def _file_digest(file_path, mtime_ns, size):
+    digest = hashlib.sha256()
+    with open(file_path, 'rb') as f:
+        for block in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(block)
+    return digest.hexdigest()[:32]
+
+def file_etag(file_path):
+    """Strong ETag from the file content; hashed once per (path, mtime, size)"""
+    name = os.path.basename(file_path)
+    if OutputStore.ID_PATTERN.match(name):
+        # Stored outputs are already named by their content hash
+        return name.split('.', 1)[0]
+    st = os.stat(file_path)
+    return _file_digest(os.path.abspath(file_path), st.st_mtime_ns, st.st_size)
+
+def send_audio_file(file_path, mimetype=None, as_attachment=False, max_age=OUTPUT_CACHE_MAX_AGE, immutable=True):
+    """send_file with a content-hash ETag, Last-Modified and Cache-Control.
+
+    Conditional requests (If-None-Match, If-Modified-Since) get 304 and
+    Range/If-Range requests 206 partial content.
+    """
+    file_path = os.path.abspath(file_path)
+    response = send_file(file_path, mimetype=mimetype or audio_mimetype(file_path), as_attachment=as_attachment,
+                         conditional=True, etag=file_etag(file_path), max_age=max_age)
+    response.cache_control.public = True
+    if immutable:
+        response.cache_control.immutable = True
+    return response
+
+def audio_mimetype(filename):
+    ext = os.path.splitext(filename)[1].lstrip('.').lower()
+    for output_format in OUTPUT_FORMATS.values():
+        if output_format['ext'] == ext:
+            return output_format['mimetype']
+    return 'application/octet-stream'
+
+def open_output_sink(output_file, output_settings, on_output=None, deadline=None):
+    """Open the writer producing the requested output format from PCM"""
+    if deadline is not None:
+        deadline.check('encoding')
+    if is_wav_passthrough(output_settings):
+        return WavWriter(output_file, on_output=on_output)
+    return encoder_manager.open(output_file, output_settings, on_output,
+                                timeout=deadline.remaining() if deadline is not None else None)
+
+def get_request_priority(validation, data):
+    """Priority class for a request: the key's class, or a lower one asked for with 'priority'"""
+    key_priority = validation.get('priority') or 'normal'
+    if key_priority not in PRIORITY_CLASSES:
+        key_priority = 'normal'
+    requested = data.get('priority')
+    if not requested:
+        return key_priority
+    if requested not in PRIORITY_CLASSES:
+        raise VoiceRequestError(f"priority must be one of: {', '.join(PRIORITY_CLASSES)}", 400)
+    # A request can only lower its class below the one granted to the key
+    return max(requested, key_priority, key=PRIORITY_CLASSES.index)
+
+def build_voice_request(text, voice_name, api_key, validation, data):
+    """Build the voice request dict for an already validated API key"""
+    priority = get_request_priority(validation, data)
+
+    chunk_settings = get_chunk_settings(data)
+    if isinstance(chunk_settings, str):
+        raise VoiceRequestError(chunk_settings, 400)
+    chunks = split_text(text, chunk_settings['chunk_size']) if CHUNKING_ENABLED else [text]
+
+    output_settings = get_output_settings(data)
+    if isinstance(output_settings, str):
+        raise VoiceRequestError(output_settings, 400)
+
+    # Chunked audio differs (inter-chunk silence) so its settings are part of the cache keys
+    cache_settings = dict(output_settings)
+    canonical_settings = dict(CANONICAL_AUDIO_SETTINGS)
+    if len(chunks) > 1:
+        cache_settings.update(chunk_settings)
+        canonical_settings.update(chunk_settings)
+
+    return {
+        'text': text,
+        'voice_name': voice_name,
+        'api_key': api_key,
+        'validation': validation,
+        'chunks': chunks,
+        'chunk_settings': chunk_settings,
+        'output_settings': output_settings,
+        'priority': priority,
+        'deadline': None,
+        'cache_key': AudioCache.make_key(text, voice_name, GEMINI_TTS_MODEL, cache_settings),
+        'canonical_key': AudioCache.make_key(text, voice_name, GEMINI_TTS_MODEL, canonical_settings)
+    }
+
+def parse_voice_request(data):
+    """Validate a voice request body and its API key.
+
+    Returns a dict with text, voice_name, api_key, validation, chunks,
+    chunk_settings, priority and cache_key; raises VoiceRequestError otherwise.
+    """
+    text = data.get('text')
+    voice_name = data.get('voice_name', 'alloy')
+    api_key = data.get('api_key')
+    
+    if not text or not api_key:
+        raise VoiceRequestError('Missing text or api_key', 400)
+
+    validation = validate_voice_api_key(api_key)
+    return build_voice_request(text, voice_name, api_key, validation, data)
+
+def reserve_quota(key_id, count):
+    with quota_reservations_lock:
+        quota_reservations[key_id] += count
+
+def release_quota(key_id, count=1):
+    with quota_reservations_lock:
+        quota_reservations[key_id] -= count
+        if quota_reservations[key_id] <= 0:
+            del quota_reservations[key_id]
+
+def get_reserved_quota(key_id):
+    with quota_reservations_lock:
+        return quota_reservations.get(key_id, 0)
+
+def copy_cached_voice(voice_request):
+    """Link cached audio for this request into the output store; returns (mp3_file, cached entry) or None.
+
+    If only the canonical PCM of this text is cached, it is transcoded to the
+    requested format and the result cached too, without calling Gemini.
+    """
+    cache_key = voice_request['cache_key']
+    cached = audio_cache.get(cache_key)
+    if cached:
+        try:
+            mp3_file = output_store.add(cached['path'])
+            print(f"[CACHE] HIT {cache_key[:12]} for API key {voice_request['api_key'][:10]}...")
+            return mp3_file, cached
+        except Exception as e:
+            print(f"[CACHE] Failed to serve cached audio {cache_key[:12]}: {e}")
+            return None
+
+    canonical = audio_cache.get(voice_request['canonical_key'])
+    if not canonical:
+        return None
+    output_settings = voice_request['output_settings']
+    mp3_file = new_output_file(output_settings)
+    try:
+        if is_wav_passthrough(output_settings):
+            link_or_copy(canonical['path'], mp3_file)
+        else:
+            encoder_manager.transcode(canonical['path'], mp3_file, output_settings)
+        mp3_file = output_store.commit(mp3_file)
+    except Exception as e:
+        print(f"[CACHE] Failed to transcode canonical audio {voice_request['canonical_key'][:12]}: {e}")
+        if os.path.exists(mp3_file):
+            os.remove(mp3_file)
+        return None
+
+    print(f"[CACHE] TRANSCODE {voice_request['canonical_key'][:12]} -> {output_settings['format']} for API key {voice_request['api_key'][:10]}...")
+    audio_cache.put(cache_key, mp3_file, canonical['duration'], canonical.get('metadata'))
+    return mp3_file, canonical
+
+def generate_voice(voice_request, remote_addr, user_agent, on_output=None, mp3_file=None):
+    """Synthesize a parsed voice request, log Gemini usage and cache the result.
+
+    on_output receives encoded bytes as they are produced; mp3_file is the
+    temp path to encode to (a new one with the requested format by default).
+    Requests without a deadline (jobs, batch rows) get one from now of
+    voice_request['deadline_seconds'] (a batch's X-Request-Timeout) or the default.
+    Returns (mp3_file, duration, samples) with mp3_file already moved to its
+    content-addressed path; raises VoiceRequestError on failure.
+    """
+    if voice_request.get('deadline') is None:
+        voice_request['deadline'] = Deadline(voice_request.get('deadline_seconds') or REQUEST_DEFAULT_DEADLINE)
+    mp3_file = mp3_file or new_output_file(voice_request['output_settings'])
+    canonical_file = None
+    if STORE_CANONICAL_AUDIO and not is_wav_passthrough(voice_request['output_settings']):
+        canonical_file = output_store.temp_path('wav')
+
+    sent_bytes = 0
+
+    def send_output(data):
+        nonlocal sent_bytes
+        sent_bytes += len(data)
+        on_output(data)
+
+    def open_encoder(path):
+        sink = open_output_sink(path, voice_request['output_settings'], send_output if on_output else None,
+                                voice_request['deadline'])
+        if canonical_file:
+            # Keep the synthesized PCM so other formats never need Gemini again
+            return TeeSink(sink, WavWriter(canonical_file))
+        return sink
+
+    try:
+        # Once audio went out live, a failing key can't be replaced by another one
+        mp3_file, duration, samples = synthesize_voice(voice_request, remote_addr, user_agent, open_encoder,
+                                                       mp3_file, canonical_file,
+                                                       output_started=lambda: sent_bytes > 0)
+        return output_store.commit(mp3_file), duration, samples
+    except Exception as e:
+        if os.path.exists(mp3_file):
+            os.remove(mp3_file)
+        if isinstance(e, DeadlineExceeded):
+            print(f"[DEADLINE] {e}")
+            raise VoiceRequestError(str(e), 504)
+        raise
+    finally:
+        if canonical_file and os.path.exists(canonical_file):
+            os.remove(canonical_file)
+
+def shared_voice_error(error):
+    """Whether the failure of a coalesced request also applies to the identical requests waiting on it.
+
+    Admission rejections, rate limits and deadlines belong to the leading
+    request only; the waiting ones try again themselves.
+    """
+    return isinstance(error, VoiceRequestError) and error.status not in (429, 504)
+
+def coalesce_voice(voice_request, produce):
+    """Run produce() once for concurrent identical voice requests (same cache key).
+
+    Returns (result, coalesced) where coalesced is True for requests that
+    got the result of another one; waiting is bounded by the request deadline.
+    """
+    if not COALESCE_ENABLED:
+        return produce(), False
+    deadline = voice_request.get('deadline')
+    try:
+        result, coalesced = voice_flights.do(voice_request['cache_key'], produce,
+                                             timeout=deadline.remaining() if deadline is not None else None,
+                                             share_error=shared_voice_error)
+    except CoalesceTimeout as e:
+        raise VoiceRequestError(str(e), 504)
+    if coalesced:
+        print(f"[COALESCE] Shared result {voice_request['cache_key'][:12]} with API key {voice_request['api_key'][:10]}...")
+    return result, coalesced
+
+def synthesize_voice(voice_request, remote_addr, user_agent, open_encoder, mp3_file, canonical_file,
+                     output_started=None):
+    text = voice_request['text']
+    voice_name = voice_request['voice_name']
+    chunks = voice_request['chunks']
+    chunk_settings = voice_request['chunk_settings']
+    api_key = voice_request['api_key']
+    deadline = voice_request['deadline']
+
+    # Get available Gemini keys with IDs
+    gemini_keys_data = gemini_key_pool.active_keys()
+
+    if not gemini_keys_data:
+        raise VoiceRequestError('No API keys available', 503)
+    
+    # Create voice using Gemini TTS
+    print(f"[DEBUG] Starting voice creation for API key {api_key[:10]}...")
+    if len(chunks) > 1:
+        print(f"[CHUNK] Split {len(text)} chars into {len(chunks)} chunks (max {chunk_settings['chunk_size']})")
+        result = gemini_tts_chunked(chunks, voice_name, gemini_keys_data, chunk_settings['chunk_silence_ms'],
+                                    open_encoder=open_encoder, mp3_file=mp3_file, deadline=deadline)
+    else:
+        # Order keys by health score so load spreads and throttled keys go last
+        gemini_keys = key_scheduler.order(gemini_keys_data)
+        result = gemini_tts_request(text, voice_name, gemini_keys, open_encoder=open_encoder, mp3_file=mp3_file,
+                                    deadline=deadline, output_started=output_started)
+    
+    if not result:
+        print(f"[DEBUG] Voice creation FAILED for API key {api_key[:10]}...")
+        raise VoiceRequestError('Failed to create voice', 500)
+
+    print(f"[DEBUG] Voice creation SUCCESS for API key {api_key[:10]}...")
+    mp3_file, duration, samples, usages = result
+    
+    # Verify the MP3 file actually exists and has content
+    if not os.path.exists(mp3_file) or os.path.getsize(mp3_file) == 0:
+        print(f"[ERROR] Generated MP3 file is invalid: {mp3_file}")
+        raise VoiceRequestError('Failed to generate valid audio file', 500)
+    
+    # Verify duration is valid
+    if not duration or duration <= 0:
+        print(f"[ERROR] Generated audio has invalid duration: {duration}")
+        raise VoiceRequestError('Failed to generate valid audio duration', 500)
+    
+    # Find the Gemini key IDs that were used
+    used_gemini_key_ids = [gemini_key_pool.id_for_key(used_gemini_key) for used_gemini_key, _ in usages]
+
+    # Only log usage if we have a valid Gemini key ID
+    for (used_gemini_key, _), used_gemini_key_id in zip(usages, used_gemini_key_ids):
+        if not used_gemini_key_id:
+            print(f"[ERROR] Could not find Gemini key ID for used key: {used_gemini_key[:20]}")
+            raise VoiceRequestError('Internal error: key tracking failed', 500)
+    
+    # Log usage for each Gemini key; chunked requests split duration and
+    # file size across chunks by text length
+    file_size = os.path.getsize(mp3_file)
+    total_length = sum(length for _, length in usages) or 1
+    for (_, text_length), used_gemini_key_id in zip(usages, used_gemini_key_ids):
+        share = text_length / total_length
+        try:
+            print(f"[DEBUG] Logging Gemini usage for gemini_key_id={used_gemini_key_id}, text_length={text_length}")
+            db.log_gemini_usage(used_gemini_key_id, text_length, voice_name, duration * share,
+                              int(file_size * share), remote_addr, user_agent)
+            print(f"[DEBUG] Gemini usage logged successfully")
+        except Exception as e:
+            print(f"[ERROR] Failed to log Gemini usage: {e}")
+            # Don't fail the request if logging fails
+
+    metadata = {'voice_name': voice_name, 'text_length': len(text), 'samples': samples}
+    audio_cache.put(voice_request['cache_key'], mp3_file, duration, metadata)
+    if STORE_CANONICAL_AUDIO:
+        audio_cache.put(voice_request['canonical_key'], canonical_file or mp3_file, duration, metadata)
+
+    return mp3_file, duration, samples
+
 @app.route('/api/voice/create', methods=['POST'])
 def create_voice():
     """Create voice using Gemini TTS"""
@@ -415,145 +1505,729 @@ def create_voice():
     if not data:
         return jsonify({'success': False, 'error': 'Request body is empty'}), 400
     
-    text = data.get('text')
-    voice_name = data.get('voice_name', 'alloy')
-    api_key = data.get('api_key')
-    
-    if not text or not api_key:
-        return jsonify({'success': False, 'error': 'Missing text or api_key'}), 400
+    try:
+        deadline = request_deadline()
+        voice_request = parse_voice_request(data)
+        voice_request['deadline'] = deadline
+    except VoiceRequestError as e:
+        return jsonify({'success': False, 'error': str(e)}), e.status
+
+    # Serve identical requests from the audio cache without touching Gemini
+    cached_copy = copy_cached_voice(voice_request)
+    if cached_copy:
+        mp3_file, cached = cached_copy
+        return voice_success_response(voice_request['validation'], voice_request['text'], voice_request['voice_name'],
+                                      mp3_file, cached['duration'],
+                                      samples=cached.get('metadata', {}).get('samples'), cached=True)
+
+    def produce():
+        # Global rate limiting: wait in the admission queue for a free slot
+        ticket = admission_queue.acquire(**admission_args(voice_request))
+        try:
+            print(f"[VALIDATE] PROCEEDING WITH VOICE GENERATION")
+            return generate_voice(voice_request, request.remote_addr, request.headers.get('User-Agent'))
+        finally:
+            # Always release the admission slot
+            admission_queue.release(ticket)
+
+    try:
+        # Identical requests already being synthesized wait for that result without taking a slot
+        (mp3_file, duration, samples), coalesced = coalesce_voice(voice_request, produce)
+        return voice_success_response(voice_request['validation'], voice_request['text'], voice_request['voice_name'],
+                                      mp3_file, duration, samples=samples, coalesced=coalesced)
+
+    except AdmissionRejected as e:
+        return admission_rejected_response(e)
+
+    except VoiceRequestError as e:
+        return jsonify({'success': False, 'error': str(e)}), e.status
+
+    except Exception as e:
+        print(f"[ERROR] Exception in voice creation: {e}")
+        return jsonify({'success': False, 'error': str(e)}), 500
+
+@app.route('/api/voice/create-stream', methods=['POST'])
+def create_voice_stream():
+    """Create voice and stream the encoded audio back while it is still being generated"""
+    if not request.is_json:
+        return jsonify({'success': False, 'error': 'Content-Type must be application/json'}), 415
     
-    # Global rate limiting: Check if we can process this request
-    if not global_semaphore.acquire(blocking=False):
-        print(f"[RATE_LIMIT] Global limit exceeded. Max {MAX_CONCURRENT_REQUESTS} concurrent requests allowed.")
-        return jsonify({'success': False, 'error': 'Server busy. Please try again later.'}), 429
+    data = request.get_json()
+    if not data:
+        return jsonify({'success': False, 'error': 'Request body is empty'}), 400
     
     try:
-        # Validate API key
-        validation = db.validate_api_key(api_key)
-        if validation is None:
-            print(f"[VALIDATE] Invalid API key: {api_key[:10]}...")
-            return jsonify({'success': False, 'error': 'Invalid API key'}), 401
-        
-        if isinstance(validation, dict) and 'error' in validation:
-            print(f"[VALIDATE] API key validation failed: {validation['error']}")
-            return jsonify({'success': False, 'error': validation['error']}), 403
-        
-        print(f"[VALIDATE] API key validated successfully - Remaining: {validation.get('daily_remaining', 0)}")
-        print(f"[VALIDATE] PROCEEDING WITH VOICE GENERATION")
-        
-        # Get available Gemini keys with IDs
-        conn = sqlite3.connect(db.db_path)
-        cursor = conn.cursor()
-        cursor.execute('SELECT id, api_key FROM gemini_keys WHERE is_active = 1')
-        gemini_keys_data = cursor.fetchall()
-        conn.close()
-        
-        if not gemini_keys_data:
-            return jsonify({'success': False, 'error': 'No API keys available'}), 503
-        
-        # Extract just the API keys for the TTS request
-        gemini_keys = [row[1] for row in gemini_keys_data]
-        
-        # Create voice using Gemini TTS
-        print(f"[DEBUG] Starting voice creation for API key {api_key[:10]}...")
-        result = gemini_tts_request(text, voice_name, gemini_keys)
-        
-        if result:
-            print(f"[DEBUG] Voice creation SUCCESS for API key {api_key[:10]}...")
-            mp3_file, duration, used_gemini_key = result
-            filename = os.path.basename(mp3_file)
-            
-            # Verify the MP3 file actually exists and has content
-            if not os.path.exists(mp3_file) or os.path.getsize(mp3_file) == 0:
-                print(f"[ERROR] Generated MP3 file is invalid: {mp3_file}")
-                return jsonify({'success': False, 'error': 'Failed to generate valid audio file'}), 500
-            
-            # Verify duration is valid
-            if not duration or duration <= 0:
-                print(f"[ERROR] Generated audio has invalid duration: {duration}")
-                return jsonify({'success': False, 'error': 'Failed to generate valid audio duration'}), 500
-            
-            # Find the Gemini key ID that was used
-            used_gemini_key_id = None
-            for gemini_id, gemini_key in gemini_keys_data:
-                if gemini_key == used_gemini_key:
-                    used_gemini_key_id = gemini_id
-                    break
-            
-            # Only log usage if we have a valid Gemini key ID
-            if not used_gemini_key_id:
-                print(f"[ERROR] Could not find Gemini key ID for used key: {used_gemini_key[:20]}")
-                return jsonify({'success': False, 'error': 'Internal error: key tracking failed'}), 500
-            
-            # Log usage for API key (this will automatically increment daily/monthly usage)
-            key_id = validation.get('key_id')
-            user_id = validation.get('user_id')
-            if key_id and user_id:
-                try:
-                    # Generate unique request ID to prevent duplicate processing
-                    request_id = f"{key_id}_{user_id}_{int(time.time() * 1000)}_{hash(text[:50])}"
-                    print(f"[DEBUG] Processing request {request_id} for key_id={key_id}, user_id={user_id}, text_length={len(text)}, voice_name={voice_name}")
-                    
-                    db.log_usage(key_id, user_id, len(text), voice_name, duration, 
-                                os.path.getsize(mp3_file), request.remote_addr, request.headers.get('User-Agent'))
-                    print(f"[DEBUG] Usage logged successfully for request {request_id}")
-                except Exception as e:
-                    print(f"[ERROR] Failed to log usage for key_id={key_id}: {e}")
-                    # Don't fail the request if logging fails
-            
-            # Log usage for Gemini key
-            if used_gemini_key_id:
-                try:
-                    print(f"[DEBUG] Logging Gemini usage for gemini_key_id={used_gemini_key_id}, text_length={len(text)}")
-                    db.log_gemini_usage(used_gemini_key_id, len(text), voice_name, duration, 
-                                      os.path.getsize(mp3_file), request.remote_addr, request.headers.get('User-Agent'))
-                    print(f"[DEBUG] Gemini usage logged successfully")
-                except Exception as e:
-                    print(f"[ERROR] Failed to log Gemini usage: {e}")
-                    # Don't fail the request if logging fails
-            
-            return jsonify({
-                'success': True,
-                'filename': filename,
-                'duration': duration,
-                'download_url': f'/api/voice/download/{filename}'
-            })
+        deadline = request_deadline()
+        voice_request = parse_voice_request(data)
+        voice_request['deadline'] = deadline
+    except VoiceRequestError as e:
+        return jsonify({'success': False, 'error': str(e)}), e.status
+
+    remote_addr = request.remote_addr
+    user_agent = request.headers.get('User-Agent')
+
+    cached_copy = copy_cached_voice(voice_request)
+    if cached_copy:
+        mp3_file, cached = cached_copy
+        log_user_usage(voice_request['validation'], voice_request['text'], voice_request['voice_name'],
+                       mp3_file, cached['duration'], remote_addr, user_agent)
+        response = send_audio_file(mp3_file)
+        headers = live_stream_headers(os.path.basename(mp3_file), cached=True, duration=cached['duration'],
+                                      samples=cached.get('metadata', {}).get('samples'))
+        # A finished file keeps the ETag/Cache-Control of send_audio_file; no-store is only for live streams
+        headers.pop('Cache-Control')
+        response.headers.update(headers)
+        return response
+
+    global coalesced_stream_followers
+    cache_key = voice_request['cache_key']
+    caller = (voice_request['validation'], voice_request['text'], voice_request['voice_name'], remote_addr, user_agent)
+    with live_streams_lock:
+        flight = coalesced_streams.get(cache_key) if COALESCE_ENABLED else None
+        leader = flight is None
+        if not leader:
+            # An identical voice is already being generated: follow its stream
+            # from the first byte; usage is logged when it finishes
+            flight['followers'].append(caller)
+            coalesced_stream_followers += 1
+            filename, stream = flight['filename'], flight['stream']
         else:
-            print(f"[DEBUG] Voice creation FAILED for API key {api_key[:10]}...")
-            return jsonify({'success': False, 'error': 'Failed to create voice'}), 500
-            
+            # The content hash is not known yet, so the stream gets a random id
+            # that resolves to the stored file once it is finished
+            filename = output_store.new_id(output_ext(voice_request['output_settings']))
+            stream = AudioStream()
+            live_streams[filename] = stream
+            if COALESCE_ENABLED:
+                # Registered before waiting for a slot so duplicates arriving meanwhile join it
+                flight = coalesced_streams[cache_key] = {'filename': filename, 'stream': stream, 'followers': []}
+
+    if leader:
+        def end_flight():
+            with live_streams_lock:
+                live_streams.pop(filename, None)
+                if coalesced_streams.get(cache_key) is flight:
+                    del coalesced_streams[cache_key]
+            return flight['followers'] if flight else []
+
+        try:
+            ticket = admission_queue.acquire(**admission_args(voice_request))
+        except AdmissionRejected as e:
+            end_flight()
+            stream.fail(VoiceRequestError('Server busy. Please try again later.', e.status))
+            return admission_rejected_response(e)
+
+        mp3_file = new_output_file(voice_request['output_settings'])
+
+        def generate_in_background():
+            # Runs independently of the client so the file is finished and
+            # persisted even if the listener disconnects early
+            try:
+                generated_file, duration, samples = generate_voice(voice_request, remote_addr, user_agent,
+                                                                   on_output=stream.write, mp3_file=mp3_file)
+                output_store.alias(filename, generated_file, duration=duration, samples=samples)
+                followers = end_flight()
+                stream.finish()
+                callers = [caller] + (followers if COALESCE_BILL_FOLLOWERS else [])
+                for validation, text, voice_name, addr, agent in callers:
+                    log_user_usage(validation, text, voice_name, generated_file, duration, addr, agent)
+                print(f"[STREAM] Finished {filename} ({duration}s, {len(followers)} coalesced)")
+            except Exception as e:
+                print(f"[STREAM] Voice generation failed for {filename}: {e}")
+                end_flight()
+                stream.fail(e)
+            finally:
+                admission_queue.release(ticket)
+
+        threading.Thread(target=generate_in_background, daemon=True).start()
+
+    # Report failures before any audio as a normal JSON error
+    if not stream.wait_for_data(timeout=deadline.cap(STREAM_FIRST_AUDIO_TIMEOUT)):
+        if stream.error is not None:
+            status = stream.error.status if isinstance(stream.error, VoiceRequestError) else 500
+            return jsonify({'success': False, 'error': str(stream.error)}), status
+        if not stream.finished:
+            return jsonify({'success': False, 'error': 'Timed out waiting for audio'}), 504
+
+    return app.response_class(stream_live_audio(stream, filename), mimetype=audio_mimetype(filename),
+                              headers=live_stream_headers(filename))
+
+def admission_args(voice_request):
+    """Admission queue flow, fair-share weight, concurrency cap and priority class for a voice request"""
+    validation = voice_request['validation']
+    args = {
+        'key': validation.get('key_id'),
+        'weight': validation.get('queue_weight') or 1,
+        'limit': validation.get('max_concurrent') or None,
+        'priority': voice_request['priority']
+    }
+    if voice_request.get('deadline') is not None:
+        # Don't wait for a slot longer than the client is willing to wait overall
+        args['max_wait'] = voice_request['deadline'].cap(ADMISSION_MAX_WAIT)
+    return args
+
+def request_deadline():
+    """Deadline for the current HTTP request from the X-Request-Timeout header or the default"""
+    value = request.headers.get(REQUEST_DEADLINE_HEADER)
+    if not value:
+        return Deadline(REQUEST_DEFAULT_DEADLINE)
+    try:
+        seconds = float(value)
+    except ValueError:
+        raise VoiceRequestError(f'{REQUEST_DEADLINE_HEADER} must be a number of seconds', 400)
+    if seconds <= 0:
+        raise VoiceRequestError(f'{REQUEST_DEADLINE_HEADER} must be positive', 400)
+    return Deadline(min(seconds, REQUEST_MAX_DEADLINE))
+
+def admission_rejected_response(error):
+    """429/503 response for a request the admission queue could not take, with a Retry-After hint"""
+    print(f"[RATE_LIMIT] Request rejected: {error} (retry after {error.retry_after}s)")
+    response = jsonify({'success': False, 'error': 'Server busy. Please try again later.',
+                        'retry_after': error.retry_after})
+    response.headers['Retry-After'] = str(error.retry_after)
+    return response, error.status
+
+def live_stream_headers(filename, cached=False, duration=None, samples=None):
+    headers = {
+        'X-Voice-Filename': filename,
+        'X-Voice-Cached': 'true' if cached else 'false',
+        'X-Voice-Download-Url': f'/api/voice/download/{filename}',
+        'X-Voice-Live-Url': f'/api/voice/live/{filename}',
+        'Cache-Control': 'no-store'
+    }
+    headers.update(voice_duration_headers(duration, samples))
+    return headers
+
+def voice_duration_headers(duration=None, samples=None):
+    """Duration headers of a finished voice; samples / X-Voice-Sample-Rate is the exact length"""
+    headers = {}
+    if duration is not None:
+        headers['X-Voice-Duration'] = str(duration)
+    if samples is not None:
+        headers['X-Voice-Samples'] = str(samples)
+        headers['X-Voice-Sample-Rate'] = str(PCM_SAMPLE_RATE)
+    return headers
+
+def stream_live_audio(stream, filename):
+    """Yield encoded audio as it is produced; the response is sent with chunked transfer encoding"""
+    for chunk in stream:
+        yield chunk
+    if stream.error is not None:
+        # Headers are already sent; dropping the connection without the final
+        # chunk tells the client the audio is incomplete
+        print(f"[STREAM] Stream for {filename} ended early: {stream.error}")
+        raise RuntimeError(f"Voice generation failed: {stream.error}")
+
+@app.route('/api/voice/live/<filename>')
+def live_voice(filename):
+    """Follow a voice that is still being generated, or serve it once finished"""
+    with live_streams_lock:
+        stream = live_streams.get(filename)
+    if stream is not None:
+        return app.response_class(stream_live_audio(stream, filename), mimetype=audio_mimetype(filename),
+                                  headers={'Cache-Control': 'no-store'})
+
+    file_path = output_store.resolve(filename)
+    if file_path:
+        output_janitor.touch(file_path)
+        response = send_audio_file(file_path)
+        # Streamed voices keep their exact duration with the alias, so clients can
+        # get it with a HEAD request once the stream has ended
+        info = output_store.alias_info(filename)
+        if info:
+            response.headers.update(voice_duration_headers(info.get('duration'), info.get('samples')))
+        return response
+    return jsonify({'error': 'File not found'}), 404
+
+def start_voice_jobs():
+    """Start the job workers once per process, re-queueing jobs of processes that died"""
+    global voice_jobs_started, voice_job_worker_id
+    with voice_jobs_lock:
+        if voice_jobs_started:
+            return
+        voice_jobs_started = True
+    voice_job_worker_id = f"{socket.gethostname()}:{os.getpid()}:{secrets.token_hex(4)}"
+    requeued = db.requeue_stale_voice_jobs(VOICE_JOB_STALE_AFTER)
+    if requeued:
+        print(f"[JOBS] Requeued {requeued} stale running jobs")
+    voice_jobs.start(db.get_queued_voice_job_ids())
+    threading.Thread(target=voice_job_heartbeat, daemon=True, name='voice-job-heartbeat').start()
+
+def voice_job_heartbeat():
+    """Keep this process's running jobs alive and pick up jobs left behind by other processes"""
+    while True:
+        time.sleep(VOICE_JOB_HEARTBEAT_INTERVAL)
+        try:
+            db.heartbeat_voice_jobs(voice_job_worker_id)
+            requeued = db.requeue_stale_voice_jobs(VOICE_JOB_STALE_AFTER)
+            if requeued:
+                print(f"[JOBS] Requeued {requeued} stale running jobs")
+            # Jobs queued long ago may have been in the memory of a process that died
+            for job_id in db.get_queued_voice_job_ids(min_age=VOICE_JOB_STALE_AFTER):
+                voice_jobs.recover(job_id)
+        except Exception as e:
+            print(f"[JOBS] Heartbeat failed: {e}")
+
+def produce_voice(voice_request, remote_addr, user_agent):
+    """Serve a validated voice request from the cache or generate it, waiting for a free slot.
+
+    Logs user usage and returns (mp3_file, duration, samples, cached).
+    """
+    coalesced = False
+    cached_copy = copy_cached_voice(voice_request)
+    if cached_copy:
+        mp3_file, cached = cached_copy
+        duration = cached['duration']
+        samples = cached.get('metadata', {}).get('samples')
+    else:
+        def produce():
+            # Wait for a slot for as long as it takes rather than rejecting like the synchronous endpoint
+            with admission_queue.slot(bounded=False, **admission_args(voice_request)):
+                return generate_voice(voice_request, remote_addr, user_agent)
+
+        (mp3_file, duration, samples), coalesced = coalesce_voice(voice_request, produce)
+
+    if not coalesced or COALESCE_BILL_FOLLOWERS:
+        log_user_usage(voice_request['validation'], voice_request['text'], voice_request['voice_name'],
+                       mp3_file, duration, remote_addr, user_agent)
+    return mp3_file, duration, samples, bool(cached_copy)
+
+def run_voice_job(job_id):
+    """Process one persisted voice job and store its result"""
+    job = db.get_voice_job(job_id)
+    if not job or job['status'] != 'queued':
+        return
+
+    if not db.claim_voice_job(job_id, voice_job_worker_id):
+        return  # Another worker process got it first
+    print(f"[JOBS] Running job {job_id}")
+    try:
+        # Quota is checked again because the job may have waited in the queue
+        voice_request = parse_voice_request(job['request_data'])
+        mp3_file, duration, samples, cached = produce_voice(voice_request, job['ip_address'], job['user_agent'])
+        db.finish_voice_job(job_id, os.path.basename(mp3_file), duration, samples, cached=cached)
+        print(f"[JOBS] Job {job_id} succeeded ({duration}s)")
+
+    except VoiceRequestError as e:
+        print(f"[JOBS] Job {job_id} failed: {e}")
+        db.fail_voice_job(job_id, str(e), e.status)
     except Exception as e:
-        print(f"[ERROR] Exception in voice creation: {e}")
-        return jsonify({'success': False, 'error': str(e)}), 500
+        print(f"[JOBS] Job {job_id} failed: {e}")
+        db.fail_voice_job(job_id, str(e), 500)
+
+def voice_job_response(job):
+    """Build the public view of a voice job (never includes the request body or API key)"""
+    result = {
+        'success': True,
+        'job_id': job['id'],
+        'status': job['status'],
+        'created_at': job['created_at'],
+        'started_at': job['started_at'],
+        'finished_at': job['finished_at']
+    }
+    if job['status'] == 'queued':
+        result['position'] = voice_jobs.position(job['id'])
+    elif job['status'] == 'succeeded':
+        result.update({
+            'filename': job['filename'],
+            'duration': job['duration'],
+            'samples': job['samples'],
+            'sample_rate': PCM_SAMPLE_RATE if job['samples'] is not None else None,
+            'cached': bool(job['cached']),
+            'download_url': f"/api/voice/download/{job['filename']}"
+        })
+    elif job['status'] == 'failed':
+        result.update({'error': job['error'], 'error_status': job['error_status']})
+    return result
+
+@app.route('/api/voice/jobs', methods=['POST'])
+def create_voice_job():
+    """Queue a voice creation job and return its id immediately"""
+    if not request.is_json:
+        return jsonify({'success': False, 'error': 'Content-Type must be application/json'}), 415
     
+    data = request.get_json()
+    if not data:
+        return jsonify({'success': False, 'error': 'Request body is empty'}), 400
+
+    # Reject bad keys and exhausted quota up front instead of in the job
+    try:
+        voice_request = parse_voice_request(data)
+    except VoiceRequestError as e:
+        return jsonify({'success': False, 'error': str(e)}), e.status
+
+    if not voice_jobs.has_room():
+        print(f"[JOBS] Queue full ({VOICE_JOB_MAX_QUEUED} jobs)")
+        return jsonify({'success': False, 'error': 'Job queue is full. Please try again later.'}), 429
+
+    job_id = secrets.token_urlsafe(16)
+    request_data = {
+        'text': voice_request['text'],
+        'voice_name': voice_request['voice_name'],
+        'api_key': voice_request['api_key'],
+        'chunk_size': voice_request['chunk_settings']['chunk_size'],
+        'chunk_silence_ms': voice_request['chunk_settings']['chunk_silence_ms'],
+        'format': voice_request['output_settings']['format'],
+        'sample_rate': voice_request['output_settings']['sample_rate'],
+        'bitrate': voice_request['output_settings'].get('bitrate'),
+        'priority': voice_request['priority']
+    }
+    db.create_voice_job(job_id, voice_request['validation'].get('key_id'), request_data,
+                        request.remote_addr, request.headers.get('User-Agent'))
+    try:
+        voice_jobs.submit(job_id)
+    except QueueFullError as e:
+        db.fail_voice_job(job_id, str(e), 429)
+        return jsonify({'success': False, 'error': 'Job queue is full. Please try again later.'}), 429
+
+    print(f"[JOBS] Queued job {job_id} for API key {voice_request['api_key'][:10]}...")
+    return jsonify({
+        'success': True,
+        'job_id': job_id,
+        'status': 'queued',
+        'position': voice_jobs.position(job_id),
+        'status_url': f'/api/voice/jobs/{job_id}'
+    }), 202
+
+@app.route('/api/voice/jobs/<job_id>', methods=['GET'])
+def get_voice_job(job_id):
+    """Get voice job status; ?wait=N long-polls up to N seconds for the job to finish"""
+    job = db.get_voice_job(job_id)
+    if not job:
+        return jsonify({'success': False, 'error': 'Job not found'}), 404
+
+    try:
+        wait_seconds = min(max(float(request.args.get('wait', 0)), 0), VOICE_JOB_MAX_WAIT)
+    except ValueError:
+        return jsonify({'success': False, 'error': 'wait must be a number of seconds'}), 400
+
+    if wait_seconds and job['status'] in ('queued', 'running'):
+        if voice_jobs.wait(job_id, wait_seconds):
+            job = db.get_voice_job(job_id)
+
+    return jsonify(voice_job_response(job))
+
+@app.route('/api/voice/batch', methods=['POST'])
+def create_voice_batch():
+    """Create voices for an ordered list of rows, streaming each row's result as it completes"""
+    if not request.is_json:
+        return jsonify({'success': False, 'error': 'Content-Type must be application/json'}), 415
+    
+    data = request.get_json()
+    if not data:
+        return jsonify({'success': False, 'error': 'Request body is empty'}), 400
+
+    api_key = data.get('api_key')
+    rows = data.get('rows')
+    if not api_key or not isinstance(rows, list) or not rows:
+        return jsonify({'success': False, 'error': 'Missing api_key or rows'}), 400
+    if len(rows) > BATCH_MAX_ROWS:
+        return jsonify({'success': False, 'error': f'Too many rows (max {BATCH_MAX_ROWS})'}), 400
+
+    for index, row in enumerate(rows):
+        if not isinstance(row, dict) or not row.get('text'):
+            return jsonify({'success': False, 'error': f'Row {index}: missing text'}), 400
+
+    # X-Request-Timeout applies to each row, counted from when the row starts
+    row_deadline = None
+    if request.headers.get(REQUEST_DEADLINE_HEADER):
+        try:
+            row_deadline = request_deadline().seconds
+        except VoiceRequestError as e:
+            return jsonify({'success': False, 'error': str(e)}), e.status
+
+    # Validate once and reserve quota for every row so concurrent requests can't use it up mid-batch
+    with batch_admission_lock:
+        try:
+            validation = validate_voice_api_key(api_key, needed=len(rows))
+        except VoiceRequestError as e:
+            return jsonify({'success': False, 'error': str(e)}), e.status
+        key_id = validation.get('key_id')
+        reserve_quota(key_id, len(rows))
+
+    items = []
+    try:
+        for index, row in enumerate(rows):
+            # Row-level voice_name/chunk settings override the batch-level ones
+            row_data = {**data, **row}
+            voice_request = build_voice_request(row['text'], row_data.get('voice_name', 'alloy'), api_key,
+                                                validation, row_data)
+            voice_request['deadline_seconds'] = row_deadline
+            items.append((index, row.get('row_id', index), voice_request))
+    except VoiceRequestError as e:
+        release_quota(key_id, len(rows))
+        return jsonify({'success': False, 'error': str(e)}), e.status
+
+    print(f"[BATCH] Accepted {len(rows)} rows for API key {api_key[:10]}...")
+    return app.response_class(stream_batch_results(items, key_id, request.remote_addr,
+                                                   request.headers.get('User-Agent')),
+                              mimetype='application/x-ndjson', headers={'Cache-Control': 'no-store'})
+
+def stream_batch_results(items, key_id, remote_addr, user_agent):
+    """Run batch rows with bounded parallelism and yield one JSON line per finished row"""
+    pending = {}
+    next_item = 0
+    unreleased = len(items)
+    succeeded = 0
+    failed = 0
+
+    def submit_next():
+        nonlocal next_item
+        index, row_id, voice_request = items[next_item]
+        next_item += 1
+        pending[batch_executor.submit(produce_voice, voice_request, remote_addr, user_agent)] = (index, row_id)
+
+    try:
+        while next_item < len(items) and len(pending) < BATCH_MAX_PARALLEL:
+            submit_next()
+
+        while pending:
+            done, _ = wait(list(pending), return_when=FIRST_COMPLETED)
+            for future in done:
+                index, row_id = pending.pop(future)
+                release_quota(key_id)
+                unreleased -= 1
+                try:
+                    mp3_file, duration, samples, cached = future.result()
+                    filename = os.path.basename(mp3_file)
+                    result = {
+                        'index': index,
+                        'row_id': row_id,
+                        'success': True,
+                        'filename': filename,
+                        'duration': duration,
+                        'samples': samples,
+                        'sample_rate': PCM_SAMPLE_RATE if samples is not None else None,
+                        'cached': cached,
+                        'download_url': f'/api/voice/download/{filename}'
+                    }
+                    succeeded += 1
+                except Exception as e:
+                    status = e.status if isinstance(e, VoiceRequestError) else 500
+                    print(f"[BATCH] Row {row_id} failed: {e}")
+                    result = {'index': index, 'row_id': row_id, 'success': False, 'error': str(e), 'status': status}
+                    failed += 1
+
+                yield json.dumps(result) + '\n'
+                if next_item < len(items):
+                    submit_next()
+
+        print(f"[BATCH] Finished batch: {succeeded} succeeded, {failed} failed")
+        yield json.dumps({'done': True, 'total': len(items), 'succeeded': succeeded, 'failed': failed}) + '\n'
     finally:
-        # Always release the global semaphore
-        global_semaphore.release()
-        print(f"[RATE_LIMIT] Released semaphore. Available slots: {global_semaphore._value}")
+        # Client went away or batch ended: drop rows not started yet and their reservations
+        for future in pending:
+            future.cancel()
+        if unreleased:
+            release_quota(key_id, unreleased)
+
+@app.route('/api/admin/encoders', methods=['GET'])
+def admin_encoders():
+    """Get encoder backend statistics"""
+    if 'user_id' not in session or session.get('role') != 'admin':
+        return jsonify({'success': False, 'error': 'Admin access required'}), 403
+
+    return jsonify({'success': True, 'encoders': encoder_manager.stats()})
+
+@app.route('/api/admin/encoders/benchmark', methods=['POST'])
+def admin_encoders_benchmark():
+    """Benchmark encoder backends on synthetic audio of several text lengths"""
+    if 'user_id' not in session or session.get('role') != 'admin':
+        return jsonify({'success': False, 'error': 'Admin access required'}), 403
+
+    data = request.get_json(silent=True) or {}
+    backends = data.get('backends') or list(ENCODER_BACKENDS)
+    unknown = [name for name in backends if name not in ENCODER_BACKENDS]
+    if unknown:
+        return jsonify({'success': False, 'error': f"Unknown backends: {', '.join(unknown)}"}), 400
+
+    try:
+        iterations = min(max(int(data.get('iterations', 5)), 1), 50)
+        text_lengths = [min(max(int(length), 1), 10000) for length in data.get('text_lengths', [50, 200, 1000, 4000])]
+    except (TypeError, ValueError):
+        return jsonify({'success': False, 'error': 'iterations and text_lengths must be integers'}), 400
+
+    # Takes minutes for long texts, so it runs in the background; poll GET for the results
+    with encoder_benchmark_lock:
+        if encoder_benchmark['status'] == 'running':
+            return jsonify({'success': False, 'error': 'A benchmark is already running'}), 409
+        encoder_benchmark.update(status='running', started_at=datetime.now().isoformat(), finished_at=None,
+                                 backends=backends, text_lengths=text_lengths, iterations=iterations,
+                                 results=None, error=None)
+
+    def run_in_background():
+        try:
+            results = run_benchmark(backends, text_lengths=text_lengths, iterations=iterations)
+            update = {'status': 'finished', 'results': results}
+        except Exception as e:
+            print(f"[ENCODER] Benchmark failed: {e}")
+            update = {'status': 'failed', 'error': str(e)}
+        with encoder_benchmark_lock:
+            encoder_benchmark.update(update, finished_at=datetime.now().isoformat())
+
+    threading.Thread(target=run_in_background, daemon=True, name='encoder-benchmark').start()
+    return jsonify({'success': True, 'status': 'running',
+                    'status_url': '/api/admin/encoders/benchmark'}), 202
+
+@app.route('/api/admin/encoders/benchmark', methods=['GET'])
+def admin_encoders_benchmark_status():
+    """Get the status and results of the last encoder benchmark"""
+    if 'user_id' not in session or session.get('role') != 'admin':
+        return jsonify({'success': False, 'error': 'Admin access required'}), 403
+
+    with encoder_benchmark_lock:
+        return jsonify({'success': True, 'benchmark': dict(encoder_benchmark)})
+
+@app.route('/api/admin/voice-jobs', methods=['GET'])
+def admin_voice_jobs():
+    """Get voice job queue statistics"""
+    if 'user_id' not in session or session.get('role') != 'admin':
+        return jsonify({'success': False, 'error': 'Admin access required'}), 403
+
+    return jsonify({
+        'success': True,
+        'queue': voice_jobs.stats(),
+        'jobs_by_status': db.get_voice_job_counts()
+    })
+
+@app.route('/api/admin/admission', methods=['GET'])
+def admin_admission():
+    """Get admission queue depth, wait-time and rejection statistics"""
+    if 'user_id' not in session or session.get('role') != 'admin':
+        return jsonify({'success': False, 'error': 'Admin access required'}), 403
+
+    return jsonify({'success': True, 'admission': admission_queue.stats()})
+
+@app.route('/api/admin/http-sessions', methods=['GET'])
+def admin_http_sessions():
+    """Get HTTP session pool statistics (connection reuse, TLS handshakes)"""
+    if 'user_id' not in session or session.get('role') != 'admin':
+        return jsonify({'success': False, 'error': 'Admin access required'}), 403
+
+    return jsonify({'success': True, 'sessions': session_pool.stats()})
+
+@app.route('/api/admin/proxies', methods=['GET'])
+def admin_proxies():
+    """Get outbound proxies with their health, ejections and pinned keys"""
+    if 'user_id' not in session or session.get('role') != 'admin':
+        return jsonify({'success': False, 'error': 'Admin access required'}), 403
+
+    return jsonify({'success': True, 'proxies': proxy_pool.stats()})
+
+@app.route('/api/admin/proxies', methods=['PUT'])
+def admin_set_proxies():
+    """Replace the admin panel proxy list (one proxy per line, same formats as proxies.txt)"""
+    if 'user_id' not in session or session.get('role') != 'admin':
+        return jsonify({'success': False, 'error': 'Admin access required'}), 403
+
+    data = request.get_json(silent=True) or {}
+    proxies = data.get('proxies', '')
+    if isinstance(proxies, list):
+        proxies = '\n'.join(str(line) for line in proxies)
+    if not isinstance(proxies, str):
+        return jsonify({'success': False, 'error': 'proxies must be a string or a list of strings'}), 400
+    proxy_type = data.get('proxy_type', 'http')
+    if proxy_type not in ('http', 'https', 'socks4', 'socks5', 'socks5h'):
+        return jsonify({'success': False, 'error': 'proxy_type must be http, https, socks4, socks5 or socks5h'}), 400
+
+    urls, invalid = parse_proxy_list(proxies, proxy_type)
+    if invalid:
+        return jsonify({'success': False, 'error': f"Invalid proxy lines: {', '.join(invalid[:10])}"}), 400
+
+    db.set_setting('proxy_list', '\n'.join(urls))
+    load_proxy_sources()
+    print(f"[PROXY] Admin proxy list set to {len(urls)} proxies")
+    return jsonify({'success': True, 'count': len(urls), 'proxies': proxy_pool.stats()})
+
+@app.route('/api/admin/proxies/check', methods=['POST'])
+def admin_check_proxies():
+    """Reload the proxy file and health check all proxies now"""
+    if 'user_id' not in session or session.get('role') != 'admin':
+        return jsonify({'success': False, 'error': 'Admin access required'}), 403
+
+    check_proxies()
+    return jsonify({'success': True, 'proxies': proxy_pool.stats()})
+
+@app.route('/api/admin/concurrency', methods=['GET'])
+def admin_concurrency():
+    """Get the adaptive concurrency limit, its recent changes and retry budget usage"""
+    if 'user_id' not in session or session.get('role') != 'admin':
+        return jsonify({'success': False, 'error': 'Admin access required'}), 403
+
+    return jsonify({'success': True, 'concurrency': concurrency_limit.stats(), 'retry_budget': retry_budget.stats()})
+
+@app.route('/api/admin/voice-samples', methods=['GET'])
+def admin_voice_samples():
+    """Get in-memory voice sample and preview statistics"""
+    if 'user_id' not in session or session.get('role') != 'admin':
+        return jsonify({'success': False, 'error': 'Admin access required'}), 403
+
+    return jsonify({'success': True, 'samples': voice_catalog.stats()})
+
+@app.route('/api/admin/coalescing', methods=['GET'])
+def admin_coalescing():
+    """Get statistics of identical voice requests served by one synthesis"""
+    if 'user_id' not in session or session.get('role') != 'admin':
+        return jsonify({'success': False, 'error': 'Admin access required'}), 403
+
+    stats = voice_flights.stats()
+    with live_streams_lock:
+        stats['streams_in_flight'] = len(coalesced_streams)
+        stats['stream_followers'] = coalesced_stream_followers
+    stats.update(enabled=COALESCE_ENABLED, bill_followers=COALESCE_BILL_FOLLOWERS)
+    return jsonify({'success': True, 'coalescing': stats})
+
+@app.route('/api/admin/outputs', methods=['GET'])
+def admin_outputs():
+    """Get output directory disk usage and retention (eviction) statistics"""
+    if 'user_id' not in session or session.get('role') != 'admin':
+        return jsonify({'success': False, 'error': 'Admin access required'}), 403
+
+    return jsonify({'success': True, 'outputs': output_janitor.stats()})
+
+@app.route('/api/admin/outputs/cleanup', methods=['POST'])
+def admin_cleanup_outputs():
+    """Run the output retention sweep now"""
+    if 'user_id' not in session or session.get('role') != 'admin':
+        return jsonify({'success': False, 'error': 'Admin access required'}), 403
+
+    removed = output_janitor.run()
+    return jsonify({'success': True, 'removed': removed, 'outputs': output_janitor.stats()})
 
 @app.route('/api/voice/download/<filename>')
 def download_voice(filename):
     """Download generated voice file"""
     try:
-        file_path = os.path.join(OUTPUT_FOLDER, filename)
-        if os.path.exists(file_path):
-            return send_file(file_path, as_attachment=True)
+        file_path = output_store.resolve(filename)
+        if file_path:
+            output_janitor.touch(file_path)
+            return send_audio_file(file_path, as_attachment=True)
         else:
             return jsonify({'error': 'File not found'}), 404
+    except HTTPException:
+        # e.g. 416 for an unsatisfiable Range
+        raise
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
 @app.route('/api/voice/play/<filename>')
 def play_voice(filename):
-    """Play voice sample file"""
-    try:
-        file_path = os.path.join(VOICE_OUTPUT_DIR, filename)
-        if os.path.exists(file_path):
-            return send_file(file_path, mimetype='audio/mpeg')
-        else:
-            return jsonify({'error': 'Voice file not found'}), 404
-    except Exception as e:
-        return jsonify({'error': str(e)}), 500
+    """Play voice sample file from memory; ?variant=preview serves the low-bitrate preview"""
+    sample = voice_catalog.sample(filename, preview=request.args.get('variant') == 'preview')
+    if sample is None:
+        return jsonify({'error': 'Voice file not found'}), 404
+
+    response = app.response_class(sample['data'], mimetype='audio/mpeg')
+    response.set_etag(sample['etag'])
+    response.last_modified = sample['last_modified']
+    response.cache_control.public = True
+    # A versioned URL always names the same bytes, unless the preview is still being built
+    wants_preview = request.args.get('variant') == 'preview'
+    if request.args.get('v') == sample['version'] and sample['preview'] == wants_preview:
+        response.cache_control.max_age = OUTPUT_CACHE_MAX_AGE
+        response.cache_control.immutable = True
+    else:
+        response.cache_control.max_age = VOICE_SAMPLE_CACHE_MAX_AGE
+    return response.make_conditional(request, accept_ranges=True, complete_length=len(sample['data']))
 
 @app.route('/api/stats', methods=['GET'])
 @require_auth
@@ -648,65 +2322,51 @@ def admin_add_gemini_key():
         ''', (api_key,))
         
         conn.commit()
+        gemini_key_pool.notify_changed()
         return jsonify({'success': True, 'message': 'Gemini API key added successfully'})
     except sqlite3.IntegrityError:
         return jsonify({'success': False, 'error': 'API key already exists'}), 400
     finally:
         conn.close()
 
+@app.route('/api/admin/gemini-keys/scheduler', methods=['GET'])
+def admin_gemini_key_scheduler():
+    """Get Gemini key scheduler state and recent decisions (admin only)"""
+    if 'user_id' not in session or session.get('role') != 'admin':
+        return jsonify({'success': False, 'error': 'Admin access required'}), 403
+
+    snapshot = key_scheduler.snapshot()
+    snapshot['gemini_latency'] = gemini_latency.stats()
+    snapshot['key_pool'] = gemini_key_pool.stats()
+    return jsonify({'success': True, 'scheduler': snapshot})
+
+@app.route('/api/admin/audio-cache', methods=['GET'])
+def admin_audio_cache_stats():
+    """Get audio cache statistics (admin only)"""
+    if 'user_id' not in session or session.get('role') != 'admin':
+        return jsonify({'success': False, 'error': 'Admin access required'}), 403
+
+    return jsonify({'success': True, 'cache': audio_cache.stats()})
+
+@app.route('/api/admin/audio-cache', methods=['DELETE'])
+def admin_clear_audio_cache():
+    """Clear audio cache (admin only)"""
+    if 'user_id' not in session or session.get('role') != 'admin':
+        return jsonify({'success': False, 'error': 'Admin access required'}), 403
+
+    count = audio_cache.clear()
+    return jsonify({'success': True, 'message': f'Cleared {count} cached audio files', 'deleted_count': count})
+
 # Additional endpoints for tool compatibility
 @app.route('/api/voice/list', methods=['GET'])
 def list_voices():
-    """Get voice list with sample URLs"""
-    voices = [
-        {"name": "Voice 1 - Alpha", "code": "achernar"},
-        {"name": "Voice 2 - Beta", "code": "achird"},
-        {"name": "Voice 3 - Gamma", "code": "algenib"},
-        {"name": "Voice 4 - Delta", "code": "algieba"},
-        {"name": "Voice 5 - Epsilon", "code": "alnilam"},
-        {"name": "Voice 6 - Zeta", "code": "aoede"},
-        {"name": "Voice 7 - Eta", "code": "autonoe"},
-        {"name": "Voice 8 - Theta", "code": "callirrhoe"},
-        {"name": "Voice 9 - Iota", "code": "charon"},
-        {"name": "Voice 10 - Kappa", "code": "despina"},
-        {"name": "Voice 11 - Lambda", "code": "enceladus"},
-        {"name": "Voice 12 - Mu", "code": "erinome"},
-        {"name": "Voice 13 - Nu", "code": "fenrir"},
-        {"name": "Voice 14 - Xi", "code": "gacrux"},
-        {"name": "Voice 15 - Omicron", "code": "iapetus"},
-        {"name": "Voice 16 - Pi", "code": "kore"},
-        {"name": "Voice 17 - Rho", "code": "laomedeia"},
-        {"name": "Voice 18 - Sigma", "code": "leda"},
-        {"name": "Voice 19 - Tau", "code": "orus"},
-        {"name": "Voice 20 - Upsilon", "code": "puck"},
-        {"name": "Voice 21 - Phi", "code": "pulcherrima"},
-        {"name": "Voice 22 - Chi", "code": "rasalgethi"},
-        {"name": "Voice 23 - Psi", "code": "sadachbia"},
-        {"name": "Voice 24 - Omega", "code": "sadaltager"},
-        {"name": "Voice 25 - Alpha Prime", "code": "schedar"},
-        {"name": "Voice 26 - Beta Prime", "code": "sulafat"},
-        {"name": "Voice 27 - Gamma Prime", "code": "umbriel"},
-        {"name": "Voice 28 - Delta Prime", "code": "vindemiatrix"},
-        {"name": "Voice 29 - Epsilon Prime", "code": "zephyr"},
-        {"name": "Voice 30 - Zeta Prime", "code": "zubenelgenubi"},
-    ]
-
-    # Get base URL from request
-    base_url = request.url_root.rstrip('/')
-    
-    for voice in voices:
-        filename = f"{voice['code']}.mp3"
-        file_path = os.path.join(VOICE_OUTPUT_DIR, filename)
-
-        if os.path.exists(file_path):
-            voice["sample_url"] = f"{base_url}/api/voice/play/{filename}"
-        else:
-            voice["sample_url"] = None
-
-    return jsonify({
-        'success': True,
-        'voices': voices
-    })
+    """Get voice list with sample URLs and sample metadata (size, duration, hash)"""
+    body, etag = voice_catalog.response_body(request.url_root.rstrip('/'))
+    response = app.response_class(body, mimetype='application/json')
+    response.set_etag(etag)
+    response.cache_control.public = True
+    response.cache_control.max_age = VOICE_CATALOG_MAX_AGE
+    return response.make_conditional(request)
 
 @app.route('/api/voice/auth', methods=['GET'])
 def voice_auth():
@@ -855,7 +2515,8 @@ def admin_list_all_keys():
     
     cursor.execute('''
         SELECT ak.id, ak.key_name, ak.api_key, ak.daily_limit, ak.total_usage,
-               ak.expires_at, ak.is_active, ak.created_at, ak.device_id, ak.last_login, u.username
+               ak.expires_at, ak.is_active, ak.created_at, ak.device_id, ak.last_login, u.username,
+               ak.max_concurrent, ak.queue_weight, ak.priority
         FROM api_keys ak
         JOIN users u ON ak.user_id = u.id
         ORDER BY ak.created_at DESC
@@ -902,7 +2563,10 @@ def admin_list_all_keys():
             'created_at': key[7],
             'device_id': key[8] or '',
             'last_login': key[9] or '',
-            'username': key[10]
+            'username': key[10],
+            'max_concurrent': key[11],
+            'queue_weight': key[12],
+            'priority': key[13] or 'normal'
         })
     
     conn.close()
@@ -929,11 +2593,16 @@ def admin_create_key():
     key_name = data.get('key_name', 'Admin Created Key')
     daily_limit = data.get('daily_limit', 100)
     monthly_limit = data.get('monthly_limit', 3000)
+    max_concurrent = data.get('max_concurrent', 3)
+    queue_weight = data.get('queue_weight', 1)
+    priority = data.get('priority', 'normal')
     expires_days = data.get('expires_days')
     custom_key = data.get('custom_key')
     
     if not username:
         return jsonify({'success': False, 'error': 'Username required'}), 400
+    if priority not in PRIORITY_CLASSES:
+        return jsonify({'success': False, 'error': f"priority must be one of: {', '.join(PRIORITY_CLASSES)}"}), 400
     
     conn = sqlite3.connect(db.db_path)
     cursor = conn.cursor()
@@ -959,9 +2628,11 @@ def admin_create_key():
     
     try:
         cursor.execute('''
-            INSERT INTO api_keys (user_id, key_name, api_key, daily_limit, monthly_limit, expires_at)
-            VALUES (?, ?, ?, ?, ?, ?)
-        ''', (user_id, key_name, api_key, daily_limit, monthly_limit, expires_at))
+            INSERT INTO api_keys (user_id, key_name, api_key, daily_limit, monthly_limit, expires_at,
+                                  max_concurrent, queue_weight, priority)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+        ''', (user_id, key_name, api_key, daily_limit, monthly_limit, expires_at, max_concurrent, queue_weight,
+              priority))
         
         key_id = cursor.lastrowid
         conn.commit()
@@ -1036,11 +2707,37 @@ def admin_delete_gemini_key(key_id):
     if cursor.rowcount > 0:
         conn.commit()
         conn.close()
+        gemini_key_pool.notify_changed()
         return jsonify({'success': True, 'message': 'Gemini API key deleted successfully'})
     else:
         conn.close()
         return jsonify({'success': False, 'error': 'Gemini API key not found'}), 404
 
+@app.route('/api/admin/gemini-keys/<int:key_id>/toggle', methods=['POST'])
+def admin_toggle_gemini_key(key_id):
+    """Toggle Gemini API key status (admin only)"""
+    # Check admin session instead of JWT token
+    if 'user_id' not in session or session.get('role') != 'admin':
+        return jsonify({'success': False, 'error': 'Admin access required'}), 403
+
+    conn = sqlite3.connect(db.db_path)
+    cursor = conn.cursor()
+
+    cursor.execute('''
+        UPDATE gemini_keys
+        SET is_active = NOT is_active
+        WHERE id = ?
+    ''', (key_id,))
+
+    if cursor.rowcount > 0:
+        conn.commit()
+        conn.close()
+        gemini_key_pool.notify_changed()
+        return jsonify({'success': True, 'message': 'Gemini API key status updated'})
+    else:
+        conn.close()
+        return jsonify({'success': False, 'error': 'Gemini API key not found'}), 404
+
 @app.route('/api/admin/users/<int:user_id>', methods=['DELETE'])
 def admin_delete_user(user_id):
     """Delete user (admin only)"""
@@ -1227,9 +2924,14 @@ def admin_edit_key(key_id):
     monthly_limit = data.get('monthly_limit')
     expires_days = data.get('expires_days')
     device_id = data.get('device_id')
+    max_concurrent = data.get('max_concurrent')  # Optional, unchanged when omitted
+    queue_weight = data.get('queue_weight')
+    priority = data.get('priority')
     
     if not all([key_name, daily_limit is not None, monthly_limit is not None]):
         return jsonify({'success': False, 'error': 'Missing required fields'}), 400
+    if priority is not None and priority not in PRIORITY_CLASSES:
+        return jsonify({'success': False, 'error': f"priority must be one of: {', '.join(PRIORITY_CLASSES)}"}), 400
     
     conn = sqlite3.connect(db.db_path)
     cursor = conn.cursor()
@@ -1256,9 +2958,12 @@ def admin_edit_key(key_id):
     # Update key
     cursor.execute('''
         UPDATE api_keys 
-        SET key_name = ?, daily_limit = ?, monthly_limit = ?, expires_at = ?, device_id = ?
+        SET key_name = ?, daily_limit = ?, monthly_limit = ?, expires_at = ?, device_id = ?,
+            max_concurrent = COALESCE(?, max_concurrent), queue_weight = COALESCE(?, queue_weight),
+            priority = COALESCE(?, priority)
         WHERE id = ?
-    ''', (key_name, daily_limit, monthly_limit, expires_at, device_id, key_id))
+    ''', (key_name, daily_limit, monthly_limit, expires_at, device_id, max_concurrent, queue_weight, priority,
+          key_id))
     
     if cursor.rowcount > 0:
         conn.commit()
@@ -1286,24 +2991,64 @@ def run_scheduler():
         schedule.run_pending()
         time.sleep(60)  # Check every minute
 
-if __name__ == '__main__':
+def start_scheduler():
+    """Register the periodic maintenance jobs and run them in a background thread"""
     # Schedule daily reset of Gemini usage at midnight
     schedule.every().day.at("00:00").do(reset_gemini_daily_usage)
-    
+
+    # Persist audio cache access times periodically
+    schedule.every(5).minutes.do(audio_cache.flush)
+
+    # Close HTTP sessions (and their connections) nobody used for a while
+    schedule.every(5).minutes.do(session_pool.evict_idle)
+
+    # Remove expired, over-quota and orphaned temp output files
+    schedule.every(OUTPUT_JANITOR_INTERVAL).minutes.do(output_janitor.run)
+
+    # Reload and health check outbound proxies
+    schedule.every(PROXY_HEALTH_CHECK_INTERVAL).minutes.do(check_proxies)
+
+    # Drop old finished voice jobs
+    schedule.every().day.at("03:00").do(db.delete_old_voice_jobs, VOICE_JOB_RETENTION_DAYS)
+
     # Start scheduler in background thread
-    scheduler_thread = threading.Thread(target=run_scheduler, daemon=True)
-    scheduler_thread.start()
-    
-    # Add some sample Gemini API keys for testing
+    threading.Thread(target=run_scheduler, daemon=True, name='scheduler').start()
+
+    # First proxy health check, so selection is latency-weighted from the start
+    threading.Thread(target=check_proxies, daemon=True).start()
+
+def init_app():
+    """Start-up work of a serving process: database tables and migrations,
+    folders, the audio cache index, voice samples, proxies, job workers and
+    the maintenance schedule"""
+    db.init_database()
+    os.makedirs(UPLOAD_FOLDER, exist_ok=True)
+    os.makedirs(OUTPUT_FOLDER, exist_ok=True)
+    audio_cache.load()
+    voice_catalog.refresh()
+    load_proxy_sources()
+    start_voice_jobs()
+    start_scheduler()
+
     conn = sqlite3.connect(db.db_path)
     cursor = conn.cursor()
-    
-    # Check if any Gemini keys exist
     cursor.execute('SELECT COUNT(*) FROM gemini_keys')
     if cursor.fetchone()[0] == 0:
         print("No Gemini API keys found. Please add them via admin panel.")
-    
     conn.close()
-    
+
+# init_app() runs in every serving process, including each worker of a WSGI
+# server, which imports this module. Several processes can share the voice
+# jobs because a job is claimed in the database, and the maintenance jobs
+# tolerate running in each of them. The dev server's reloader
+# parent only watches files, and encoder pool processes (spawned) re-import
+# the main module as __mp_main__ when they start; neither serves requests, so
+# neither runs any of it
+DEV_SERVER_RELOADER = True  # app.run() restarts the server on code changes
+if multiprocessing.current_process().name == 'MainProcess' and (
+        __name__ != '__main__' or not DEV_SERVER_RELOADER or is_running_from_reloader()):
+    init_app()
+
+if __name__ == '__main__':
     print("Starting server with quota management...")
-    app.run(debug=True, host='0.0.0.0', port=2000)
\ No newline at end of file
+    app.run(debug=True, use_reloader=DEV_SERVER_RELOADER, host='0.0.0.0', port=2000)
@@ -0,0 +1,219 @@
+import os
+import json
+import time
+import shutil
+import hashlib
+import threading
+import unicodedata
+from collections import OrderedDict
+
+class AudioCache:
+    """Persistent content-addressed cache for synthesized audio files"""
+
+    INDEX_FILE = 'index.json'
+    INDEX_FLUSH_INTERVAL = 30  # Flush access times to disk at most every 30 seconds
+
+    def __init__(self, cache_dir, max_bytes=2 * 1024 * 1024 * 1024, ttl_seconds=30 * 24 * 3600, load=True):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.ttl_seconds = ttl_seconds
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()  # key -> entry, least recently used first
+        self._total_bytes = 0
+        self._dirty = False
+        self._last_flush = time.time()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+        if load:
+            self.load()
+
+    @staticmethod
+    def normalize_text(text):
+        """Normalize text so that cosmetic differences map to the same cache key"""
+        text = unicodedata.normalize('NFC', text or '')
+        return ' '.join(text.split())
+
+    @classmethod
+    def make_key(cls, text, voice_name, model, output_settings=None):
+        """Build cache key from normalized text, voice, model and output settings"""
+        payload = json.dumps({
+            'text': cls.normalize_text(text),
+            'voice': (voice_name or '').strip().lower(),
+            'model': model,
+            'output': output_settings or {}
+        }, sort_keys=True, ensure_ascii=False)
+        return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+    def _index_path(self):
+        return os.path.join(self.cache_dir, self.INDEX_FILE)
+
+    def _entry_path(self, entry):
+        return os.path.join(self.cache_dir, entry['file'])
+
+    def load(self):
+        """Create the cache directory and load the index (done by the constructor unless load=False)"""
+        os.makedirs(self.cache_dir, exist_ok=True)
+        with self._lock:
+            self._load_index()
+
+    def _load_index(self):
+        """Load cache index from disk, dropping entries whose files are gone"""
+        try:
+            with open(self._index_path(), 'r', encoding='utf-8') as f:
+                data = json.load(f)
+        except FileNotFoundError:
+            return
+        except Exception as e:
+            print(f"[CACHE] Failed to load cache index, starting empty: {e}")
+            return
+
+        entries = sorted(data.get('entries', {}).items(), key=lambda item: item[1].get('last_access', 0))
+        for key, entry in entries:
+            if os.path.exists(self._entry_path(entry)):
+                self._entries[key] = entry
+                self._total_bytes += entry.get('size', 0)
+
+        print(f"[CACHE] Loaded {len(self._entries)} cached audio entries ({self._total_bytes} bytes)")
+
+    def _save_index(self):
+        """Write index atomically (caller must hold the lock)"""
+        tmp_path = self._index_path() + '.tmp'
+        try:
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump({'entries': dict(self._entries)}, f)
+            os.replace(tmp_path, self._index_path())
+            self._dirty = False
+            self._last_flush = time.time()
+        except Exception as e:
+            print(f"[CACHE] Failed to save cache index: {e}")
+
+    def _remove_entry(self, key):
+        """Remove entry and its file (caller must hold the lock)"""
+        entry = self._entries.pop(key, None)
+        if not entry:
+            return
+        self._total_bytes -= entry.get('size', 0)
+        try:
+            os.remove(self._entry_path(entry))
+        except FileNotFoundError:
+            pass
+        except Exception as e:
+            print(f"[CACHE] Failed to remove cached file {entry['file']}: {e}")
+
+    def _evict(self):
+        """Evict expired entries, then least recently used ones until under size limit"""
+        now = time.time()
+        expired = [key for key, entry in self._entries.items()
+                   if now - entry['created_at'] > self.ttl_seconds]
+        for key in expired:
+            self._remove_entry(key)
+            self.evictions += 1
+
+        while self._entries and self._total_bytes > self.max_bytes:
+            key = next(iter(self._entries))
+            self._remove_entry(key)
+            self.evictions += 1
+
+        if expired:
+            self._dirty = True
+
+    def get(self, key):
+        """Return cached entry (with absolute path) or None on miss"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+
+            path = self._entry_path(entry)
+            if time.time() - entry['created_at'] > self.ttl_seconds or not os.path.exists(path):
+                self._remove_entry(key)
+                self._dirty = True
+                self.misses += 1
+                return None
+
+            entry['last_access'] = time.time()
+            entry['hit_count'] = entry.get('hit_count', 0) + 1
+            self._entries.move_to_end(key)
+            self.hits += 1
+            self._dirty = True
+
+            if time.time() - self._last_flush > self.INDEX_FLUSH_INTERVAL:
+                self._save_index()
+
+            return dict(entry, path=path)
+
+    def put(self, key, source_path, duration, metadata=None):
+        """Store a copy of source_path under key"""
+        ext = os.path.splitext(source_path)[1] or '.mp3'
+        filename = f"{key}{ext}"
+        dest_path = os.path.join(self.cache_dir, filename)
+
+        try:
+            link_or_copy(source_path, dest_path)
+            size = os.path.getsize(dest_path)
+        except Exception as e:
+            print(f"[CACHE] Failed to store {source_path} in cache: {e}")
+            return False
+
+        now = time.time()
+        with self._lock:
+            old_entry = self._entries.pop(key, None)
+            if old_entry:
+                self._total_bytes -= old_entry.get('size', 0)
+
+            self._entries[key] = {
+                'file': filename,
+                'size': size,
+                'duration': duration,
+                'created_at': now,
+                'last_access': now,
+                'hit_count': 0,
+                'metadata': metadata or {}
+            }
+            self._total_bytes += size
+            self._evict()
+            self._save_index()
+
+        return True
+
+    def clear(self):
+        """Remove all cached entries"""
+        with self._lock:
+            count = len(self._entries)
+            for key in list(self._entries.keys()):
+                self._remove_entry(key)
+            self._save_index()
+            return count
+
+    def flush(self):
+        """Persist pending access-time updates"""
+        with self._lock:
+            if self._dirty:
+                self._save_index()
+
+    def stats(self):
+        """Get cache statistics"""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'entries': len(self._entries),
+                'total_bytes': self._total_bytes,
+                'max_bytes': self.max_bytes,
+                'ttl_seconds': self.ttl_seconds,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': round(self.hits / lookups, 4) if lookups else 0,
+                'evictions': self.evictions
+            }
+
+def link_or_copy(source_path, dest_path):
+    """Hard-link source to dest when possible, falling back to a copy"""
+    tmp_path = f"{dest_path}.{threading.get_ident()}.tmp"
+    try:
+        os.link(source_path, tmp_path)
+    except OSError:
+        shutil.copyfile(source_path, tmp_path)
+    os.replace(tmp_path, dest_path)
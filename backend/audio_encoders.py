@@ -0,0 +1,520 @@
+import os
+import sys
+import time
+import math
+import queue
+import struct
+import threading
+import multiprocessing
+from audio_pipeline import (StreamingEncoder, AudioEncodeError, encoder_output_kwargs, transcode_file,
+                            PCM_SAMPLE_RATE, PCM_CHANNELS)
+
+# Optional in-process MP3 encoder (pip install lameenc)
+try:
+    import lameenc
+except ImportError:
+    lameenc = None
+
+DEFAULT_MP3_BITRATE = 128  # kbps, same as ffmpeg's libmp3lame default
+LAME_QUALITY = 2  # 2 = high quality, 7 = fastest
+
+def _new_lame_encoder(bitrate):
+    encoder = lameenc.Encoder()
+    encoder.set_bit_rate(bitrate or DEFAULT_MP3_BITRATE)
+    encoder.set_in_sample_rate(PCM_SAMPLE_RATE)
+    encoder.set_channels(PCM_CHANNELS)
+    encoder.set_quality(LAME_QUALITY)
+    return encoder
+
+class EncodedFileSink:
+    """Common write/close/abort handling for encoders that hand back encoded bytes"""
+
+    def __init__(self, output_path, on_output=None, on_done=None):
+        self.output_path = output_path
+        self.on_output = on_output
+        self.on_done = on_done
+        self.bytes_written = 0
+        self._closed = False
+        self._file = open(output_path, 'wb')
+
+    def _encode(self, pcm_chunk):
+        raise NotImplementedError
+
+    def _flush(self):
+        raise NotImplementedError
+
+    def _emit(self, data):
+        if not data:
+            return
+        self._file.write(data)
+        if self.on_output:
+            try:
+                self.on_output(bytes(data))
+            except Exception as e:
+                # A failing listener must not stop the file from being written
+                print(f"[ENCODER] Output listener failed: {e}")
+
+    def write(self, pcm_chunk):
+        if not pcm_chunk:
+            return
+        try:
+            self._emit(self._encode(pcm_chunk))
+            self.bytes_written += len(pcm_chunk)
+        except Exception as e:
+            self.abort()
+            raise AudioEncodeError(f"Encoding failed: {e}")
+
+    def close(self):
+        if self._closed:
+            return
+        try:
+            self._emit(self._flush())
+            self._file.close()
+        except Exception as e:
+            self.abort()
+            raise AudioEncodeError(f"Encoding failed: {e}")
+        self._closed = True
+        self._done()
+
+    def abort(self):
+        if self._closed:
+            return
+        self._closed = True
+        try:
+            self._file.close()
+            os.remove(self.output_path)
+        except OSError:
+            pass
+        self._done(failed=True)
+
+    def _done(self, failed=False):
+        if self.on_done:
+            self.on_done(failed)
+
+class LameSink(EncodedFileSink):
+    """MP3 encoding with lameenc in the calling thread"""
+
+    def __init__(self, output_path, bitrate=None, on_output=None, on_done=None):
+        super().__init__(output_path, on_output, on_done)
+        self._encoder = _new_lame_encoder(bitrate)
+
+    def _encode(self, pcm_chunk):
+        return self._encoder.encode(bytes(pcm_chunk))
+
+    def _flush(self):
+        return self._encoder.flush()
+
+class ReleasingSink:
+    """Wrap a sink so a slot is released exactly once when it is closed or aborted"""
+
+    def __init__(self, sink, on_done):
+        self.sink = sink
+        self.output_path = sink.output_path
+        self._on_done = on_done
+
+    def write(self, pcm_chunk):
+        try:
+            self.sink.write(pcm_chunk)
+        except Exception:
+            self._release(failed=True)
+            raise
+
+    def close(self):
+        try:
+            self.sink.close()
+        except Exception:
+            self._release(failed=True)
+            raise
+        self._release()
+
+    def abort(self):
+        self.sink.abort()
+        self._release(failed=True)
+
+    def _release(self, failed=False):
+        if self._on_done:
+            on_done, self._on_done = self._on_done, None
+            on_done(failed)
+
+class EncoderBackend:
+    """Base class tracking usage of an encoder backend"""
+
+    name = 'base'
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.encodes = 0
+        self.failures = 0
+        self.in_use = 0
+
+    def available(self):
+        return True
+
+    def supports(self, output_settings):
+        return True
+
+    def open(self, output_path, output_settings, on_output=None, timeout=None):
+        raise NotImplementedError
+
+    def _started(self):
+        with self._lock:
+            self.in_use += 1
+
+    def _finished(self, failed=False):
+        with self._lock:
+            self.in_use -= 1
+            self.encodes += 1
+            if failed:
+                self.failures += 1
+
+    def stats(self):
+        with self._lock:
+            return {
+                'name': self.name,
+                'available': self.available(),
+                'in_use': self.in_use,
+                'encodes': self.encodes,
+                'failures': self.failures
+            }
+
+    def shutdown(self):
+        pass
+
+class FfmpegBackend(EncoderBackend):
+    """One ffmpeg process per encode, with at most max_processes running at once"""
+
+    name = 'ffmpeg'
+
+    def __init__(self, max_processes=None):
+        super().__init__()
+        self.max_processes = max_processes or os.cpu_count() or 1
+        self._slots = threading.BoundedSemaphore(self.max_processes)
+
+    def open(self, output_path, output_settings, on_output=None, timeout=None):
+        if not self._slots.acquire(timeout=timeout):
+            raise AudioEncodeError("No ffmpeg process slot became free in time")
+        self._started()
+
+        def release(failed=False):
+            self._slots.release()
+            self._finished(failed)
+
+        try:
+            kwargs = encoder_output_kwargs(output_settings['format'], output_settings['sample_rate'],
+                                           output_settings.get('bitrate'))
+            encoder = StreamingEncoder(output_path, on_output=on_output, **kwargs)
+        except Exception:
+            release(failed=True)
+            raise
+        return ReleasingSink(encoder, release)
+
+    def transcode(self, input_path, output_path, output_settings):
+        """Transcode a file within the same process limit as streaming encodes"""
+        kwargs = encoder_output_kwargs(output_settings['format'], output_settings['sample_rate'],
+                                       output_settings.get('bitrate'))
+        with self._slots:
+            self._started()
+            failed = True
+            try:
+                transcode_file(input_path, output_path, **kwargs)
+                failed = False
+            finally:
+                self._finished(failed)
+
+    def stats(self):
+        result = super().stats()
+        result['max_processes'] = self.max_processes
+        return result
+
+class InProcessBackend(EncoderBackend):
+    """MP3 encoding with lameenc in the request thread, no process start-up at all"""
+
+    name = 'inprocess'
+
+    def available(self):
+        return lameenc is not None
+
+    def supports(self, output_settings):
+        return (self.available() and output_settings['format'] == 'mp3'
+                and output_settings['sample_rate'] == PCM_SAMPLE_RATE)
+
+    def open(self, output_path, output_settings, on_output=None, timeout=None):
+        self._started()
+        try:
+            return LameSink(output_path, output_settings.get('bitrate'), on_output=on_output, on_done=self._finished)
+        except Exception as e:
+            self._finished(failed=True)
+            raise AudioEncodeError(f"Failed to start encoder: {e}")
+
+def _pool_worker(conn):
+    """Encoder worker process: encodes PCM sent over conn until told to exit"""
+    encoder = None
+    while True:
+        try:
+            message = conn.recv()
+        except (EOFError, KeyboardInterrupt):
+            return
+        if message is None:
+            return
+        command, payload = message
+        try:
+            if command == 'start':
+                encoder = _new_lame_encoder(payload)
+                conn.send(('ok', b''))
+            elif command == 'data':
+                conn.send(('ok', encoder.encode(payload)))
+            elif command == 'end':
+                data = encoder.flush() if encoder else b''
+                encoder = None
+                conn.send(('ok', data))
+        except Exception as e:
+            encoder = None
+            conn.send(('error', str(e)))
+
+class PoolWorker:
+    def __init__(self, context, index):
+        self.index = index
+        self.conn, child_conn = context.Pipe()
+        self.process = context.Process(target=_pool_worker, args=(child_conn,),
+                                       name=f'encoder-worker-{index}', daemon=True)
+        self.process.start()
+        child_conn.close()
+
+    def call(self, command, payload=None):
+        self.conn.send((command, payload))
+        status, result = self.conn.recv()
+        if status != 'ok':
+            raise AudioEncodeError(result)
+        return result
+
+    def stop(self):
+        try:
+            self.conn.send(None)
+        except Exception:
+            pass
+        self.process.join(timeout=2)
+        if self.process.is_alive():
+            self.process.terminate()
+
+class PoolSink(EncodedFileSink):
+    """Encode through a worker process checked out from the pool for the duration of one file"""
+
+    def __init__(self, worker, output_path, bitrate=None, on_output=None, on_done=None):
+        self.worker = worker
+        # Start the worker's encoder before creating the file, so a failed start leaves nothing behind
+        worker.call('start', bitrate)
+        super().__init__(output_path, on_output, on_done)
+
+    def _encode(self, pcm_chunk):
+        return self.worker.call('data', bytes(pcm_chunk))
+
+    def _flush(self):
+        return self.worker.call('end')
+
+class EncoderPoolBackend(EncoderBackend):
+    """Long-lived encoder worker processes, one per CPU core by default.
+
+    Each encode checks a worker out for its whole duration, so the pool size
+    is also the limit on concurrent encodes. Workers are started on first use
+    and replaced if they die.
+    """
+
+    name = 'pool'
+
+    def __init__(self, workers=None, acquire_timeout=60):
+        super().__init__()
+        self.size = workers or os.cpu_count() or 1
+        self.acquire_timeout = acquire_timeout
+        self._idle = queue.Queue()
+        self._workers = []
+        self._started_pool = False
+        self._context = multiprocessing.get_context('spawn')
+
+    def available(self):
+        return lameenc is not None
+
+    def supports(self, output_settings):
+        return (self.available() and output_settings['format'] == 'mp3'
+                and output_settings['sample_rate'] == PCM_SAMPLE_RATE)
+
+    def _ensure_started(self):
+        with self._lock:
+            if self._started_pool:
+                return
+            self._started_pool = True
+            for index in range(self.size):
+                worker = PoolWorker(self._context, index)
+                self._workers.append(worker)
+                self._idle.put(worker)
+        print(f"[ENCODER] Started {self.size} encoder worker processes")
+
+    def _return_worker(self, worker, failed):
+        if failed and worker.process.is_alive():
+            # Drop the half-finished encoder; restart the worker if it doesn't answer
+            try:
+                worker.call('end')
+                failed = False
+            except Exception:
+                pass
+        if failed or not worker.process.is_alive():
+            worker.stop()
+            replacement = PoolWorker(self._context, worker.index)
+            with self._lock:
+                self._workers[worker.index] = replacement
+            worker = replacement
+        self._idle.put(worker)
+
+    def open(self, output_path, output_settings, on_output=None, timeout=None):
+        self._ensure_started()
+        try:
+            worker = self._idle.get(timeout=min(self.acquire_timeout, timeout) if timeout is not None
+                                    else self.acquire_timeout)
+        except queue.Empty:
+            raise AudioEncodeError("No encoder worker became free in time")
+        self._started()
+
+        def release(failed=False):
+            self._finished(failed)
+            self._return_worker(worker, failed)
+
+        try:
+            return PoolSink(worker, output_path, output_settings.get('bitrate'), on_output=on_output, on_done=release)
+        except Exception as e:
+            release(failed=True)
+            raise AudioEncodeError(f"Failed to start encoder: {e}")
+
+    def stats(self):
+        result = super().stats()
+        result.update({'workers': self.size, 'idle_workers': self._idle.qsize(), 'started': self._started_pool})
+        return result
+
+    def shutdown(self):
+        for worker in self._workers:
+            worker.stop()
+
+ENCODER_BACKENDS = {
+    'ffmpeg': FfmpegBackend,
+    'inprocess': InProcessBackend,
+    'pool': EncoderPoolBackend
+}
+
+class EncoderManager:
+    """Route encodes to the configured backend, falling back to ffmpeg for unsupported output"""
+
+    def __init__(self, backend_name='ffmpeg', max_ffmpeg_processes=None, pool_workers=None):
+        if backend_name not in ENCODER_BACKENDS:
+            raise ValueError(f"Unknown encoder backend: {backend_name}")
+        self.ffmpeg = FfmpegBackend(max_ffmpeg_processes)
+        if backend_name == 'ffmpeg':
+            self.backend = self.ffmpeg
+        elif backend_name == 'pool':
+            self.backend = EncoderPoolBackend(pool_workers)
+        else:
+            self.backend = ENCODER_BACKENDS[backend_name]()
+        if not self.backend.available():
+            print(f"[ENCODER] Backend '{backend_name}' is not available (lameenc not installed), using ffmpeg")
+            self.backend = self.ffmpeg
+        self.fallbacks = 0
+
+    def open(self, output_path, output_settings, on_output=None, timeout=None):
+        """Open a PCM sink writing output_settings-encoded audio to output_path.
+
+        timeout bounds the wait for a free encoder slot (None waits as long as needed).
+        """
+        if self.backend is not self.ffmpeg:
+            if self.backend.supports(output_settings):
+                return self.backend.open(output_path, output_settings, on_output, timeout=timeout)
+            self.fallbacks += 1
+        return self.ffmpeg.open(output_path, output_settings, on_output, timeout=timeout)
+
+    def transcode(self, input_path, output_path, output_settings):
+        self.ffmpeg.transcode(input_path, output_path, output_settings)
+
+    def stats(self):
+        backends = [self.backend.stats()]
+        if self.backend is not self.ffmpeg:
+            backends.append(self.ffmpeg.stats())
+        return {'backend': self.backend.name, 'fallbacks': self.fallbacks, 'backends': backends}
+
+def _benchmark_pcm(seconds):
+    """Synthetic speech-like PCM (amplitude-modulated tone) of the given length"""
+    one_second = b''.join(
+        struct.pack('<h', int(8000 * math.sin(2 * math.pi * 220 * i / PCM_SAMPLE_RATE)
+                             * (0.5 + 0.5 * math.sin(2 * math.pi * 3 * i / PCM_SAMPLE_RATE))))
+        for i in range(PCM_SAMPLE_RATE)
+    )
+    whole_seconds, fraction = divmod(seconds, 1)
+    return one_second * int(whole_seconds) + one_second[:int(fraction * PCM_SAMPLE_RATE) * 2]
+
+def run_benchmark(backend_names=None, text_lengths=(50, 200, 1000, 4000), iterations=5, concurrency=None,
+                  chars_per_second=15, output_dir=None, chunk_size=64 * 1024):
+    """Encode synthetic PCM sized like Gemini output for each text length with each backend.
+
+    Returns a list of result dicts with per-encode latency and throughput
+    (seconds of audio encoded per wall-clock second).
+    """
+    import tempfile
+    from concurrent.futures import ThreadPoolExecutor
+
+    backend_names = backend_names or list(ENCODER_BACKENDS)
+    concurrency = concurrency or os.cpu_count() or 1
+    output_dir = output_dir or tempfile.mkdtemp(prefix='encoder_bench_')
+    output_settings = {'format': 'mp3', 'sample_rate': PCM_SAMPLE_RATE, 'channels': PCM_CHANNELS}
+    results = []
+
+    for backend_name in backend_names:
+        backend = ENCODER_BACKENDS[backend_name]()
+        if not backend.available():
+            results.append({'backend': backend_name, 'error': 'not available (lameenc not installed)'})
+            continue
+
+        for text_length in text_lengths:
+            audio_seconds = max(text_length / chars_per_second, 0.5)
+            pcm = _benchmark_pcm(audio_seconds)
+
+            def encode_once(index):
+                output_path = os.path.join(output_dir, f'{backend_name}_{text_length}_{index}.mp3')
+                started = time.time()
+                sink = backend.open(output_path, output_settings)
+                for offset in range(0, len(pcm), chunk_size):
+                    sink.write(pcm[offset:offset + chunk_size])
+                sink.close()
+                latency = time.time() - started
+                os.remove(output_path)
+                return latency
+
+            try:
+                encode_once('warmup')
+                started = time.time()
+                with ThreadPoolExecutor(max_workers=concurrency) as executor:
+                    latencies = sorted(executor.map(encode_once, range(iterations)))
+                elapsed = time.time() - started
+            except Exception as e:
+                results.append({'backend': backend_name, 'text_length': text_length, 'error': str(e)})
+                continue
+
+            results.append({
+                'backend': backend_name,
+                'text_length': text_length,
+                'audio_seconds': round(audio_seconds, 2),
+                'iterations': iterations,
+                'concurrency': concurrency,
+                'latency_p50': round(latencies[len(latencies) // 2], 4),
+                'latency_max': round(latencies[-1], 4),
+                'audio_seconds_per_second': round(audio_seconds * iterations / elapsed, 1) if elapsed else None
+            })
+
+        backend.shutdown()
+
+    return results
+
+if __name__ == '__main__':
+    # python audio_encoders.py [backend ...]
+    names = sys.argv[1:] or None
+    for result in run_benchmark(names):
+        if 'error' in result:
+            print(f"{result['backend']:>10} {result.get('text_length', ''):>6}  ERROR: {result['error']}")
+        else:
+            print(f"{result['backend']:>10} {result['text_length']:>6} chars  {result['audio_seconds']:>6}s audio  "
+                  f"p50 {result['latency_p50']:.4f}s  max {result['latency_max']:.4f}s  "
+                  f"{result['audio_seconds_per_second']}x realtime")
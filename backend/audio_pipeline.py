@@ -0,0 +1,373 @@
+import re
+import os
+import binascii
+import wave
+import threading
+import ffmpeg
+
+# Gemini TTS returns raw signed 16-bit little-endian PCM, 24 kHz, mono
+PCM_FORMAT = 's16le'
+PCM_SAMPLE_RATE = 24000
+PCM_CHANNELS = 1
+PCM_SAMPLE_WIDTH = 2
+PCM_BYTES_PER_SECOND = PCM_SAMPLE_RATE * PCM_CHANNELS * PCM_SAMPLE_WIDTH  # 48000
+
+# Output formats clients can ask for: file extension, ffmpeg codec, mimetype and
+# whether a bitrate applies
+OUTPUT_FORMATS = {
+    'mp3': {'ext': 'mp3', 'codec': 'libmp3lame', 'mimetype': 'audio/mpeg', 'bitrate': True},
+    'opus': {'ext': 'opus', 'codec': 'libopus', 'mimetype': 'audio/ogg', 'bitrate': True},
+    'wav': {'ext': 'wav', 'codec': 'pcm_s16le', 'mimetype': 'audio/wav', 'bitrate': False},
+    'flac': {'ext': 'flac', 'codec': 'flac', 'mimetype': 'audio/flac', 'bitrate': False}
+}
+SUPPORTED_SAMPLE_RATES = (8000, 12000, 16000, 22050, 24000, 44100, 48000)
+OPUS_SAMPLE_RATES = (8000, 12000, 16000, 24000, 48000)
+
+def encoder_output_kwargs(output_format, sample_rate=PCM_SAMPLE_RATE, bitrate=None):
+    """ffmpeg output arguments for an entry of OUTPUT_FORMATS"""
+    kwargs = {'acodec': OUTPUT_FORMATS[output_format]['codec'], 'ar': str(sample_rate), 'ac': str(PCM_CHANNELS)}
+    if bitrate and OUTPUT_FORMATS[output_format]['bitrate']:
+        kwargs['audio_bitrate'] = f'{bitrate}k'
+    return kwargs
+
+def pcm_sample_count(num_bytes):
+    """Number of complete samples in num_bytes of PCM"""
+    return num_bytes // (PCM_SAMPLE_WIDTH * PCM_CHANNELS)
+
+def pcm_duration(num_bytes):
+    """Exact duration in seconds of num_bytes of PCM"""
+    return pcm_sample_count(num_bytes) / PCM_SAMPLE_RATE
+
+def pcm_silence(milliseconds):
+    """PCM bytes for the given duration of silence"""
+    samples = int(PCM_SAMPLE_RATE * max(0, milliseconds) / 1000)
+    return b'\x00' * (samples * PCM_SAMPLE_WIDTH * PCM_CHANNELS)
+
+class AudioEncodeError(Exception):
+    """Raised when the audio encoder fails"""
+    pass
+
+class GeminiAudioDecoder:
+    """Incrementally extract and base64-decode inlineData.data from a streamed Gemini JSON response"""
+
+    DATA_PATTERN = re.compile(rb'"inlineData"\s*:\s*\{[^{}]*?"data"\s*:\s*"')
+    MAX_HEADER_BYTES = 1024 * 1024  # Give up if no audio field shows up in the first 1 MB
+
+    def __init__(self):
+        self.state = 'seek'  # seek -> data -> done
+        self.pcm_bytes = 0
+        self._header = bytearray()
+        self._b64_tail = b''
+
+    def feed(self, chunk):
+        """Feed raw response bytes and return any newly decoded PCM bytes"""
+        if self.state == 'seek':
+            self._header.extend(chunk)
+            match = self.DATA_PATTERN.search(self._header)
+            if not match:
+                if len(self._header) > self.MAX_HEADER_BYTES:
+                    raise Exception("Invalid response structure from Gemini: no audio data found")
+                return b''
+            chunk = bytes(self._header[match.end():])
+            del self._header[match.start():]
+            self.state = 'data'
+
+        if self.state != 'data':
+            return b''
+
+        end = chunk.find(b'"')
+        if end != -1:
+            chunk = chunk[:end]
+            self.state = 'done'
+
+        # Base64 never contains backslashes; JSON may escape "/" as "\/"
+        data = self._b64_tail + chunk.replace(b'\\', b'')
+        usable = len(data) if self.state == 'done' else len(data) - len(data) % 4
+        self._b64_tail = data[usable:]
+        if not usable:
+            return b''
+
+        pcm = binascii.a2b_base64(data[:usable])
+        self.pcm_bytes += len(pcm)
+        return pcm
+
+    def finish(self):
+        """Verify that the complete audio field was received"""
+        if self.state == 'seek':
+            snippet = self._header[:300].decode('utf-8', errors='replace')
+            raise Exception(f"Invalid response structure from Gemini: {snippet}")
+        if self.state == 'data':
+            raise Exception("Truncated audio data from Gemini")
+        if not self.pcm_bytes:
+            raise Exception("Empty audio data from Gemini")
+
+class StreamingEncoder:
+    """Encode raw PCM written chunk by chunk through an ffmpeg process stdin.
+
+    With on_output, ffmpeg writes to stdout instead and a reader thread both
+    saves the encoded bytes to output_path and hands them to on_output as
+    they are produced.
+    """
+
+    OUTPUT_READ_SIZE = 16 * 1024
+
+    def __init__(self, output_path, on_output=None, **output_kwargs):
+        self.output_path = output_path
+        self.on_output = on_output
+        self.bytes_written = 0
+        self._closed = False
+        self._reader = None
+        self._reader_error = None
+        try:
+            if on_output:
+                output_kwargs.setdefault('format', os.path.splitext(output_path)[1].lstrip('.') or 'mp3')
+                output = ffmpeg.input('pipe:', f=PCM_FORMAT, ar=str(PCM_SAMPLE_RATE), ac=str(PCM_CHANNELS)).output('pipe:', **output_kwargs)
+            else:
+                output = ffmpeg.input('pipe:', f=PCM_FORMAT, ar=str(PCM_SAMPLE_RATE), ac=str(PCM_CHANNELS)).output(output_path, **output_kwargs)
+            self.process = (
+                output
+                .global_args('-hide_banner', '-nostats', '-loglevel', 'error')
+                .overwrite_output()
+                .run_async(pipe_stdin=True, pipe_stdout=bool(on_output), pipe_stderr=True)
+            )
+        except Exception as e:
+            raise AudioEncodeError(f"Failed to start encoder: {e}")
+
+        if on_output:
+            self._reader = threading.Thread(target=self._read_output, daemon=True)
+            self._reader.start()
+
+    def _read_output(self):
+        try:
+            with open(self.output_path, 'wb') as f:
+                while True:
+                    data = os.read(self.process.stdout.fileno(), self.OUTPUT_READ_SIZE)
+                    if not data:
+                        break
+                    f.write(data)
+                    try:
+                        self.on_output(data)
+                    except Exception as e:
+                        # A failing listener must not stop the file from being written
+                        print(f"[ENCODER] Output listener failed: {e}")
+        except Exception as e:
+            self._reader_error = e
+
+    def write(self, pcm_chunk):
+        if not pcm_chunk:
+            return
+        try:
+            self.process.stdin.write(pcm_chunk)
+            self.bytes_written += len(pcm_chunk)
+        except (BrokenPipeError, OSError) as e:
+            self.abort()
+            raise AudioEncodeError(f"Encoder stopped accepting audio: {e}")
+
+    def close(self):
+        """Finish encoding and raise AudioEncodeError if ffmpeg failed"""
+        if self._closed:
+            return
+        self._closed = True
+        try:
+            self.process.stdin.close()
+        except Exception:
+            pass
+        stderr = self.process.stderr.read() if self.process.stderr else b''
+        return_code = self.process.wait()
+        if self._reader:
+            self._reader.join()
+        if return_code != 0:
+            self._remove_output()
+            raise AudioEncodeError(f"ffmpeg exited with {return_code}: {stderr.decode('utf-8', errors='replace')[:300]}")
+        if self._reader_error:
+            self._remove_output()
+            raise AudioEncodeError(f"Failed to save encoded audio: {self._reader_error}")
+
+    def abort(self):
+        """Kill the encoder and remove any partial output"""
+        if self._closed:
+            return
+        self._closed = True
+        try:
+            self.process.kill()
+            self.process.wait()
+        except Exception:
+            pass
+        if self._reader:
+            self._reader.join(timeout=5)
+        self._remove_output()
+
+    def _remove_output(self):
+        try:
+            os.remove(self.output_path)
+        except OSError:
+            pass
+
+class PcmBuffer:
+    """In-memory PCM sink with the same write/abort interface as StreamingEncoder"""
+
+    def __init__(self):
+        self.data = bytearray()
+
+    def write(self, pcm_chunk):
+        self.data.extend(pcm_chunk)
+
+    def close(self):
+        pass
+
+    def abort(self):
+        self.data = bytearray()
+
+class WavWriter:
+    """Write PCM straight to a WAV file without an encoder process"""
+
+    def __init__(self, output_path, on_output=None):
+        self.output_path = output_path
+        self.on_output = on_output
+        self.bytes_written = 0
+        self._closed = False
+        self._wav = wave.open(output_path, 'wb')
+        self._wav.setnchannels(PCM_CHANNELS)
+        self._wav.setsampwidth(PCM_SAMPLE_WIDTH)
+        self._wav.setframerate(PCM_SAMPLE_RATE)
+        if on_output:
+            # Streamed WAV has an unknown length; players accept a maximal size header
+            self.on_output(self._streaming_header())
+
+    def _streaming_header(self):
+        byte_rate = PCM_BYTES_PER_SECOND
+        block_align = PCM_CHANNELS * PCM_SAMPLE_WIDTH
+        return (b'RIFF' + (0xFFFFFFFF).to_bytes(4, 'little') + b'WAVEfmt ' + (16).to_bytes(4, 'little')
+                + (1).to_bytes(2, 'little') + PCM_CHANNELS.to_bytes(2, 'little')
+                + PCM_SAMPLE_RATE.to_bytes(4, 'little') + byte_rate.to_bytes(4, 'little')
+                + block_align.to_bytes(2, 'little') + (PCM_SAMPLE_WIDTH * 8).to_bytes(2, 'little')
+                + b'data' + (0xFFFFFFFF).to_bytes(4, 'little'))
+
+    def write(self, pcm_chunk):
+        if not pcm_chunk:
+            return
+        self._wav.writeframesraw(pcm_chunk)
+        self.bytes_written += len(pcm_chunk)
+        if self.on_output:
+            try:
+                self.on_output(bytes(pcm_chunk))
+            except Exception as e:
+                print(f"[ENCODER] Output listener failed: {e}")
+
+    def close(self):
+        if self._closed:
+            return
+        self._closed = True
+        try:
+            self._wav.close()  # Rewrites the header with the real length
+        except Exception as e:
+            raise AudioEncodeError(f"Failed to write WAV file: {e}")
+
+    def abort(self):
+        if self._closed:
+            return
+        self._closed = True
+        try:
+            self._wav.close()
+        except Exception:
+            pass
+        try:
+            os.remove(self.output_path)
+        except OSError:
+            pass
+
+class TeeSink:
+    """Write the same PCM to several sinks, e.g. the client encoder and the canonical WAV"""
+
+    def __init__(self, *sinks):
+        self.sinks = sinks
+
+    def write(self, pcm_chunk):
+        for sink in self.sinks:
+            sink.write(pcm_chunk)
+
+    def close(self):
+        for index, sink in enumerate(self.sinks):
+            try:
+                sink.close()
+            except Exception:
+                for other in self.sinks[index + 1:]:
+                    other.abort()
+                raise
+
+    def abort(self):
+        for sink in self.sinks:
+            sink.abort()
+
+def transcode_file(input_path, output_path, **output_kwargs):
+    """Transcode an audio file with ffmpeg, raising AudioEncodeError on failure"""
+    try:
+        (
+            ffmpeg
+            .input(input_path)
+            .output(output_path, **output_kwargs)
+            .global_args('-hide_banner', '-nostats', '-loglevel', 'error')
+            .overwrite_output()
+            .run(capture_stdout=True, capture_stderr=True)
+        )
+    except ffmpeg.Error as e:
+        try:
+            os.remove(output_path)
+        except OSError:
+            pass
+        raise AudioEncodeError(f"Transcode failed: {(e.stderr or b'').decode('utf-8', errors='replace')[:300]}")
+    except Exception as e:
+        raise AudioEncodeError(f"Transcode failed: {e}")
+
+class AudioStream:
+    """Growing buffer of encoded audio that any number of readers can follow.
+
+    The producer calls write() as bytes arrive and finish() or fail() at the
+    end; each iteration starts from the first byte and blocks for more data
+    until the stream is finished.
+    """
+
+    def __init__(self):
+        self._data = bytearray()
+        self._condition = threading.Condition()
+        self.finished = False
+        self.error = None
+
+    def write(self, data):
+        with self._condition:
+            self._data.extend(data)
+            self._condition.notify_all()
+
+    def finish(self):
+        with self._condition:
+            self.finished = True
+            self._condition.notify_all()
+
+    def fail(self, error):
+        with self._condition:
+            self.error = error
+            self.finished = True
+            self._condition.notify_all()
+
+    def wait_for_data(self, timeout=None):
+        """Block until the first bytes arrive or the stream ends; True if data is available"""
+        with self._condition:
+            self._condition.wait_for(lambda: self._data or self.finished, timeout=timeout)
+            return bool(self._data)
+
+    def __len__(self):
+        with self._condition:
+            return len(self._data)
+
+    def __iter__(self):
+        offset = 0
+        while True:
+            with self._condition:
+                self._condition.wait_for(lambda: len(self._data) > offset or self.finished)
+                chunk = bytes(self._data[offset:])
+                done = self.finished
+            if chunk:
+                offset += len(chunk)
+                yield chunk
+            elif done:
+                return
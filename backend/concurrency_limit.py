@@ -0,0 +1,116 @@
+import threading
+import time
+from collections import deque
+
+class AdaptiveConcurrencyLimit:
+    """AIMD concurrency limit driven by the outcome of upstream (Gemini) calls.
+
+    While the limit is in use and latency stays near its long-term baseline,
+    the limit grows by one after every `limit` successful calls. A 429/5xx or
+    a latency spike (recent latency above latency_tolerance x baseline) cuts
+    it by decrease_factor, at most once per cooldown so one incident doesn't
+    collapse it to the minimum. on_change(limit) is called whenever it moves.
+    """
+
+    def __init__(self, initial, min_limit, max_limit, on_change=None, decrease_factor=0.5,
+                 latency_tolerance=2.0, cooldown=5.0, min_samples=20, history_size=200):
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.limit = min(max(initial, min_limit), max_limit)
+        self.on_change = on_change
+        self.decrease_factor = decrease_factor
+        self.latency_tolerance = latency_tolerance
+        self.cooldown = cooldown
+        self.min_samples = min_samples
+        self._lock = threading.Lock()
+        self._successes = 0
+        self._samples = 0
+        self._baseline = None  # Slow EWMA of normalized latency
+        self._recent = None  # Fast EWMA of normalized latency
+        self._last_decrease = 0.0
+        self.increases = 0
+        self.decreases = 0
+        self.history = deque(maxlen=history_size)
+        self._record(self.limit, 'initial')
+
+    def on_success(self, latency, saturated=True):
+        """Record a successful upstream call; latency should be normalized for request size.
+
+        saturated tells whether callers were actually waiting on the limit;
+        an idle system gives no evidence that a higher limit would be safe.
+        """
+        with self._lock:
+            self._samples += 1
+            self._recent = latency if self._recent is None else 0.7 * self._recent + 0.3 * latency
+            if self._baseline is None:
+                self._baseline = latency
+            else:
+                # Spikes move the baseline only slowly, so it follows a lasting shift
+                # in upstream latency without absorbing a short burst
+                alpha = 0.05 if self._recent <= self._baseline * self.latency_tolerance else 0.01
+                self._baseline = (1 - alpha) * self._baseline + alpha * latency
+
+            if self._samples >= self.min_samples and self._recent > self._baseline * self.latency_tolerance:
+                changed = self._decrease_locked('latency')
+            elif saturated and self.limit < self.max_limit:
+                self._successes += 1
+                changed = self._successes >= self.limit and self._set_locked(self.limit + 1, 'increase')
+            else:
+                changed = False
+            limit = self.limit
+
+        if changed and self.on_change:
+            self.on_change(limit)
+
+    def on_overload(self, reason):
+        """Record an upstream overload signal (429, 5xx, timeout)"""
+        with self._lock:
+            changed = self._decrease_locked(reason)
+            limit = self.limit
+        if changed and self.on_change:
+            self.on_change(limit)
+
+    def _decrease_locked(self, reason):
+        now = time.monotonic()
+        if now - self._last_decrease < self.cooldown:
+            return False
+        self._last_decrease = now
+        if reason == 'latency':
+            # Start the next comparison fresh instead of re-triggering on the same spike
+            self._recent = self._baseline
+        return self._set_locked(int(self.limit * self.decrease_factor), reason)
+
+    def _set_locked(self, limit, reason):
+        self._successes = 0
+        limit = min(max(limit, self.min_limit), self.max_limit)
+        if limit == self.limit:
+            return False
+        if limit > self.limit:
+            self.increases += 1
+        else:
+            self.decreases += 1
+        print(f"[CONCURRENCY] Limit {self.limit} -> {limit} ({reason})")
+        self.limit = limit
+        self._record(limit, reason)
+        return True
+
+    def _record(self, limit, reason):
+        self.history.append({
+            'time': time.strftime('%Y-%m-%d %H:%M:%S'),
+            'limit': limit,
+            'reason': reason
+        })
+
+    def stats(self):
+        with self._lock:
+            return {
+                'limit': self.limit,
+                'min_limit': self.min_limit,
+                'max_limit': self.max_limit,
+                'baseline_latency': round(self._baseline, 4) if self._baseline is not None else None,
+                'recent_latency': round(self._recent, 4) if self._recent is not None else None,
+                'latency_tolerance': self.latency_tolerance,
+                'increases': self.increases,
+                'decreases': self.decreases,
+                'history': list(self.history)
+            }
@@ -5,12 +5,14 @@ import hashlib
 import secrets
 import threading
 import time
+import json
 
 class DatabaseManager:
-    def __init__(self, db_path="voice_api.db"):
+    def __init__(self, db_path="voice_api.db", init=True):
         self.db_path = db_path
         self._log_lock = threading.Lock()  # Lock for log_usage operations
-        self.init_database()
+        if init:
+            self.init_database()
     
     def init_database(self):
         """Initialize database with required tables"""
@@ -40,6 +42,9 @@ class DatabaseManager:
                 api_key VARCHAR(255) UNIQUE NOT NULL,
                 daily_limit INTEGER DEFAULT 100,
                 monthly_limit INTEGER DEFAULT 3000,
+                max_concurrent INTEGER DEFAULT 3,
+                queue_weight INTEGER DEFAULT 1,
+                priority VARCHAR(20) DEFAULT 'normal',
                 total_usage INTEGER DEFAULT 0,
                 expires_at TIMESTAMP,
                 is_active BOOLEAN DEFAULT 1,
@@ -161,6 +166,31 @@ class DatabaseManager:
             )
         ''')
         
+        # Asynchronous voice jobs
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS voice_jobs (
+                id VARCHAR(64) PRIMARY KEY,
+                api_key_id INTEGER,
+                request_data TEXT NOT NULL,
+                status VARCHAR(20) DEFAULT 'queued',
+                filename VARCHAR(255),
+                duration REAL,
+                samples INTEGER,
+                cached BOOLEAN DEFAULT 0,
+                error TEXT,
+                error_status INTEGER,
+                ip_address VARCHAR(45),
+                user_agent TEXT,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                started_at TIMESTAMP,
+                finished_at TIMESTAMP,
+                worker_id VARCHAR(64),
+                heartbeat_at TIMESTAMP,
+                FOREIGN KEY (api_key_id) REFERENCES api_keys (id)
+            )
+        ''')
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_voice_jobs_status ON voice_jobs (status, created_at)')
+        
         conn.commit()
         conn.close()
         
@@ -290,6 +320,229 @@ class DatabaseManager:
             return {'usage_count': result[0], 'total_characters': result[1]}
         return {'usage_count': 0, 'total_characters': 0}
     
+    def get_setting(self, setting_key, default=None):
+        """Get admin setting value"""
+        conn = sqlite3.connect(self.db_path)
+        cursor = conn.cursor()
+
+        cursor.execute('SELECT setting_value FROM admin_settings WHERE setting_key = ?', (setting_key,))
+        result = cursor.fetchone()
+        conn.close()
+
+        return result[0] if result else default
+
+    def set_setting(self, setting_key, setting_value):
+        """Insert or update admin setting value"""
+        conn = sqlite3.connect(self.db_path)
+        cursor = conn.cursor()
+
+        cursor.execute('''
+            INSERT INTO admin_settings (setting_key, setting_value, updated_at)
+            VALUES (?, ?, CURRENT_TIMESTAMP)
+            ON CONFLICT(setting_key) DO UPDATE SET
+                setting_value = excluded.setting_value,
+                updated_at = CURRENT_TIMESTAMP
+        ''', (setting_key, setting_value))
+
+        conn.commit()
+        conn.close()
+
+    def get_active_gemini_keys(self):
+        """Get (id, api_key) for all active Gemini keys"""
+        conn = sqlite3.connect(self.db_path)
+        cursor = conn.cursor()
+
+        cursor.execute('SELECT id, api_key FROM gemini_keys WHERE is_active = 1 ORDER BY id')
+        rows = cursor.fetchall()
+        conn.close()
+
+        return rows
+
+    def get_gemini_keys_version(self):
+        """Get version stamp that changes whenever the Gemini key list changes"""
+        return self.get_setting('gemini_keys_version', '0')
+
+    def bump_gemini_keys_version(self):
+        """Mark the Gemini key list as changed for all server processes"""
+        version = f"{int(time.time() * 1000)}-{secrets.token_hex(4)}"
+        self.set_setting('gemini_keys_version', version)
+        return version
+
+    def get_gemini_key_budgets(self):
+        """Get remaining daily/monthly budget for all active Gemini keys"""
+        today = datetime.now().date()
+        current_month = datetime.now().strftime('%Y-%m')
+
+        conn = sqlite3.connect(self.db_path)
+        cursor = conn.cursor()
+
+        cursor.execute('''
+            SELECT gk.id, gk.daily_limit, gk.monthly_limit,
+                   COALESCE(gd.usage_count, 0), COALESCE(gm.usage_count, 0)
+            FROM gemini_keys gk
+            LEFT JOIN gemini_daily_usage gd ON gd.gemini_key_id = gk.id AND gd.usage_date = ?
+            LEFT JOIN gemini_monthly_usage gm ON gm.gemini_key_id = gk.id AND gm.usage_month = ?
+            WHERE gk.is_active = 1
+        ''', (today, current_month))
+
+        rows = cursor.fetchall()
+        conn.close()
+
+        budgets = {}
+        for key_id, daily_limit, monthly_limit, daily_count, monthly_count in rows:
+            budgets[key_id] = {
+                'daily_remaining': daily_limit - daily_count if daily_limit is not None else None,
+                'monthly_remaining': monthly_limit - monthly_count if monthly_limit is not None else None
+            }
+        return budgets
+
+    def create_voice_job(self, job_id, api_key_id, request_data, ip_address=None, user_agent=None):
+        """Persist a new queued voice job"""
+        conn = sqlite3.connect(self.db_path)
+        cursor = conn.cursor()
+
+        cursor.execute('''
+            INSERT INTO voice_jobs (id, api_key_id, request_data, status, ip_address, user_agent)
+            VALUES (?, ?, ?, 'queued', ?, ?)
+        ''', (job_id, api_key_id, json.dumps(request_data), ip_address, user_agent))
+
+        conn.commit()
+        conn.close()
+
+    def get_voice_job(self, job_id):
+        """Get a voice job as a dict, or None if it doesn't exist"""
+        conn = sqlite3.connect(self.db_path)
+        conn.row_factory = sqlite3.Row
+        cursor = conn.cursor()
+
+        cursor.execute('SELECT * FROM voice_jobs WHERE id = ?', (job_id,))
+        row = cursor.fetchone()
+        conn.close()
+
+        if not row:
+            return None
+        job = dict(row)
+        job['request_data'] = json.loads(job['request_data'])
+        return job
+
+    def claim_voice_job(self, job_id, worker_id):
+        """Mark a queued voice job as running for worker_id; False if another worker claimed it first"""
+        conn = sqlite3.connect(self.db_path)
+        cursor = conn.cursor()
+
+        cursor.execute('''
+            UPDATE voice_jobs
+            SET status = 'running', started_at = CURRENT_TIMESTAMP, worker_id = ?, heartbeat_at = CURRENT_TIMESTAMP
+            WHERE id = ? AND status = 'queued'
+        ''', (worker_id, job_id))
+        claimed = cursor.rowcount == 1
+
+        conn.commit()
+        conn.close()
+
+        return claimed
+
+    def heartbeat_voice_jobs(self, worker_id):
+        """Record that the jobs worker_id is running are still alive"""
+        conn = sqlite3.connect(self.db_path)
+        cursor = conn.cursor()
+
+        cursor.execute('''
+            UPDATE voice_jobs SET heartbeat_at = CURRENT_TIMESTAMP
+            WHERE status = 'running' AND worker_id = ?
+        ''', (worker_id,))
+
+        conn.commit()
+        conn.close()
+
+    def finish_voice_job(self, job_id, filename, duration, samples=None, cached=False):
+        """Mark a voice job as succeeded with its output file"""
+        conn = sqlite3.connect(self.db_path)
+        cursor = conn.cursor()
+
+        cursor.execute('''
+            UPDATE voice_jobs
+            SET status = 'succeeded', filename = ?, duration = ?, samples = ?, cached = ?,
+                finished_at = CURRENT_TIMESTAMP
+            WHERE id = ?
+        ''', (filename, duration, samples, cached, job_id))
+
+        conn.commit()
+        conn.close()
+
+    def fail_voice_job(self, job_id, error, error_status=500):
+        """Mark a voice job as failed"""
+        conn = sqlite3.connect(self.db_path)
+        cursor = conn.cursor()
+
+        cursor.execute('''
+            UPDATE voice_jobs
+            SET status = 'failed', error = ?, error_status = ?, finished_at = CURRENT_TIMESTAMP
+            WHERE id = ?
+        ''', (error, error_status, job_id))
+
+        conn.commit()
+        conn.close()
+
+    def requeue_stale_voice_jobs(self, stale_seconds):
+        """Reset running jobs whose worker sent no heartbeat for stale_seconds (its process died);
+        returns the number of jobs reset"""
+        conn = sqlite3.connect(self.db_path)
+        cursor = conn.cursor()
+
+        cursor.execute('''
+            UPDATE voice_jobs SET status = 'queued', started_at = NULL, worker_id = NULL, heartbeat_at = NULL
+            WHERE status = 'running' AND (heartbeat_at IS NULL OR heartbeat_at < datetime('now', ?))
+        ''', (f'-{int(stale_seconds)} seconds',))
+        requeued = cursor.rowcount
+
+        conn.commit()
+        conn.close()
+
+        return requeued
+
+    def get_queued_voice_job_ids(self, min_age=0):
+        """Ids of queued jobs created at least min_age seconds ago, oldest first"""
+        conn = sqlite3.connect(self.db_path)
+        cursor = conn.cursor()
+
+        cursor.execute('''
+            SELECT id FROM voice_jobs
+            WHERE status = 'queued' AND created_at <= datetime('now', ?)
+            ORDER BY created_at, rowid
+        ''', (f'-{int(min_age)} seconds',))
+        job_ids = [row[0] for row in cursor.fetchall()]
+        conn.close()
+
+        return job_ids
+
+    def get_voice_job_counts(self):
+        """Get number of voice jobs per status"""
+        conn = sqlite3.connect(self.db_path)
+        cursor = conn.cursor()
+
+        cursor.execute('SELECT status, COUNT(*) FROM voice_jobs GROUP BY status')
+        counts = dict(cursor.fetchall())
+        conn.close()
+
+        return counts
+
+    def delete_old_voice_jobs(self, days=7):
+        """Delete finished voice jobs older than the given number of days"""
+        conn = sqlite3.connect(self.db_path)
+        cursor = conn.cursor()
+
+        cursor.execute('''
+            DELETE FROM voice_jobs
+            WHERE status IN ('succeeded', 'failed') AND finished_at < datetime('now', ?)
+        ''', (f'-{int(days)} days',))
+        deleted = cursor.rowcount
+
+        conn.commit()
+        conn.close()
+
+        return deleted
+
     def add_missing_columns(self):
         conn = sqlite3.connect(self.db_path)
         cursor = conn.cursor()
@@ -310,11 +563,43 @@ class DatabaseManager:
             if 'total_usage' not in columns:
                 cursor.execute('ALTER TABLE api_keys ADD COLUMN total_usage INTEGER DEFAULT 0')
                 print("Added total_usage column to api_keys table")
+
+            if 'max_concurrent' not in columns:
+                # No default here: existing keys stay uncapped (NULL); new keys get their cap when created
+                cursor.execute('ALTER TABLE api_keys ADD COLUMN max_concurrent INTEGER')
+                print("Added max_concurrent column to api_keys table")
+
+            if 'queue_weight' not in columns:
+                cursor.execute('ALTER TABLE api_keys ADD COLUMN queue_weight INTEGER DEFAULT 1')
+                print("Added queue_weight column to api_keys table")
+
+            if 'priority' not in columns:
+                cursor.execute("ALTER TABLE api_keys ADD COLUMN priority VARCHAR(20) DEFAULT 'normal'")
+                print("Added priority column to api_keys table")
             
+            cursor.execute("PRAGMA table_info(voice_jobs)")
+            job_columns = [column[1] for column in cursor.fetchall()]
+
+            if 'worker_id' not in job_columns:
+                cursor.execute('ALTER TABLE voice_jobs ADD COLUMN worker_id VARCHAR(64)')
+                print("Added worker_id column to voice_jobs table")
+
+            if 'heartbeat_at' not in job_columns:
+                cursor.execute('ALTER TABLE voice_jobs ADD COLUMN heartbeat_at TIMESTAMP')
+                print("Added heartbeat_at column to voice_jobs table")
+
             # Check gemini_keys table
             cursor.execute("PRAGMA table_info(gemini_keys)")
             gemini_columns = [column[1] for column in cursor.fetchall()]
-            
+
+            if 'daily_limit' not in gemini_columns:
+                cursor.execute('ALTER TABLE gemini_keys ADD COLUMN daily_limit INTEGER DEFAULT 1000')
+                print("Added daily_limit column to gemini_keys table")
+
+            if 'monthly_limit' not in gemini_columns:
+                cursor.execute('ALTER TABLE gemini_keys ADD COLUMN monthly_limit INTEGER DEFAULT 30000')
+                print("Added monthly_limit column to gemini_keys table")
+
             conn.commit()
         except Exception as e:
             print(f"Error adding columns: {e}")
@@ -375,7 +660,8 @@ class DatabaseManager:
             }
         return None
     
-    def create_api_key(self, user_id, key_name, daily_limit=100, monthly_limit=3000, expires_days=None):
+    def create_api_key(self, user_id, key_name, daily_limit=100, monthly_limit=3000, expires_days=None,
+                       max_concurrent=3, queue_weight=1, priority='normal'):
         """Create API key for user"""
         conn = sqlite3.connect(self.db_path)
         cursor = conn.cursor()
@@ -387,9 +673,11 @@ class DatabaseManager:
         
         try:
             cursor.execute('''
-                INSERT INTO api_keys (user_id, key_name, api_key, daily_limit, monthly_limit, expires_at)
-                VALUES (?, ?, ?, ?, ?, ?)
-            ''', (user_id, key_name, api_key, daily_limit, monthly_limit, expires_at))
+                INSERT INTO api_keys (user_id, key_name, api_key, daily_limit, monthly_limit, expires_at,
+                                      max_concurrent, queue_weight, priority)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+            ''', (user_id, key_name, api_key, daily_limit, monthly_limit, expires_at, max_concurrent, queue_weight,
+                  priority))
             
             key_id = cursor.lastrowid
             conn.commit()
@@ -415,7 +703,7 @@ class DatabaseManager:
                 
                 cursor.execute('''
                     SELECT ak.id, ak.user_id, ak.daily_limit, ak.monthly_limit, ak.total_usage, ak.expires_at,
-                           u.username, u.role
+                           u.username, u.role, ak.max_concurrent, ak.queue_weight, ak.priority
                     FROM api_keys ak
                     JOIN users u ON ak.user_id = u.id
                     WHERE ak.api_key = ? AND ak.is_active = 1 AND u.is_active = 1
@@ -427,7 +715,8 @@ class DatabaseManager:
                     conn.close()
                     return None
                 
-                key_id, user_id, daily_limit, monthly_limit, total_usage, expires_at, username, role = key_data
+                (key_id, user_id, daily_limit, monthly_limit, total_usage, expires_at, username, role,
+                 max_concurrent, queue_weight, priority) = key_data
                 
                 # Check expiration
                 if expires_at and datetime.fromisoformat(expires_at) < datetime.now():
@@ -482,7 +771,10 @@ class DatabaseManager:
                     'username': username,
                     'role': role,
                     'daily_remaining': max(0, daily_limit - daily_count),  # Use current count
-                    'monthly_remaining': max(0, monthly_limit - monthly_count)  # Never negative
+                    'monthly_remaining': max(0, monthly_limit - monthly_count),  # Never negative
+                    'max_concurrent': max_concurrent,
+                    'queue_weight': queue_weight,
+                    'priority': priority or 'normal'
                 }
                 
             except Exception as e:
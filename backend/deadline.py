@@ -0,0 +1,52 @@
+import threading
+import time
+
+class DeadlineExceeded(Exception):
+    """Raised when a request runs past its deadline"""
+    pass
+
+class Deadline:
+    """Absolute point in time by which a request must be finished"""
+
+    def __init__(self, seconds):
+        self.seconds = seconds
+        self.expires_at = time.monotonic() + seconds
+
+    def remaining(self):
+        """Seconds left, never negative"""
+        return max(0.0, self.expires_at - time.monotonic())
+
+    def expired(self):
+        return time.monotonic() >= self.expires_at
+
+    def check(self, stage):
+        """Raise DeadlineExceeded if the deadline has passed; stage names the step for the error"""
+        if self.expired():
+            raise DeadlineExceeded(f"Request deadline of {self.seconds:g}s exceeded during {stage}")
+
+    def cap(self, seconds):
+        """Limit a timeout to the time left (None means no other limit)"""
+        remaining = self.remaining()
+        return remaining if seconds is None else min(seconds, remaining)
+
+_local = threading.local()
+
+class deadline_scope:
+    """Make a deadline visible to code that can't take it as an argument (e.g. urllib3 retries)"""
+
+    def __init__(self, deadline):
+        self.deadline = deadline
+        self.previous = None
+
+    def __enter__(self):
+        self.previous = getattr(_local, 'deadline', None)
+        _local.deadline = self.deadline
+        return self.deadline
+
+    def __exit__(self, exc_type, exc, tb):
+        _local.deadline = self.previous
+        return False
+
+def current_deadline():
+    """Deadline of the request handled by this thread, or None"""
+    return getattr(_local, 'deadline', None)
@@ -0,0 +1,102 @@
+import queue
+import threading
+
+class QueueFullError(Exception):
+    """Raised when the job queue has no room for another job"""
+    pass
+
+class VoiceJobQueue:
+    """Bounded FIFO of persisted voice job ids processed by a fixed pool of worker threads.
+
+    Job state lives in the database; the queue only holds ids, so queued jobs
+    can be recovered from the database after a restart or from another
+    process (the handler claims a job before running it). Callers can wait
+    for a job to finish through per-job events.
+    """
+
+    def __init__(self, handler, workers=4, max_queued=500):
+        self.handler = handler  # handler(job_id) runs the job and persists its result
+        self.workers = workers
+        self.max_queued = max_queued
+        self._queue = queue.Queue()
+        self._lock = threading.Lock()
+        self._events = {}  # job_id -> threading.Event set when the job finishes
+        self._threads = []
+        self.running = 0
+        self.completed = 0
+
+    def start(self, pending_job_ids=()):
+        """Start the worker threads, queueing job ids recovered from the database first"""
+        for job_id in pending_job_ids:
+            self.recover(job_id)
+        for i in range(self.workers):
+            thread = threading.Thread(target=self._work, name=f'voice-job-{i}', daemon=True)
+            thread.start()
+            self._threads.append(thread)
+        print(f"[JOBS] Started {self.workers} workers ({len(pending_job_ids)} recovered jobs)")
+
+    def has_room(self):
+        return self._queue.qsize() < self.max_queued
+
+    def submit(self, job_id):
+        """Queue a job id; raises QueueFullError if the queue is at capacity"""
+        if not self.has_room():
+            raise QueueFullError(f"Job queue is full ({self.max_queued} jobs)")
+        self._enqueue(job_id)
+
+    def recover(self, job_id):
+        """Queue a job found in the database unless this queue already holds it; True if queued"""
+        with self._lock:
+            if job_id in self._events:
+                return False
+        self._enqueue(job_id)
+        return True
+
+    def _enqueue(self, job_id):
+        with self._lock:
+            self._events.setdefault(job_id, threading.Event())
+        self._queue.put(job_id)
+
+    def wait(self, job_id, timeout):
+        """Block until the job finishes or timeout expires; False if it is not tracked or still running"""
+        with self._lock:
+            event = self._events.get(job_id)
+        if event is None:
+            return False
+        return event.wait(timeout)
+
+    def position(self, job_id):
+        """1-based position of a queued job, or None if it is not waiting"""
+        with self._queue.mutex:
+            for index, queued_id in enumerate(self._queue.queue):
+                if queued_id == job_id:
+                    return index + 1
+        return None
+
+    def _work(self):
+        while True:
+            job_id = self._queue.get()
+            with self._lock:
+                self.running += 1
+            try:
+                self.handler(job_id)
+            except Exception as e:
+                print(f"[JOBS] Job {job_id} crashed: {e}")
+            finally:
+                with self._lock:
+                    self.running -= 1
+                    self.completed += 1
+                    event = self._events.pop(job_id, None)
+                if event:
+                    event.set()
+                self._queue.task_done()
+
+    def stats(self):
+        with self._lock:
+            return {
+                'workers': self.workers,
+                'queued': self._queue.qsize(),
+                'running': self.running,
+                'completed': self.completed,
+                'max_queued': self.max_queued
+            }
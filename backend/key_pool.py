@@ -0,0 +1,74 @@
+import time
+import threading
+
+class GeminiKeyPool:
+    """Process-wide in-memory list of active Gemini keys, indexed by key and id.
+
+    Changes are announced through a version stamp in admin_settings, so every
+    worker process only re-reads gemini_keys when the stamp actually changes.
+    """
+
+    def __init__(self, db, check_interval=5):
+        self.db = db
+        self.check_interval = check_interval
+        self._lock = threading.Lock()
+        self._keys_data = []  # [(id, api_key), ...]
+        self._id_by_key = {}
+        self._key_by_id = {}
+        self._version = None
+        self._last_check = 0
+        self.reload_count = 0
+
+    def _load(self, version):
+        """Reload active keys from the database (caller must hold the lock)"""
+        keys_data = self.db.get_active_gemini_keys()
+        self._keys_data = keys_data
+        self._id_by_key = {api_key: key_id for key_id, api_key in keys_data}
+        self._key_by_id = {key_id: api_key for key_id, api_key in keys_data}
+        self._version = version
+        self.reload_count += 1
+        print(f"[KEY_POOL] Loaded {len(keys_data)} active Gemini keys (version {version})")
+
+    def _refresh_if_stale(self, force=False):
+        now = time.time()
+        with self._lock:
+            if not force and self.reload_count and now - self._last_check < self.check_interval:
+                return
+            self._last_check = now
+            try:
+                version = self.db.get_gemini_keys_version()
+                if force or not self.reload_count or version != self._version:
+                    self._load(version)
+            except Exception as e:
+                print(f"[KEY_POOL] Failed to refresh Gemini keys: {e}")
+
+    def active_keys(self):
+        """Get [(id, api_key), ...] for all active Gemini keys"""
+        self._refresh_if_stale()
+        with self._lock:
+            return list(self._keys_data)
+
+    def id_for_key(self, api_key):
+        with self._lock:
+            return self._id_by_key.get(api_key)
+
+    def key_for_id(self, key_id):
+        with self._lock:
+            return self._key_by_id.get(key_id)
+
+    def notify_changed(self):
+        """Bump the shared version stamp and reload this process immediately"""
+        try:
+            self.db.bump_gemini_keys_version()
+        except Exception as e:
+            print(f"[KEY_POOL] Failed to bump Gemini keys version: {e}")
+        self._refresh_if_stale(force=True)
+
+    def stats(self):
+        with self._lock:
+            return {
+                'active_keys': len(self._keys_data),
+                'version': self._version,
+                'reload_count': self.reload_count,
+                'check_interval': self.check_interval
+            }
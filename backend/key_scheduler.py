@@ -0,0 +1,223 @@
+import math
+import time
+import random
+import threading
+from collections import deque
+
+class KeyState:
+    """Runtime health state for a single Gemini key"""
+
+    def __init__(self, key_id, api_key):
+        self.key_id = key_id
+        self.api_key = api_key
+        self.latency_ewma = None
+        self.outcomes = deque(maxlen=20)  # True = success, False = failure
+        self.in_flight = 0
+        self.throttle_strikes = 0.0
+        self.strikes_updated_at = 0
+        self.cooldown_until = 0
+        self.total_success = 0
+        self.total_failure = 0
+        self.total_throttled = 0
+        self.last_used = 0
+
+    def error_rate(self):
+        if not self.outcomes:
+            return 0.0
+        return self.outcomes.count(False) / len(self.outcomes)
+
+    def to_dict(self, now, budget):
+        return {
+            'id': self.key_id,
+            'api_key': self.api_key[:20] + '...',
+            'latency_ewma': round(self.latency_ewma, 3) if self.latency_ewma is not None else None,
+            'error_rate': round(self.error_rate(), 3),
+            'in_flight': self.in_flight,
+            'throttle_strikes': round(self.throttle_strikes, 2),
+            'cooldown_remaining': round(max(0, self.cooldown_until - now), 1),
+            'daily_remaining': budget.get('daily_remaining') if budget else None,
+            'monthly_remaining': budget.get('monthly_remaining') if budget else None,
+            'total_success': self.total_success,
+            'total_failure': self.total_failure,
+            'total_throttled': self.total_throttled
+        }
+
+class KeyScheduler:
+    """Order Gemini keys by health score and spread load across the pool"""
+
+    LATENCY_ALPHA = 0.3  # EWMA smoothing for latency
+    DEFAULT_LATENCY = 5.0  # Assumed latency for keys without samples
+    COOLDOWN_BASE = 30  # Seconds of cooldown after the first 429
+    COOLDOWN_MAX = 15 * 60
+    STRIKE_HALF_LIFE = 10 * 60  # 429 strikes halve every 10 minutes without new 429s
+    BUDGET_REFRESH_INTERVAL = 60
+    LOW_BUDGET_THRESHOLD = 50  # Start deprioritizing keys below this many remaining requests
+
+    def __init__(self, budget_loader=None, decision_log_size=100):
+        self._budget_loader = budget_loader
+        self._lock = threading.Lock()
+        self._states = {}  # api_key -> KeyState
+        self._budgets = {}  # key_id -> {'daily_remaining': int, 'monthly_remaining': int}
+        self._budgets_loaded_at = 0
+        self._decisions = deque(maxlen=decision_log_size)
+
+    def _state(self, key_id, api_key):
+        state = self._states.get(api_key)
+        if state is None:
+            state = KeyState(key_id, api_key)
+            self._states[api_key] = state
+        elif key_id is not None:
+            state.key_id = key_id
+        return state
+
+    def _decay_strikes(self, state, now):
+        if state.throttle_strikes and state.strikes_updated_at:
+            elapsed = now - state.strikes_updated_at
+            state.throttle_strikes *= math.pow(0.5, elapsed / self.STRIKE_HALF_LIFE)
+            state.strikes_updated_at = now
+            if state.throttle_strikes < 0.05:
+                state.throttle_strikes = 0.0
+
+    def _refresh_budgets(self, now):
+        if not self._budget_loader or now - self._budgets_loaded_at < self.BUDGET_REFRESH_INTERVAL:
+            return
+        self._budgets_loaded_at = now
+        try:
+            self._budgets = self._budget_loader() or {}
+        except Exception as e:
+            print(f"[SCHEDULER] Failed to load Gemini key budgets: {e}")
+
+    def _remaining(self, key_id):
+        budget = self._budgets.get(key_id)
+        if not budget:
+            return None
+        limits = [value for value in budget.values() if value is not None]
+        return min(limits) if limits else None
+
+    def _score(self, state, now):
+        latency = state.latency_ewma if state.latency_ewma is not None else self.DEFAULT_LATENCY
+        score = (1.0 - state.error_rate()) + 0.05  # Never fully zero so failed keys can recover
+        score /= max(latency, 0.1) * (1 + state.in_flight)
+        score /= 1 + state.throttle_strikes
+
+        remaining = self._remaining(state.key_id)
+        if remaining is not None and remaining < self.LOW_BUDGET_THRESHOLD:
+            score *= max(remaining, 1) / self.LOW_BUDGET_THRESHOLD
+
+        return score
+
+    def order(self, keys_data):
+        """Order [(id, api_key), ...] by weighted-random health score, best first"""
+        now = time.time()
+        with self._lock:
+            self._refresh_budgets(now)
+
+            ranked = []
+            cooling = []
+            exhausted = []
+            for key_id, api_key in keys_data:
+                state = self._state(key_id, api_key)
+                self._decay_strikes(state, now)
+
+                remaining = self._remaining(key_id)
+                if remaining is not None and remaining <= 0:
+                    exhausted.append(api_key)
+                elif state.cooldown_until > now:
+                    cooling.append((state.cooldown_until, api_key))
+                else:
+                    # Weighted random sampling without replacement: higher scores
+                    # usually go first, but load still spreads across healthy keys
+                    score = self._score(state, now)
+                    ranked.append((random.random() ** (1.0 / score), api_key))
+
+            ranked.sort(reverse=True)
+            cooling.sort()
+            ordered = [api_key for _, api_key in ranked]
+            ordered += [api_key for _, api_key in cooling]  # Last resort, soonest cooldown end first
+            ordered += exhausted
+
+            self._decisions.append({
+                'timestamp': now,
+                'candidates': len(keys_data),
+                'healthy': len(ranked),
+                'cooling': len(cooling),
+                'exhausted': len(exhausted),
+                'first_choices': [self._states[api_key].key_id for api_key in ordered[:3]]
+            })
+
+        return ordered
+
+    def on_start(self, api_key):
+        with self._lock:
+            state = self._state(None, api_key)
+            state.in_flight += 1
+            state.last_used = time.time()
+
+    def on_success(self, api_key, latency):
+        with self._lock:
+            state = self._state(None, api_key)
+            state.in_flight = max(0, state.in_flight - 1)
+            state.outcomes.append(True)
+            state.total_success += 1
+            if state.latency_ewma is None:
+                state.latency_ewma = latency
+            else:
+                state.latency_ewma += self.LATENCY_ALPHA * (latency - state.latency_ewma)
+
+            budget = self._budgets.get(state.key_id)
+            if budget:
+                for name, value in budget.items():
+                    if value is not None:
+                        budget[name] = value - 1
+
+    def on_failure(self, api_key):
+        with self._lock:
+            state = self._state(None, api_key)
+            state.in_flight = max(0, state.in_flight - 1)
+            state.outcomes.append(False)
+            state.total_failure += 1
+
+    def on_throttled(self, api_key):
+        """Record a 429: cooldown grows exponentially with recent strikes"""
+        now = time.time()
+        with self._lock:
+            state = self._state(None, api_key)
+            state.in_flight = max(0, state.in_flight - 1)
+            self._decay_strikes(state, now)
+            state.throttle_strikes += 1
+            state.strikes_updated_at = now
+            state.total_throttled += 1
+            cooldown = min(self.COOLDOWN_MAX, self.COOLDOWN_BASE * math.pow(2, state.throttle_strikes - 1))
+            state.cooldown_until = now + cooldown
+            print(f"[SCHEDULER] Key {api_key[:20]} throttled, cooling down for {cooldown:.0f}s")
+
+    def throttled_fraction(self, api_keys):
+        """Share of api_keys currently cooling down after a 429"""
+        if not api_keys:
+            return 0.0
+        now = time.time()
+        with self._lock:
+            cooling = sum(1 for api_key in api_keys
+                          if api_key in self._states and self._states[api_key].cooldown_until > now)
+        return cooling / len(api_keys)
+
+    def on_cancel(self, api_key):
+        with self._lock:
+            state = self._state(None, api_key)
+            state.in_flight = max(0, state.in_flight - 1)
+
+    def snapshot(self):
+        """Get per-key state and recent scheduling decisions"""
+        now = time.time()
+        with self._lock:
+            keys = []
+            for state in self._states.values():
+                self._decay_strikes(state, now)
+                info = state.to_dict(now, self._budgets.get(state.key_id))
+                info['score'] = round(self._score(state, now), 4)
+                keys.append(info)
+            keys.sort(key=lambda item: item['score'], reverse=True)
+            return {
+                'keys': keys,
+                'decisions': list(self._decisions)[-20:]
+            }
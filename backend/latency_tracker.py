@@ -0,0 +1,45 @@
+import threading
+from collections import deque
+
+class LatencyTracker:
+    """Rolling window of observed latencies with percentile lookups"""
+
+    def __init__(self, window_size=200, min_samples=10):
+        self.min_samples = min_samples
+        self._samples = deque(maxlen=window_size)
+        self._lock = threading.Lock()
+
+    def record(self, seconds):
+        """Record one observed latency in seconds"""
+        with self._lock:
+            self._samples.append(seconds)
+
+    def percentile(self, fraction, default=None):
+        """Get latency at the given percentile (0-1), or default if too few samples"""
+        with self._lock:
+            if len(self._samples) < self.min_samples:
+                return default
+            ordered = sorted(self._samples)
+
+        index = min(len(ordered) - 1, max(0, int(round(fraction * (len(ordered) - 1)))))
+        return ordered[index]
+
+    def stats(self):
+        """Get summary statistics"""
+        with self._lock:
+            ordered = sorted(self._samples)
+
+        if not ordered:
+            return {'samples': 0}
+
+        def pick(fraction):
+            return round(ordered[min(len(ordered) - 1, int(round(fraction * (len(ordered) - 1))))], 3)
+
+        return {
+            'samples': len(ordered),
+            'p50': pick(0.5),
+            'p90': pick(0.9),
+            'p95': pick(0.95),
+            'p99': pick(0.99),
+            'max': round(ordered[-1], 3)
+        }
@@ -0,0 +1,166 @@
+import os
+import time
+import shutil
+import threading
+
+class OutputJanitor:
+    """Retention for generated output files: max age, total size quota and temp file cleanup.
+
+    The last download time of a file is kept in its atime (set explicitly by
+    touch(), so it works on noatime mounts and survives restarts). A sweep
+    removes leftover temp files (dot-files, *.tmp, *.pcm) older than
+    orphan_grace, then files not downloaded for max_age seconds, then the
+    least recently downloaded files until the total is under max_bytes.
+    Output still being written (including live streams) is a temp file, so
+    it is only removed once orphan_grace has passed since its last write,
+    and finished files younger than min_age are never evicted. Files with
+    other hard links (e.g. shared with the audio cache) free no space when
+    removed: they still expire but don't count toward max_bytes. Shard
+    directories left empty for min_age are removed as well.
+    """
+
+    TEMP_SUFFIXES = ('.tmp', '.pcm', '.part')
+
+    def __init__(self, directory, max_bytes=5 * 1024 * 1024 * 1024, max_age=7 * 24 * 3600,
+                 orphan_grace=3600, min_age=600, exclude_dirs=()):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self.orphan_grace = orphan_grace
+        self.min_age = min_age
+        self.exclude_dirs = {os.path.abspath(path) for path in exclude_dirs}
+        self._lock = threading.Lock()  # One sweep at a time
+        self.evictions = {'expired': 0, 'size': 0, 'orphan': 0}
+        self.freed_bytes = 0
+        self.runs = 0
+        self.last_run = None
+
+    def touch(self, path):
+        """Record a download of path (keeps mtime, which is the file's Last-Modified)"""
+        try:
+            os.utime(path, (time.time(), os.stat(path).st_mtime))
+        except OSError:
+            pass
+
+    @classmethod
+    def is_temp_file(cls, name):
+        return name.startswith('.') or name.endswith(cls.TEMP_SUFFIXES)
+
+    def _scan(self):
+        files = []
+        for root, dirs, names in os.walk(self.directory):
+            dirs[:] = [name for name in dirs if os.path.abspath(os.path.join(root, name)) not in self.exclude_dirs]
+            for name in names:
+                path = os.path.join(root, name)
+                try:
+                    st = os.stat(path)
+                except OSError:
+                    continue
+                files.append((path, name, st.st_size, st.st_mtime, max(st.st_atime, st.st_mtime), st.st_nlink))
+        return files
+
+    def _remove(self, path, size, reason):
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            return False
+        except OSError as e:
+            print(f"[JANITOR] Failed to remove {path}: {e}")
+            return False
+        self.evictions[reason] += 1
+        self.freed_bytes += size
+        return True
+
+    def _remove_empty_dirs(self, now):
+        """Remove empty subdirectories not modified for min_age; returns how many"""
+        removed = 0
+        root = os.path.abspath(self.directory)
+        for path, dirs, names in os.walk(root, topdown=False):
+            if path == root or names or any(path == excluded or path.startswith(excluded + os.sep)
+                                            for excluded in self.exclude_dirs):
+                continue
+            try:
+                # A shard directory may have just been created for a commit
+                if now - os.stat(path).st_mtime <= self.min_age:
+                    continue
+                os.rmdir(path)
+                removed += 1
+            except OSError:
+                continue  # Not empty (any more) or already gone
+        return removed
+
+    def run(self):
+        """Sweep the output directory once; returns what was removed"""
+        with self._lock:
+            started = time.time()
+            removed = {'expired': 0, 'size': 0, 'orphan': 0}
+            keep = []
+            total = 0
+
+            for path, name, size, mtime, last_access, nlink in self._scan():
+                age = started - mtime
+                # Other hard links keep the data on disk, so removing this name frees nothing
+                size = size if nlink == 1 else 0
+                if self.is_temp_file(name):
+                    if age > self.orphan_grace and self._remove(path, size, 'orphan'):
+                        removed['orphan'] += 1
+                        continue
+                elif age > self.min_age:
+                    if started - last_access > self.max_age and self._remove(path, size, 'expired'):
+                        removed['expired'] += 1
+                        continue
+                    if size:
+                        keep.append((last_access, path, size))
+                total += size
+
+            # Least recently downloaded first
+            keep.sort()
+            for last_access, path, size in keep:
+                if total <= self.max_bytes:
+                    break
+                if self._remove(path, size, 'size'):
+                    removed['size'] += 1
+                    total -= size
+
+            empty_dirs = self._remove_empty_dirs(started)
+
+            self.runs += 1
+            self.last_run = {
+                'time': time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(started)),
+                'duration': round(time.time() - started, 3),
+                'total_bytes': total,
+                'removed': removed,
+                'empty_dirs_removed': empty_dirs
+            }
+            if any(removed.values()):
+                print(f"[JANITOR] Removed {removed['expired']} expired, {removed['size']} over quota, "
+                      f"{removed['orphan']} temp files from {self.directory}")
+            return removed
+
+    def stats(self):
+        files = []
+        temp_files = []
+        linked_files = 0
+        for entry in self._scan():
+            (temp_files if self.is_temp_file(entry[1]) else files).append(entry)
+            linked_files += entry[5] > 1
+        try:
+            disk = shutil.disk_usage(self.directory)
+            disk = {'total': disk.total, 'used': disk.used, 'free': disk.free}
+        except OSError:
+            disk = None
+        return {
+            'directory': os.path.abspath(self.directory),
+            'files': len(files),
+            'total_bytes': sum(entry[2] for entry in files if entry[5] == 1),
+            'linked_files': linked_files,
+            'temp_files': len(temp_files),
+            'temp_bytes': sum(entry[2] for entry in temp_files),
+            'max_bytes': self.max_bytes,
+            'max_age': self.max_age,
+            'disk': disk,
+            'evictions': dict(self.evictions),
+            'freed_bytes': self.freed_bytes,
+            'runs': self.runs,
+            'last_run': self.last_run
+        }
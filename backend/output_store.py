@@ -0,0 +1,122 @@
+import os
+import re
+import json
+import time
+import uuid
+import hashlib
+from audio_cache import link_or_copy
+
+class OutputStore:
+    """Content-addressed storage for generated audio.
+
+    A finished file is named by the SHA-256 of its content (the download id,
+    e.g. '3fa9...e1.mp3') and stored under a nested fan-out of its leading
+    hex digits (root/3f/a9/3fa9...e1.mp3), so names never collide and no
+    directory grows too large. Files are written to a temp path in root first
+    and moved into place with an atomic rename, so a download never sees a
+    partial file. Ids announced before the content was known (live streams)
+    get a small JSON alias file at their own sharded path (<id>.alias) with
+    the final download id and details such as the duration, so they resolve
+    after a restart and from any process; files from the older flat layout
+    in root are still found by resolve().
+    """
+
+    ID_PATTERN = re.compile(r'^[0-9a-f]{32}\.[a-z0-9]{1,5}$')
+    LEGACY_PATTERN = re.compile(r'^[\w-]+\.[a-z0-9]{1,5}$')
+
+    ALIAS_SUFFIX = '.alias'
+
+    def __init__(self, root, fanout=2, width=2):
+        self.root = root
+        self.fanout = fanout
+        self.width = width
+        os.makedirs(self.root, exist_ok=True)
+
+    @staticmethod
+    def new_id(ext):
+        """Random id for output whose content is not known yet"""
+        return f"{uuid.uuid4().hex}.{ext}"
+
+    def temp_path(self, ext):
+        """Path to write a new output to before commit(); keeps the extension for the encoder"""
+        return os.path.join(self.root, f".tmp-{uuid.uuid4().hex}.{ext}")
+
+    def path_for(self, download_id):
+        digest = download_id.split('.', 1)[0]
+        shards = [digest[i * self.width:(i + 1) * self.width] for i in range(self.fanout)]
+        return os.path.join(self.root, *shards, download_id)
+
+    @staticmethod
+    def file_digest(file_path):
+        digest = hashlib.sha256()
+        with open(file_path, 'rb') as f:
+            for block in iter(lambda: f.read(1024 * 1024), b''):
+                digest.update(block)
+        return digest.hexdigest()[:32]
+
+    def _download_id(self, file_path):
+        ext = os.path.splitext(file_path)[1].lstrip('.').lower() or 'mp3'
+        return f"{self.file_digest(file_path)}.{ext}"
+
+    def commit(self, temp_path):
+        """Move a finished temp file to its content-addressed path; returns that path"""
+        final_path = self.path_for(self._download_id(temp_path))
+        os.makedirs(os.path.dirname(final_path), exist_ok=True)
+        # Identical content maps to the same path, so replacing an existing file is harmless
+        os.replace(temp_path, final_path)
+        return final_path
+
+    def add(self, source_path):
+        """Store a copy (hard link when possible) of an existing file, e.g. from the audio cache"""
+        final_path = self.path_for(self._download_id(source_path))
+        if not os.path.exists(final_path):
+            os.makedirs(os.path.dirname(final_path), exist_ok=True)
+            link_or_copy(source_path, final_path)
+        # Both an existing file and a hard link keep their old times; refresh them so the
+        # janitor treats the file as new (min_age) and recently used until it is downloaded
+        os.utime(final_path)
+        return final_path
+
+    def alias(self, announced_id, final_path, **info):
+        """Let an id handed out before the content was known resolve to the stored file;
+        info (e.g. duration, samples) is kept with the alias for alias_info()"""
+        alias_path = self.path_for(announced_id) + self.ALIAS_SUFFIX
+        os.makedirs(os.path.dirname(alias_path), exist_ok=True)
+        temp_path = self.temp_path('alias')
+        with open(temp_path, 'w') as f:
+            json.dump({'id': os.path.basename(final_path), **info}, f)
+        os.replace(temp_path, alias_path)
+
+    def alias_info(self, download_id):
+        """Contents of the alias for an announced id ('id' plus the info given to alias()), or None"""
+        download_id = (download_id or '').lower()
+        if not self.ID_PATTERN.match(download_id):
+            return None
+        alias_path = self.path_for(download_id) + self.ALIAS_SUFFIX
+        try:
+            with open(alias_path) as f:
+                info = json.load(f)
+            # Record the access like a download so retention keeps used aliases
+            os.utime(alias_path, (time.time(), os.stat(alias_path).st_mtime))
+        except (OSError, ValueError):
+            return None
+        if not isinstance(info, dict) or not self.ID_PATTERN.match(str(info.get('id', ''))):
+            return None
+        return info
+
+    def resolve(self, download_id):
+        """Path of the file for a download id (or alias, or legacy flat name); None if unknown"""
+        download_id = (download_id or '').lower()
+        if self.ID_PATTERN.match(download_id) and not os.path.isfile(self.path_for(download_id)):
+            info = self.alias_info(download_id)
+            if info:
+                download_id = info['id']
+        if self.ID_PATTERN.match(download_id):
+            path = self.path_for(download_id)
+            if os.path.isfile(path):
+                return path
+        if self.LEGACY_PATTERN.match(download_id):
+            path = os.path.join(self.root, download_id)
+            if os.path.isfile(path):
+                return path
+        return None
@@ -0,0 +1,246 @@
+import re
+import time
+import random
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+def parse_proxy_line(line, proxy_type="http"):
+    """Parse a proxy in the same formats as tool/proxy_manager.py:
+    scheme://..., ip:port or ip:port:user:password. Returns a URL or None."""
+    line = line.strip()
+    if not line or line.startswith('#'):
+        return None
+
+    if re.match(r"^(socks5h?|socks4|http|https)://", line):
+        return line
+
+    parts = line.split(":")
+    if len(parts) == 4:
+        ip, port, user, pwd = parts
+        return f"{proxy_type}://{user}:{pwd}@{ip}:{port}"
+    elif len(parts) == 2:
+        ip, port = parts
+        return f"{proxy_type}://{ip}:{port}"
+    return None
+
+def parse_proxy_list(text, proxy_type="http"):
+    """Parse one proxy per line; returns (urls, invalid_lines)"""
+    urls = []
+    invalid = []
+    for line in text.splitlines():
+        if not line.strip() or line.strip().startswith('#'):
+            continue
+        url = parse_proxy_line(line, proxy_type)
+        if url is None:
+            invalid.append(line.strip())
+        elif url not in urls:
+            urls.append(url)
+    return urls, invalid
+
+def mask_proxy(url):
+    """Proxy URL with the password hidden, for logs and stats"""
+    return re.sub(r"://([^:@/]+):[^@/]*@", r"://\1:***@", url)
+
+class ProxyState:
+    """Runtime health state for a single proxy"""
+
+    def __init__(self, url, source):
+        self.url = url
+        self.source = source
+        self.latency_ewma = None  # Health check round trip in seconds
+        self.consecutive_failures = 0
+        self.ejections = 0
+        self.ejected_until = 0
+        self.last_checked = None
+        self.total_success = 0
+        self.total_failure = 0
+        self.total_throttled = 0
+
+    def ejected(self, now):
+        return now < self.ejected_until
+
+    def to_dict(self, now, pinned_keys):
+        return {
+            'proxy': mask_proxy(self.url),
+            'source': self.source,
+            'latency_ewma': round(self.latency_ewma, 3) if self.latency_ewma is not None else None,
+            'consecutive_failures': self.consecutive_failures,
+            'ejected': self.ejected(now),
+            'ejection_remaining': round(max(0, self.ejected_until - now), 1),
+            'ejections': self.ejections,
+            'pinned_keys': pinned_keys,
+            'last_checked': time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(self.last_checked)) if self.last_checked else None,
+            'total_success': self.total_success,
+            'total_failure': self.total_failure,
+            'total_throttled': self.total_throttled
+        }
+
+class ProxyPool:
+    """Outbound proxies for Gemini calls with health checks and outlier ejection.
+
+    Proxies come from named sources (e.g. a file and the admin panel) that
+    are replaced independently. A Gemini key stays pinned to one proxy so it
+    always leaves from the same IP; it is moved only when that proxy is
+    ejected or removed. New pins pick a proxy at random weighted by
+    1/latency from health checks. A proxy failing eject_after times in a row
+    is ejected for a cooldown that doubles with every ejection; afterwards a
+    single further failure ejects it again until a success resets it. With
+    no usable proxy, calls go direct (allow_direct) or through the proxy
+    whose ejection ends first.
+    """
+
+    LATENCY_ALPHA = 0.3
+    DEFAULT_LATENCY = 1.0  # Assumed latency for proxies not checked yet
+
+    def __init__(self, eject_after=3, cooldown=60, max_cooldown=30 * 60, allow_direct=True, pin_keys=True):
+        self.eject_after = eject_after
+        self.cooldown = cooldown
+        self.max_cooldown = max_cooldown
+        self.allow_direct = allow_direct
+        self.pin_keys = pin_keys
+        self._lock = threading.Lock()
+        self._proxies = {}  # url -> ProxyState
+        self._pins = {}  # api_key -> url
+        self.direct_calls = 0
+
+    def set_source(self, source, urls):
+        """Replace the proxies of one source; state of proxies kept is preserved"""
+        with self._lock:
+            for url, state in list(self._proxies.items()):
+                if state.source == source and url not in urls:
+                    del self._proxies[url]
+            for url in urls:
+                if url not in self._proxies:
+                    self._proxies[url] = ProxyState(url, source)
+            self._pins = {api_key: url for api_key, url in self._pins.items() if url in self._proxies}
+            return len(self._proxies)
+
+    def urls(self, source=None):
+        with self._lock:
+            return [url for url, state in self._proxies.items() if source is None or state.source == source]
+
+    @staticmethod
+    def proxy_dict(url):
+        """requests proxies mapping for a proxy URL (None for direct)"""
+        if not url:
+            return None
+        return {'http': url, 'https': url}
+
+    def choose(self, api_key):
+        """Proxy URL to use for a Gemini key, or None for a direct connection"""
+        now = time.monotonic()
+        with self._lock:
+            if not self._proxies:
+                self.direct_calls += 1
+                return None
+
+            pinned = self._pins.get(api_key) if self.pin_keys else None
+            if pinned in self._proxies and not self._proxies[pinned].ejected(now):
+                return pinned
+
+            available = [state for state in self._proxies.values() if not state.ejected(now)]
+            if not available:
+                if self.allow_direct:
+                    self.direct_calls += 1
+                    return None
+                url = min(self._proxies.values(), key=lambda state: state.ejected_until).url
+            else:
+                weights = [1.0 / max(state.latency_ewma or self.DEFAULT_LATENCY, 0.01) for state in available]
+                url = random.choices(available, weights=weights)[0].url
+
+            if self.pin_keys:
+                if pinned and pinned != url:
+                    print(f"[PROXY] Key {api_key[:20]} moved to {mask_proxy(url)}")
+                self._pins[api_key] = url
+            return url
+
+    def report_success(self, url):
+        if not url:
+            return
+        with self._lock:
+            state = self._proxies.get(url)
+            if state:
+                state.consecutive_failures = 0
+                state.total_success += 1
+
+    def report_throttled(self, url):
+        """Upstream 429 seen through a proxy; counted but not held against the proxy"""
+        if not url:
+            return
+        with self._lock:
+            state = self._proxies.get(url)
+            if state:
+                state.consecutive_failures = 0
+                state.total_throttled += 1
+
+    def report_failure(self, url, reason):
+        """Connection-level failure through a proxy (proxy error, connect failure, timeout)"""
+        if not url:
+            return
+        now = time.monotonic()
+        with self._lock:
+            state = self._proxies.get(url)
+            if state is None:
+                return
+            state.consecutive_failures += 1
+            state.total_failure += 1
+            if state.consecutive_failures >= self.eject_after and not state.ejected(now):
+                state.ejections += 1
+                seconds = min(self.cooldown * 2 ** (state.ejections - 1), self.max_cooldown)
+                state.ejected_until = now + seconds
+                # One more failure after the cooldown ejects it again
+                state.consecutive_failures = self.eject_after - 1
+                print(f"[PROXY] Ejected {mask_proxy(url)} for {seconds:g}s ({reason})")
+
+    def check_health(self, probe, max_workers=10):
+        """Probe every proxy that is not ejected; probe(url) returns the round trip
+        in seconds or raises. Returns (healthy, failed) counts."""
+        now = time.monotonic()
+        with self._lock:
+            urls = [url for url, state in self._proxies.items() if not state.ejected(now)]
+        if not urls:
+            return 0, 0
+
+        def check(url):
+            try:
+                return url, probe(url), None
+            except Exception as e:
+                return url, None, e
+
+        with ThreadPoolExecutor(max_workers=min(max_workers, len(urls)), thread_name_prefix='proxy-check') as executor:
+            results = list(executor.map(check, urls))
+
+        healthy = 0
+        for url, latency, error in results:
+            if error is not None:
+                self.report_failure(url, f"health check: {error}")
+                continue
+            healthy += 1
+            with self._lock:
+                state = self._proxies.get(url)
+                if state is None:
+                    continue
+                state.last_checked = time.time()
+                state.consecutive_failures = 0
+                if state.latency_ewma is None:
+                    state.latency_ewma = latency
+                else:
+                    state.latency_ewma = (1 - self.LATENCY_ALPHA) * state.latency_ewma + self.LATENCY_ALPHA * latency
+        return healthy, len(results) - healthy
+
+    def stats(self):
+        now = time.monotonic()
+        with self._lock:
+            pinned = {}
+            for url in self._pins.values():
+                pinned[url] = pinned.get(url, 0) + 1
+            proxies = [state.to_dict(now, pinned.get(url, 0)) for url, state in self._proxies.items()]
+            return {
+                'total': len(proxies),
+                'available': sum(1 for proxy in proxies if not proxy['ejected']),
+                'ejected': sum(1 for proxy in proxies if proxy['ejected']),
+                'pinned_keys': len(self._pins),
+                'direct_calls': self.direct_calls,
+                'allow_direct': self.allow_direct,
+                'proxies': proxies
+            }
@@ -0,0 +1,97 @@
+import threading
+import time
+from collections import deque
+from urllib3.exceptions import MaxRetryError, ResponseError
+from urllib3.util.retry import Retry
+from deadline import current_deadline
+
+class RetryBudget:
+    """Cap retries to a fraction of upstream requests over a sliding window.
+
+    Each original upstream request earns `ratio` retries; min_per_second
+    retries are always allowed so a quiet server can still retry. During an
+    incident, when every call fails, retries stop at that fraction instead of
+    multiplying the load on the upstream.
+    """
+
+    def __init__(self, ratio=0.2, min_per_second=1.0, window=10):
+        self.ratio = ratio
+        self.min_per_second = min_per_second
+        self.window = window
+        self._lock = threading.Lock()
+        self._requests = deque()
+        self._retries = deque()
+        self.total_requests = 0
+        self.total_retries = 0
+        self.denied = 0
+
+    def _prune_locked(self, now):
+        cutoff = now - self.window
+        for events in (self._requests, self._retries):
+            while events and events[0] < cutoff:
+                events.popleft()
+
+    def record_request(self):
+        """Record an original (non-retry) upstream request"""
+        now = time.monotonic()
+        with self._lock:
+            self._prune_locked(now)
+            self._requests.append(now)
+            self.total_requests += 1
+
+    def try_spend(self):
+        """Record a retry if the budget allows it; False means don't retry"""
+        now = time.monotonic()
+        with self._lock:
+            self._prune_locked(now)
+            allowed = self.min_per_second * self.window + self.ratio * len(self._requests)
+            if len(self._retries) >= allowed:
+                self.denied += 1
+                return False
+            self._retries.append(now)
+            self.total_retries += 1
+            return True
+
+    def stats(self):
+        with self._lock:
+            self._prune_locked(time.monotonic())
+            return {
+                'ratio': self.ratio,
+                'min_per_second': self.min_per_second,
+                'window': self.window,
+                'window_requests': len(self._requests),
+                'window_retries': len(self._retries),
+                'total_requests': self.total_requests,
+                'total_retries': self.total_retries,
+                'denied': self.denied
+            }
+
+class BudgetedRetry(Retry):
+    """urllib3 Retry that also stops when the retry budget is spent or the
+    wait before the next attempt would run past the current request deadline"""
+
+    def __init__(self, *args, budget=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.budget = budget
+
+    def new(self, **kw):
+        retry = super().new(**kw)
+        retry.budget = self.budget
+        return retry
+
+    def increment(self, method=None, url=None, response=None, error=None, _pool=None, _stacktrace=None):
+        new_retry = super().increment(method, url, response=response, error=error, _pool=_pool,
+                                      _stacktrace=_stacktrace)
+
+        deadline = current_deadline()
+        if deadline is not None:
+            wait = new_retry.get_backoff_time()
+            if response is not None and self.respect_retry_after_header:
+                wait = max(wait, new_retry.get_retry_after(response) or 0)
+            if wait >= deadline.remaining():
+                raise MaxRetryError(_pool, url, error or ResponseError('retry would exceed the request deadline'))
+
+        if self.budget is not None and not self.budget.try_spend():
+            raise MaxRetryError(_pool, url, error or ResponseError('retry budget exhausted'))
+
+        return new_retry
@@ -0,0 +1,155 @@
+import threading
+import time
+from collections import OrderedDict
+from http.cookiejar import DefaultCookiePolicy
+
+class _NoCookies(DefaultCookiePolicy):
+    """Sessions are shared across threads; keep them free of mutable cookie state"""
+
+    def set_ok(self, cookie, request):
+        return False
+
+class _Entry:
+    def __init__(self, session):
+        self.session = session
+        self.created_at = time.monotonic()
+        self.last_used = self.created_at
+        self.uses = 0
+
+def _connection_pools(session):
+    """urllib3 connection pools behind every adapter of a session, direct and per proxy"""
+    pools = []
+    for adapter in set(session.adapters.values()):
+        managers = [getattr(adapter, 'poolmanager', None)] + list(getattr(adapter, 'proxy_manager', {}).values())
+        for manager in managers:
+            if manager is None:
+                continue
+            for key in manager.pools.keys():
+                pool = manager.pools.get(key)
+                if pool is not None:
+                    pools.append(pool)
+    return pools
+
+def _connection_counts(session):
+    """(requests sent, connections opened, TLS connections opened) across a session's pools"""
+    requests_sent = connections = tls_connections = 0
+    for pool in _connection_pools(session):
+        requests_sent += pool.num_requests
+        connections += pool.num_connections
+        if pool.scheme == 'https':
+            tls_connections += pool.num_connections
+    return requests_sent, connections, tls_connections
+
+class SessionPool:
+    """Thread-safe LRU of HTTP sessions, one per proxy (None for direct connections).
+
+    factory(proxy_dict) builds a session. The pool holds at most max_sessions;
+    the least recently used session, or one idle for longer than idle_ttl, is
+    closed (releasing its connection pools) when evicted. Connection reuse and
+    new TLS handshakes are counted from the urllib3 pools, including those of
+    sessions already evicted.
+    """
+
+    def __init__(self, factory, max_sessions=32, idle_ttl=600):
+        self.factory = factory
+        self.max_sessions = max_sessions
+        self.idle_ttl = idle_ttl
+        self._lock = threading.Lock()
+        self._sessions = OrderedDict()  # key -> _Entry, least recently used first
+        self.created = 0
+        self.evicted = 0
+        self._closed_counts = (0, 0, 0)  # Connection counts of evicted sessions
+
+    @staticmethod
+    def make_key(proxy_dict):
+        if not proxy_dict:
+            return 'direct'
+        return '|'.join(f"{scheme}={proxy_dict[scheme]}" for scheme in sorted(proxy_dict))
+
+    def get(self, proxy_dict=None):
+        """Get the session for a proxy, creating it if needed"""
+        key = self.make_key(proxy_dict)
+        now = time.monotonic()
+        expired = []
+        with self._lock:
+            entry = self._sessions.get(key)
+            if entry is not None and now - entry.last_used > self.idle_ttl:
+                expired.append(self._sessions.pop(key))
+                entry = None
+            if entry is None:
+                session = self.factory(proxy_dict)
+                session.cookies.set_policy(_NoCookies())
+                entry = _Entry(session)
+                self._sessions[key] = entry
+                self.created += 1
+                while len(self._sessions) > self.max_sessions:
+                    expired.append(self._sessions.popitem(last=False)[1])
+            else:
+                self._sessions.move_to_end(key)
+            entry.last_used = now
+            entry.uses += 1
+            session = entry.session
+
+        for old in expired:
+            self._close(old)
+        return session
+
+    def evict_idle(self):
+        """Close sessions idle for longer than idle_ttl; returns how many were closed"""
+        now = time.monotonic()
+        with self._lock:
+            keys = [key for key, entry in self._sessions.items() if now - entry.last_used > self.idle_ttl]
+            expired = [self._sessions.pop(key) for key in keys]
+        for entry in expired:
+            self._close(entry)
+        return len(expired)
+
+    def _close(self, entry):
+        counts = _connection_counts(entry.session)
+        with self._lock:
+            self._closed_counts = tuple(a + b for a, b in zip(self._closed_counts, counts))
+            self.evicted += 1
+        try:
+            entry.session.close()
+        except Exception as e:
+            print(f"[HTTP] Failed to close session: {e}")
+
+    def close_all(self):
+        with self._lock:
+            entries = list(self._sessions.values())
+            self._sessions.clear()
+        for entry in entries:
+            self._close(entry)
+
+    def stats(self):
+        with self._lock:
+            entries = list(self._sessions.items())
+            totals = self._closed_counts
+            created, evicted = self.created, self.evicted
+
+        sessions = []
+        for key, entry in entries:
+            counts = _connection_counts(entry.session)
+            totals = tuple(a + b for a, b in zip(totals, counts))
+            sessions.append({
+                'key': key,
+                'uses': entry.uses,
+                'requests': counts[0],
+                'connections': counts[1],
+                'idle_seconds': round(time.monotonic() - entry.last_used, 1)
+            })
+
+        requests_sent, connections, tls_connections = totals
+        return {
+            'sessions': len(entries),
+            'max_sessions': self.max_sessions,
+            'idle_ttl': self.idle_ttl,
+            'created': created,
+            'evicted': evicted,
+            'requests': requests_sent,
+            'new_connections': connections,
+            'tls_handshakes': tls_connections,
+            'reused_connections': max(0, requests_sent - connections),
+            'reuse_ratio': round(1 - connections / requests_sent, 3) if requests_sent else None,
+            'by_session': sessions
+        }
@@ -0,0 +1,92 @@
+import time
+import threading
+
+class CoalesceTimeout(Exception):
+    """Raised when a follower gives up waiting for the leader's result"""
+    pass
+
+class _Call:
+    """One in-flight call and the callers waiting for it"""
+
+    def __init__(self):
+        self.event = threading.Event()
+        self.result = None
+        self.error = None
+        self.followers = 0
+
+class SingleFlight:
+    """Coalesce identical concurrent calls into one.
+
+    The first caller for a key (the leader) runs fn itself; callers
+    arriving with the same key while it runs (followers) wait for its
+    result instead of repeating the work. An error of the leader is
+    handed to the followers only if share_error(error) says so; otherwise
+    (e.g. the leader's own deadline or rate limit) each follower tries
+    again and one of them becomes the new leader. Nothing is remembered
+    once a call finishes.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls = {}  # key -> _Call
+        self.leaders = 0
+        self.followers = 0
+        self.shared_errors = 0
+        self.retries = 0
+        self.timeouts = 0
+
+    def do(self, key, fn, timeout=None, share_error=None):
+        """Run fn() once for all concurrent callers with key; returns (result, shared).
+
+        shared is True for followers. A follower waits at most timeout
+        seconds in total and then raises CoalesceTimeout.
+        """
+        expires_at = time.monotonic() + timeout if timeout is not None else None
+        while True:
+            with self._lock:
+                call = self._calls.get(key)
+                leader = call is None
+                if leader:
+                    call = self._calls[key] = _Call()
+                    self.leaders += 1
+                else:
+                    call.followers += 1
+                    self.followers += 1
+
+            if leader:
+                try:
+                    call.result = fn()
+                    return call.result, False
+                except BaseException as e:
+                    call.error = e
+                    raise
+                finally:
+                    with self._lock:
+                        del self._calls[key]
+                    call.event.set()
+
+            remaining = None if expires_at is None else max(0.0, expires_at - time.monotonic())
+            if not call.event.wait(remaining):
+                with self._lock:
+                    self.timeouts += 1
+                raise CoalesceTimeout("Timed out waiting for an identical request in flight")
+            if call.error is None:
+                return call.result, True
+            if share_error is not None and share_error(call.error):
+                with self._lock:
+                    self.shared_errors += 1
+                raise call.error
+            with self._lock:
+                self.retries += 1
+
+    def stats(self):
+        with self._lock:
+            return {
+                'in_flight': len(self._calls),
+                'waiting': sum(call.followers for call in self._calls.values()),
+                'leaders': self.leaders,
+                'followers': self.followers,
+                'shared_errors': self.shared_errors,
+                'retries': self.retries,
+                'timeouts': self.timeouts
+            }
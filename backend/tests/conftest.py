@@ -0,0 +1,18 @@
+import importlib
+import os
+import sys
+
+import pytest
+
+# Backend modules are imported flat (from x import Y), as api_server does
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+@pytest.fixture(scope='session')
+def server(tmp_path_factory):
+    """The api_server module, imported in a temp directory so its database and outputs stay out of the repo"""
+    cwd = os.getcwd()
+    os.chdir(tmp_path_factory.mktemp('server'))
+    try:
+        yield importlib.import_module('api_server')
+    finally:
+        os.chdir(cwd)
@@ -0,0 +1,173 @@
+import threading
+import time
+
+import pytest
+
+from admission import AdmissionQueue, AdmissionRejected
+
+def wait_for(condition, timeout=2):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, "condition not met in time"
+        time.sleep(0.005)
+
+class Waiters:
+    """Queue acquire() calls in separate threads and record the order they are granted in"""
+
+    def __init__(self, admission):
+        self.admission = admission
+        self.order = []
+        self.tickets = []
+        self.threads = []
+        self._lock = threading.Lock()
+
+    def add(self, name, **kwargs):
+        def run():
+            ticket = self.admission.acquire(**kwargs)
+            with self._lock:
+                self.order.append(name)
+                self.tickets.append(ticket)
+
+        expected = self.admission.queue_depth + 1
+        # Daemon threads so a waiter that is never granted fails the test instead of hanging it
+        thread = threading.Thread(target=run, daemon=True)
+        thread.start()
+        self.threads.append(thread)
+        # Enqueue one at a time so the queue order is deterministic
+        wait_for(lambda: self.admission.queue_depth == expected)
+
+    def grant_all(self, ticket):
+        """Release ticket, then keep releasing each granted ticket until every waiter ran"""
+        self.admission.release(ticket)
+        for i in range(len(self.threads)):
+            wait_for(lambda: len(self.tickets) > i)
+            self.admission.release(self.tickets[i])
+        for thread in self.threads:
+            thread.join(2)
+        return self.order
+
+def test_admits_immediately_while_slots_are_free():
+    admission = AdmissionQueue(2)
+    first = admission.acquire(key=1)
+    second = admission.acquire(key=2)
+    assert (first.waited, second.waited) == (0, 0)
+    assert admission.in_flight == 2
+    admission.release(first)
+    admission.release(first)  # Releasing twice is harmless
+    assert admission.in_flight == 1
+
+
+def test_rejects_when_queue_is_full_with_retry_after():
+    admission = AdmissionQueue(1, max_queue=1)
+    running = admission.acquire(key='x')
+    waiters = Waiters(admission)
+    waiters.add('queued', key='a')
+    with pytest.raises(AdmissionRejected) as error:
+        admission.acquire(key='b')
+    assert error.value.status == 429
+    assert error.value.retry_after >= 1
+    waiters.grant_all(running)
+
+
+def test_wait_timeout_is_a_503_and_frees_the_queue():
+    admission = AdmissionQueue(1)
+    admission.acquire(key='x')
+    with pytest.raises(AdmissionRejected) as error:
+        admission.acquire(key='a', max_wait=0.05)
+    assert error.value.status == 503
+    assert admission.queue_depth == 0
+    assert admission.timed_out == 1
+
+
+def test_raising_capacity_grants_waiters():
+    admission = AdmissionQueue(1)
+    admission.acquire(key='x')
+    waiters = Waiters(admission)
+    waiters.add('a', key='a')
+    admission.set_capacity(2)
+    wait_for(lambda: waiters.order == ['a'])
+
+def test_background_waiters_do_not_fill_the_queue():
+    admission = AdmissionQueue(1, max_queue=2)
+    running = admission.acquire(key='x')
+    waiters = Waiters(admission)
+    for i in range(3):
+        waiters.add(f'job{i}', key='jobs', bounded=False)
+    assert admission.stats()['background_queued'] == 3
+    # Interactive requests still get max_queue places behind the background backlog
+    waiters.add('user0', key='a')
+    waiters.add('user1', key='b')
+    with pytest.raises(AdmissionRejected, match=r'\(2 requests queued\)'):
+        admission.acquire(key='c')
+    assert sorted(waiters.grant_all(running)) == ['job0', 'job1', 'job2', 'user0', 'user1']
+    assert (admission.queue_depth, admission.background_depth) == (0, 0)
+
+def test_background_waiter_waits_past_max_wait():
+    admission = AdmissionQueue(1, max_wait=0.01)
+    running = admission.acquire(key='x')
+    waiters = Waiters(admission)
+    waiters.add('job', key='jobs', bounded=False)
+    time.sleep(0.05)
+    assert waiters.grant_all(running) == ['job']
+
+def test_fair_queuing_interleaves_keys():
+    admission = AdmissionQueue(1)
+    running = admission.acquire(key='x')
+    waiters = Waiters(admission)
+    for i in range(3):
+        waiters.add(f'heavy{i}', key='heavy')
+    waiters.add('light0', key='light')
+    waiters.add('light1', key='light')
+    # The light key is served in turn with the heavy one instead of behind its whole backlog
+    assert waiters.grant_all(running) == ['heavy0', 'light0', 'heavy1', 'light1', 'heavy2']
+
+def test_weight_gives_a_larger_share():
+    admission = AdmissionQueue(1)
+    running = admission.acquire(key='x')
+    waiters = Waiters(admission)
+    for i in range(4):
+        waiters.add(f'big{i}', key='big', weight=2)
+    for i in range(2):
+        waiters.add(f'small{i}', key='small')
+    # Both flows start at tag 0, then big advances by 1/2 per request and small by 1
+    assert waiters.grant_all(running) == ['big0', 'small0', 'big1', 'big2', 'small1', 'big3']
+
+def test_per_key_limit_lets_other_keys_pass():
+    admission = AdmissionQueue(3)
+    admission.acquire(key='a', limit=1)
+    # Key a is at its limit even though slots are free, so it waits without blocking key b
+    with pytest.raises(AdmissionRejected) as error:
+        admission.acquire(key='a', limit=1, max_wait=0)
+    assert error.value.status == 429
+    assert admission.acquire(key='b', limit=1).waited == 0
+
+def test_rejects_when_key_has_too_many_queued():
+    admission = AdmissionQueue(1, max_queue_per_key=1)
+    running = admission.acquire(key='x')
+    waiters = Waiters(admission)
+    waiters.add('queued', key='a')
+    with pytest.raises(AdmissionRejected, match='this API key'):
+        admission.acquire(key='a')
+    # Another key still gets a place in the queue
+    waiters.add('other', key='b')
+    waiters.grant_all(running)
+
+def test_higher_priority_is_served_first():
+    admission = AdmissionQueue(1)
+    running = admission.acquire(key='x')
+    waiters = Waiters(admission)
+    waiters.add('low', key='a', priority='low')
+    waiters.add('normal', key='b', priority='normal')
+    waiters.add('high', key='c', priority='high')
+    assert waiters.grant_all(running) == ['high', 'normal', 'low']
+
+def test_reserved_slots_are_held_back_for_their_class():
+    admission = AdmissionQueue(2, reserved={'high': 1})
+    admission.acquire(key='a')
+    with pytest.raises(AdmissionRejected):
+        admission.acquire(key='b', max_wait=0)
+    assert admission.acquire(key='c', priority='high').waited == 0
+
+def test_unknown_priority_is_rejected():
+    with pytest.raises(ValueError):
+        AdmissionQueue(1).acquire(key='a', priority='urgent')
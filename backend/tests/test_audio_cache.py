@@ -0,0 +1,65 @@
+import os
+import time
+
+from audio_cache import AudioCache
+
+def source(tmp_path, name, size):
+    path = tmp_path / name
+    path.write_bytes(b'x' * size)
+    return str(path)
+
+def test_key_ignores_cosmetic_differences():
+    key = AudioCache.make_key('Xin  chào\n thế giới', 'Kore', 'model', {'format': 'mp3'})
+    assert key == AudioCache.make_key(' Xin chào thế giới ', 'kore ', 'model', {'format': 'mp3'})
+    assert key != AudioCache.make_key('Xin chào thế giới', 'Kore', 'model', {'format': 'wav'})
+    assert key != AudioCache.make_key('Xin chào thế giới', 'Puck', 'model', {'format': 'mp3'})
+
+def test_put_get_and_hard_link(tmp_path):
+    cache = AudioCache(str(tmp_path / 'cache'))
+    path = source(tmp_path, 'out.mp3', 100)
+    assert cache.get('k1') is None
+    assert cache.put('k1', path, 1.5, {'voice': 'kore'})
+
+    entry = cache.get('k1')
+    assert entry['duration'] == 1.5 and entry['metadata'] == {'voice': 'kore'}
+    assert os.path.samefile(entry['path'], path)
+    assert cache.stats()['hits'] == 1 and cache.stats()['misses'] == 1
+
+def test_evicts_least_recently_used_over_max_bytes(tmp_path):
+    cache = AudioCache(str(tmp_path / 'cache'), max_bytes=250)
+    for name in ('a', 'b'):
+        cache.put(name, source(tmp_path, f'{name}.mp3', 100), 1)
+    cache.get('a')  # b is now the least recently used
+    cache.put('c', source(tmp_path, 'c.mp3', 100), 1)
+    assert cache.get('b') is None
+    assert cache.get('a') and cache.get('c')
+    assert cache.stats()['total_bytes'] == 200
+
+def test_expired_entry_is_a_miss(tmp_path):
+    cache = AudioCache(str(tmp_path / 'cache'), ttl_seconds=60)
+    cache.put('k1', source(tmp_path, 'out.mp3', 10), 1)
+    cache._entries['k1']['created_at'] = time.time() - 120
+    assert cache.get('k1') is None
+    assert cache.stats()['entries'] == 0
+
+def test_index_survives_restart_and_drops_missing_files(tmp_path):
+    cache_dir = str(tmp_path / 'cache')
+    cache = AudioCache(cache_dir)
+    cache.put('kept', source(tmp_path, 'a.mp3', 10), 1)
+    cache.put('gone', source(tmp_path, 'b.mp3', 20), 2)
+    os.remove(cache.get('gone')['path'])
+    cache.flush()
+
+    reloaded = AudioCache(cache_dir)
+    assert reloaded.get('kept')['duration'] == 1
+    assert reloaded.get('gone') is None
+    assert reloaded.stats()['total_bytes'] == 10
+
+def test_load_can_be_deferred(tmp_path):
+    cache_dir = tmp_path / 'cache'
+    AudioCache(str(cache_dir)).put('k1', source(tmp_path, 'a.mp3', 10), 1)
+
+    deferred = AudioCache(str(cache_dir), load=False)
+    assert deferred.stats()['entries'] == 0
+    deferred.load()
+    assert deferred.get('k1') is not None
@@ -0,0 +1,35 @@
+import pytest
+
+def rows(count):
+    return [{'row_id': str(i), 'text': f'Row {i}'} for i in range(count)]
+
+@pytest.fixture
+def client(server):
+    return server.app.test_client()
+
+def test_too_many_rows_names_the_limit(server, client):
+    response = client.post('/api/voice/batch', json={'api_key': 'k', 'rows': rows(server.BATCH_MAX_ROWS + 1)})
+    assert response.status_code == 400
+    assert f'max {server.BATCH_MAX_ROWS}' in response.json['error']
+
+def test_invalid_deadline_header_is_rejected(client):
+    response = client.post('/api/voice/batch', json={'api_key': 'k', 'rows': rows(2)},
+                           headers={'X-Request-Timeout': 'soon'})
+    assert response.status_code == 400
+    assert 'X-Request-Timeout' in response.json['error']
+
+def test_row_deadline_starts_when_the_row_is_generated(server, monkeypatch):
+    seen = []
+
+    def synthesize_voice(voice_request, *args, **kwargs):
+        seen.append(voice_request['deadline'].seconds)
+        raise server.VoiceRequestError('stop here', 500)
+
+    monkeypatch.setattr(server, 'synthesize_voice', synthesize_voice)
+    voice_request = {'deadline': None, 'deadline_seconds': 42, 'output_settings': server.get_output_settings({})}
+    with pytest.raises(server.VoiceRequestError):
+        server.generate_voice(voice_request, '127.0.0.1', 'test')
+    voice_request = {'deadline': None, 'output_settings': server.get_output_settings({})}
+    with pytest.raises(server.VoiceRequestError):
+        server.generate_voice(voice_request, '127.0.0.1', 'test')
+    assert seen == [42, server.REQUEST_DEFAULT_DEADLINE]
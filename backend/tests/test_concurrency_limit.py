@@ -0,0 +1,62 @@
+from concurrency_limit import AdaptiveConcurrencyLimit
+
+def make_limit(initial=4, min_limit=2, max_limit=10, **kwargs):
+    changes = []
+    limit = AdaptiveConcurrencyLimit(initial, min_limit, max_limit, on_change=changes.append, **kwargs)
+    return limit, changes
+
+def test_initial_limit_is_clamped():
+    assert AdaptiveConcurrencyLimit(50, 2, 10).limit == 10
+    assert AdaptiveConcurrencyLimit(0, 2, 10).limit == 2
+
+def test_additive_increase_after_limit_saturated_successes():
+    limit, changes = make_limit(initial=4)
+    for _ in range(3):
+        limit.on_success(1.0)
+    assert limit.limit == 4
+    limit.on_success(1.0)
+    assert limit.limit == 5
+    # The next step needs as many successes as the new limit
+    for _ in range(5):
+        limit.on_success(1.0)
+    assert limit.limit == 6
+    assert changes == [5, 6]
+
+def test_no_increase_without_saturation():
+    limit, changes = make_limit(initial=4)
+    for _ in range(20):
+        limit.on_success(1.0, saturated=False)
+    assert limit.limit == 4
+    assert changes == []
+
+def test_increase_stops_at_max_limit():
+    limit, _ = make_limit(initial=9, max_limit=10)
+    for _ in range(50):
+        limit.on_success(1.0)
+    assert limit.limit == 10
+
+def test_multiplicative_decrease_on_overload_with_cooldown():
+    limit, changes = make_limit(initial=8, cooldown=60)
+    limit.on_overload('5xx')
+    assert limit.limit == 4
+    # A second signal within the cooldown belongs to the same incident
+    limit.on_overload('timeout')
+    assert limit.limit == 4
+    assert changes == [4]
+    assert limit.stats()['history'][-1]['reason'] == '5xx'
+
+def test_decrease_stops_at_min_limit():
+    limit, _ = make_limit(initial=3, min_limit=2, cooldown=0)
+    for _ in range(5):
+        limit.on_overload('429')
+    assert limit.limit == 2
+
+def test_latency_spike_cuts_the_limit():
+    limit, changes = make_limit(initial=8, min_samples=5, cooldown=60)
+    for _ in range(5):
+        limit.on_success(1.0, saturated=False)
+    for _ in range(5):
+        limit.on_success(10.0, saturated=False)
+    assert limit.limit == 4
+    assert changes == [4]
+    assert limit.stats()['history'][-1]['reason'] == 'latency'
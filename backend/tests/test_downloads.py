@@ -0,0 +1,58 @@
+import os
+
+import pytest
+
+AUDIO = bytes(range(256)) * 40
+
+@pytest.fixture(scope='module')
+def stored(server, tmp_path_factory):
+    source = tmp_path_factory.mktemp('audio') / 'voice.mp3'
+    source.write_bytes(AUDIO)
+    return os.path.basename(server.output_store.add(str(source)))
+
+@pytest.fixture
+def client(server):
+    return server.app.test_client()
+
+def test_full_download_has_cache_headers(client, stored):
+    response = client.get(f'/api/voice/download/{stored}')
+    assert response.status_code == 200
+    assert response.data == AUDIO
+    assert response.headers['Accept-Ranges'] == 'bytes'
+    assert response.headers['ETag']
+    assert 'immutable' in response.headers['Cache-Control']
+
+@pytest.mark.parametrize('header, start, end', [
+    ('bytes=0-99', 0, 99),
+    ('bytes=100-', 100, len(AUDIO) - 1),
+    ('bytes=-50', len(AUDIO) - 50, len(AUDIO) - 1),
+    ('bytes=10000-20000', 10000, len(AUDIO) - 1),
+])
+def test_range_requests_return_partial_content(client, stored, header, start, end):
+    response = client.get(f'/api/voice/download/{stored}', headers={'Range': header})
+    assert response.status_code == 206
+    assert response.data == AUDIO[start:end + 1]
+    assert response.headers['Content-Range'] == f'bytes {start}-{end}/{len(AUDIO)}'
+
+def test_unsatisfiable_range(client, stored):
+    response = client.get(f'/api/voice/download/{stored}', headers={'Range': f'bytes={len(AUDIO)}-'})
+    assert response.status_code == 416
+
+def test_if_range_with_stale_etag_sends_the_whole_file(client, stored):
+    response = client.get(f'/api/voice/download/{stored}', headers={'Range': 'bytes=0-9', 'If-Range': '"stale"'})
+    assert response.status_code == 200
+    assert response.data == AUDIO
+
+def test_if_none_match_returns_not_modified(client, stored):
+    etag = client.get(f'/api/voice/download/{stored}').headers['ETag']
+    response = client.get(f'/api/voice/download/{stored}', headers={'If-None-Match': etag})
+    assert response.status_code == 304
+    assert response.data == b''
+
+def test_live_url_serves_finished_file_with_ranges(client, stored):
+    response = client.get(f'/api/voice/live/{stored}', headers={'Range': 'bytes=5-9'})
+    assert response.status_code == 206
+    assert response.data == AUDIO[5:10]
+
+def test_unknown_file_is_404(client):
+    assert client.get('/api/voice/download/' + '0' * 32 + '.mp3').status_code == 404
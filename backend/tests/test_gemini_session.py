@@ -0,0 +1,8 @@
+def test_adapter_does_not_retry_429(server):
+    session = server.create_session_with_retry()
+    retry = session.get_adapter('https://generativelanguage.googleapis.com').max_retries
+    # A 429 belongs to the key scheduler: the next attempt moves to another key
+    assert 429 not in retry.status_forcelist
+    assert {500, 502, 503, 504} <= set(retry.status_forcelist)
+    assert not retry.is_retry('GET', 429)
+    assert retry.is_retry('GET', 503)
@@ -0,0 +1,51 @@
+import threading
+import time
+
+import pytest
+
+from audio_pipeline import PcmBuffer
+
+KEYS = [(i, f'key-{i}') for i in range(10)]
+
+@pytest.fixture
+def gemini(server, monkeypatch):
+    """Replace the Gemini call with one that answers after `delay` seconds; records the keys called"""
+    calls = []
+    lock = threading.Lock()
+    fake = {'delay': 0.3, 'calls': calls}
+
+    def stream_gemini_audio(text, voice_name, api_key, race, open_sink, deadline=None, output_started=None):
+        with lock:
+            calls.append(api_key)
+        time.sleep(fake['delay'])
+        if not race.claim(api_key):
+            raise server.HedgeCancelled(f"Key {api_key} cancelled")
+        sink = open_sink()
+        sink.write(b'\0\0' * 100)
+        return sink, 200, fake['delay']
+
+    monkeypatch.setattr(server, 'stream_gemini_audio', stream_gemini_audio)
+    monkeypatch.setattr(server, 'get_hedge_delay', lambda: 0.05)
+    monkeypatch.setattr(server, 'HEDGE_ENABLED', True)
+    return fake
+
+def test_hedge_budget_is_shared_and_refundable(server):
+    budget = server.HedgeBudget(2)
+    assert budget.try_spend() and budget.try_spend()
+    assert not budget.try_spend()
+    budget.refund()
+    assert budget.try_spend()
+
+def test_slow_key_is_hedged_up_to_the_limit(server, gemini):
+    sink, pcm_bytes, api_key = server.synthesize_pcm('hello', 'Kore', [key for _, key in KEYS], PcmBuffer,
+                                                     hedge_budget=server.HedgeBudget(2))
+    assert pcm_bytes == 200
+    assert len(gemini['calls']) == 3
+    assert api_key in gemini['calls']
+
+def test_chunks_of_one_request_share_the_hedge_budget(server, gemini, tmp_path):
+    chunks = [f'Sentence number {i}.' for i in range(6)]
+    server.gemini_tts_chunked(chunks, 'Kore', KEYS, silence_ms=0, open_encoder=lambda path: PcmBuffer(),
+                              mp3_file=str(tmp_path / 'out.mp3'))
+    # One call per chunk plus at most HEDGE_MAX_EXTRA_CALLS for the whole request
+    assert len(gemini['calls']) <= len(chunks) + server.HEDGE_MAX_EXTRA_CALLS
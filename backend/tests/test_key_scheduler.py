@@ -0,0 +1,59 @@
+from key_scheduler import KeyScheduler
+
+def test_throttled_fraction_counts_keys_cooling_down():
+    scheduler = KeyScheduler()
+    keys = [(1, 'key-a'), (2, 'key-b'), (3, 'key-c'), (4, 'key-d')]
+    scheduler.order(keys)
+    api_keys = [api_key for _, api_key in keys]
+    assert scheduler.throttled_fraction(api_keys) == 0
+    scheduler.on_throttled('key-a')
+    assert scheduler.throttled_fraction(api_keys) == 0.25
+    scheduler.on_throttled('key-b')
+    assert scheduler.throttled_fraction(api_keys) == 0.5
+    # Keys never seen by the scheduler are not throttled
+    assert scheduler.throttled_fraction(['unknown']) == 0
+    assert scheduler.throttled_fraction([]) == 0
+
+KEYS = [(1, 'key-a'), (2, 'key-b'), (3, 'key-c')]
+
+def test_cooling_keys_go_last_soonest_first():
+    scheduler = KeyScheduler()
+    scheduler.on_throttled('key-a')
+    scheduler.on_throttled('key-b')
+    scheduler.on_throttled('key-b')  # Second strike: longer cooldown
+    assert scheduler.order(KEYS) == ['key-c', 'key-a', 'key-b']
+
+def test_cooldown_grows_with_strikes():
+    scheduler = KeyScheduler()
+    cooldowns = []
+    for _ in range(3):
+        scheduler.on_throttled('key-a')
+        cooldowns.append(scheduler.snapshot()['keys'][0]['cooldown_remaining'])
+    base = KeyScheduler.COOLDOWN_BASE
+    assert cooldowns == [base, 2 * base, 4 * base]
+
+def test_exhausted_keys_go_after_cooling_keys():
+    scheduler = KeyScheduler(budget_loader=lambda: {1: {'daily_remaining': 0, 'monthly_remaining': 100}})
+    scheduler.on_throttled('key-b')
+    assert scheduler.order(KEYS) == ['key-c', 'key-b', 'key-a']
+
+def test_healthy_fast_key_usually_goes_first(monkeypatch):
+    scheduler = KeyScheduler()
+    scheduler.order(KEYS)
+    for _ in range(10):
+        scheduler.on_start('key-a')
+        scheduler.on_success('key-a', 0.5)
+        scheduler.on_start('key-b')
+        scheduler.on_failure('key-b')
+    firsts = [scheduler.order(KEYS)[0] for _ in range(200)]
+    assert firsts.count('key-a') > 150
+    assert firsts.count('key-b') < 10
+
+def test_in_flight_is_released_by_every_outcome():
+    scheduler = KeyScheduler()
+    for outcome in (lambda: scheduler.on_success('key-a', 1.0), lambda: scheduler.on_failure('key-a'),
+                    lambda: scheduler.on_throttled('key-a'), lambda: scheduler.on_cancel('key-a')):
+        scheduler.on_start('key-a')
+        assert scheduler.snapshot()['keys'][0]['in_flight'] == 1
+        outcome()
+        assert scheduler.snapshot()['keys'][0]['in_flight'] == 0
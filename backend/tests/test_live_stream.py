@@ -0,0 +1,75 @@
+import base64
+import json
+
+import pytest
+import requests
+
+from audio_pipeline import PcmBuffer
+
+PCM = b'\x01\x02' * 4000
+
+def gemini_body(pcm=PCM):
+    data = base64.b64encode(pcm).decode()
+    return json.dumps({'candidates': [{'content': {'parts': [{'inlineData': {'data': data}}]}}]}).encode()
+
+class FakeResponse:
+    """Streams a Gemini body; with fail_after set, the connection breaks after that many bytes"""
+
+    status_code = 200
+
+    def __init__(self, body, fail_after=None):
+        self.body = body
+        self.fail_after = fail_after
+
+    def iter_content(self, chunk_size):
+        end = self.fail_after if self.fail_after is not None else len(self.body)
+        for start in range(0, end, 1024):
+            yield self.body[start:min(start + 1024, end)]
+        if self.fail_after is not None:
+            raise requests.exceptions.ChunkedEncodingError("Connection broken")
+
+    def close(self):
+        pass
+
+class LiveSink(PcmBuffer):
+    """Sink that passes every write straight on to a listener, like an encoder feeding a live stream"""
+
+    def __init__(self, listener):
+        super().__init__()
+        self.listener = listener
+
+    def write(self, pcm_chunk):
+        super().write(pcm_chunk)
+        if pcm_chunk:
+            self.listener.append(bytes(pcm_chunk))
+
+@pytest.fixture
+def gemini(server, monkeypatch):
+    """The first key breaks mid-response, every other key answers in full"""
+    calls = []
+
+    def post_gemini_tts(text, voice_name, api_key, deadline=None):
+        calls.append(api_key)
+        body = gemini_body()
+        return FakeResponse(body, fail_after=len(body) // 2 if api_key == 'key-broken' else None)
+
+    monkeypatch.setattr(server, 'post_gemini_tts', post_gemini_tts)
+    monkeypatch.setattr(server, 'HEDGE_ENABLED', False)
+    monkeypatch.setattr(server, 'log_failed_gemini_key', lambda key, error: None)
+    return calls
+
+def test_failure_before_output_falls_back_to_next_key(server, gemini):
+    sink, pcm_bytes, api_key = server.synthesize_pcm('hello', 'Kore', ['key-broken', 'key-ok'], PcmBuffer,
+                                                     output_started=lambda: False)
+    assert api_key == 'key-ok'
+    assert bytes(sink.data) == PCM
+    assert gemini == ['key-broken', 'key-ok']
+
+def test_failure_after_output_fails_the_stream(server, gemini):
+    sent = []
+    with pytest.raises(server.StreamInterrupted):
+        server.synthesize_pcm('hello', 'Kore', ['key-broken', 'key-ok'], lambda: LiveSink(sent),
+                              output_started=lambda: bool(sent))
+    # Only the broken attempt's audio went out; no second attempt was appended to it
+    assert gemini == ['key-broken']
+    assert 0 < sum(map(len, sent)) < len(PCM)
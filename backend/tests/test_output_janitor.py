@@ -0,0 +1,87 @@
+import os
+import time
+
+import schedule
+
+from output_janitor import OutputJanitor
+
+DAY = 24 * 3600
+
+def write(path, size, age=0, last_download=None):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'wb') as f:
+        f.write(b'x' * size)
+    now = time.time()
+    mtime = now - age
+    atime = now - last_download if last_download is not None else mtime
+    os.utime(path, (atime, mtime))
+    return path
+
+def age_dir(path, age):
+    os.utime(path, (time.time() - age, time.time() - age))
+
+def test_removes_orphans_expired_then_least_recently_downloaded(tmp_path):
+    janitor = OutputJanitor(str(tmp_path), max_bytes=250, max_age=7 * DAY, orphan_grace=3600, min_age=600)
+    orphan = write(str(tmp_path / '.tmp-abc.mp3'), 10, age=2 * 3600)
+    fresh_temp = write(str(tmp_path / '.tmp-def.mp3'), 10, age=60)
+    expired = write(str(tmp_path / 'aa' / 'bb' / 'expired.mp3'), 100, age=10 * DAY, last_download=8 * DAY)
+    oldest = write(str(tmp_path / 'cc' / 'dd' / 'oldest.mp3'), 100, age=2 * DAY, last_download=2 * DAY)
+    newer = write(str(tmp_path / 'cc' / 'ee' / 'newer.mp3'), 100, age=2 * DAY, last_download=DAY)
+    young = write(str(tmp_path / 'ff' / 'gg' / 'young.mp3'), 100, age=60)
+
+    removed = janitor.run()
+
+    assert removed == {'expired': 1, 'size': 1, 'orphan': 1}
+    assert not os.path.exists(orphan) and not os.path.exists(expired) and not os.path.exists(oldest)
+    assert os.path.exists(fresh_temp) and os.path.exists(newer) and os.path.exists(young)
+    assert janitor.freed_bytes == 210
+
+def test_hard_linked_files_expire_but_do_not_count_toward_quota(tmp_path):
+    cache_dir = tmp_path / 'cache'
+    janitor = OutputJanitor(str(tmp_path), max_bytes=150, max_age=7 * DAY, min_age=600,
+                            exclude_dirs=[str(cache_dir)])
+    cached = write(str(cache_dir / 'entry.mp3'), 100)
+    shared = str(tmp_path / 'aa' / 'bb' / 'shared.mp3')
+    os.makedirs(os.path.dirname(shared))
+    os.link(cached, shared)
+    os.utime(shared, (time.time() - DAY, time.time() - DAY))
+    own = write(str(tmp_path / 'cc' / 'dd' / 'own.mp3'), 100, age=2 * DAY, last_download=2 * DAY)
+
+    # The shared file is the least recently downloaded, but removing it would free nothing
+    assert janitor.run() == {'expired': 0, 'size': 0, 'orphan': 0}
+    assert os.path.exists(shared) and os.path.exists(own)
+    assert janitor.last_run['total_bytes'] == 100
+    assert janitor.stats()['linked_files'] == 1
+
+    os.utime(shared, (time.time() - 8 * DAY, time.time() - 8 * DAY))
+    assert janitor.run()['expired'] == 1
+    assert not os.path.exists(shared) and os.path.exists(cached)
+    assert janitor.freed_bytes == 0
+
+def test_removes_empty_shard_directories(tmp_path):
+    cache_dir = tmp_path / 'cache'
+    cache_dir.mkdir()
+    janitor = OutputJanitor(str(tmp_path), min_age=600, exclude_dirs=[str(cache_dir)])
+    (tmp_path / 'aa' / 'bb').mkdir(parents=True)
+    (tmp_path / 'cc' / 'dd').mkdir(parents=True)
+    write(str(tmp_path / 'ee' / 'ff' / 'kept.mp3'), 10, age=60)
+    age_dir(tmp_path / 'aa' / 'bb', 3600)
+    age_dir(tmp_path / 'aa', 3600)
+    age_dir(cache_dir, 3600)
+
+    janitor.run()
+    # Old and empty: gone; its parent was just modified by the removal
+    assert not (tmp_path / 'aa' / 'bb').exists()
+    assert (tmp_path / 'aa').exists()
+    # Just created, e.g. for a commit in progress
+    assert (tmp_path / 'cc' / 'dd').exists()
+    assert (tmp_path / 'ee' / 'ff').exists()
+    assert cache_dir.exists()
+
+    age_dir(tmp_path / 'aa', 3600)
+    janitor.run()
+    assert not (tmp_path / 'aa').exists()
+    assert janitor.last_run['empty_dirs_removed'] == 1
+
+def test_serving_process_schedules_the_janitor(server):
+    assert any(job.job_func.func == server.output_janitor.run for job in schedule.get_jobs())
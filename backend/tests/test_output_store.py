@@ -0,0 +1,56 @@
+import os
+import time
+
+from output_store import OutputStore
+
+def write_temp(store, data, ext='mp3'):
+    path = store.temp_path(ext)
+    with open(path, 'wb') as f:
+        f.write(data)
+    return path
+
+def test_commit_names_file_by_content_in_shards(tmp_path):
+    store = OutputStore(str(tmp_path))
+    final_path = store.commit(write_temp(store, b'audio'))
+    download_id = os.path.basename(final_path)
+    assert OutputStore.ID_PATTERN.match(download_id)
+    assert final_path == os.path.join(str(tmp_path), download_id[:2], download_id[2:4], download_id)
+    assert store.resolve(download_id) == final_path
+    assert store.resolve(download_id.upper()) == final_path
+
+    # Same content, same id
+    assert store.commit(write_temp(store, b'audio')) == final_path
+    assert [name for name in os.listdir(tmp_path) if name.startswith('.tmp-')] == []
+
+def test_add_links_and_refreshes_times(tmp_path):
+    store = OutputStore(str(tmp_path / 'outputs'))
+    source = tmp_path / 'cached.mp3'
+    source.write_bytes(b'cached audio')
+    old = time.time() - 3600
+    os.utime(source, (old, old))
+
+    final_path = store.add(str(source))
+    assert os.path.samefile(final_path, source)
+    # A reused file counts as new for the output janitor
+    assert os.stat(final_path).st_mtime > old + 60
+    assert store.add(str(source)) == final_path
+
+def test_alias_resolves_announced_id(tmp_path):
+    store = OutputStore(str(tmp_path))
+    final_path = store.commit(write_temp(store, b'streamed'))
+    announced = OutputStore.new_id('mp3')
+    assert store.resolve(announced) is None
+
+    store.alias(announced, final_path, duration=1.25, samples=30000)
+    assert store.resolve(announced) == final_path
+    info = OutputStore(str(tmp_path)).alias_info(announced)
+    assert info == {'id': os.path.basename(final_path), 'duration': 1.25, 'samples': 30000}
+
+def test_resolve_rejects_unknown_and_unsafe_ids(tmp_path):
+    store = OutputStore(str(tmp_path))
+    legacy = tmp_path / 'voice_123.mp3'
+    legacy.write_bytes(b'old layout')
+    assert store.resolve('voice_123.mp3') == str(legacy)
+    assert store.resolve('../voice_123.mp3') is None
+    assert store.resolve(OutputStore.new_id('mp3')) is None
+    assert store.resolve('') is None and store.resolve(None) is None
@@ -0,0 +1,84 @@
+import time
+
+import requests
+from requests.cookies import extract_cookies_to_jar
+
+from session_pool import SessionPool
+
+class TrackedSession(requests.Session):
+    def __init__(self, proxies=None):
+        super().__init__()
+        self.proxies_used = proxies
+        self.closed = False
+
+    def close(self):
+        self.closed = True
+        super().close()
+
+def make_pool(**kwargs):
+    return SessionPool(TrackedSession, **kwargs)
+
+def test_one_session_per_proxy():
+    pool = make_pool()
+    direct = pool.get()
+    assert pool.get(None) is direct
+    proxied = pool.get({'https': 'http://proxy:8080'})
+    assert proxied is not direct
+    assert proxied.proxies_used == {'https': 'http://proxy:8080'}
+    assert pool.get({'https': 'http://proxy:8080'}) is proxied
+    assert pool.stats()['created'] == 2
+
+def test_key_ignores_proxy_dict_order():
+    first = SessionPool.make_key({'http': 'http://p:1', 'https': 'http://p:1'})
+    second = SessionPool.make_key({'https': 'http://p:1', 'http': 'http://p:1'})
+    assert first == second
+    assert SessionPool.make_key(None) == SessionPool.make_key({}) == 'direct'
+
+def test_least_recently_used_session_is_closed():
+    pool = make_pool(max_sessions=2)
+    a = pool.get({'https': 'http://a:1'})
+    b = pool.get({'https': 'http://b:1'})
+    pool.get({'https': 'http://a:1'})  # a is now the most recently used
+    pool.get({'https': 'http://c:1'})
+    assert b.closed and not a.closed
+    stats = pool.stats()
+    assert (stats['sessions'], stats['evicted']) == (2, 1)
+
+def test_idle_sessions_are_evicted():
+    pool = make_pool(idle_ttl=0.01)
+    old = pool.get()
+    time.sleep(0.02)
+    assert pool.evict_idle() == 1
+    assert old.closed
+    # An expired session is replaced on the next get as well
+    fresh = pool.get()
+    time.sleep(0.02)
+    assert pool.get() is not fresh and fresh.closed
+
+def test_sessions_do_not_keep_cookies():
+    session = make_pool().get()
+    request = requests.Request('GET', 'https://example.com/').prepare()
+    extract_cookies_to_jar(session.cookies, request, _RawResponse({'Set-Cookie': 'sid=abc; Path=/'}))
+    assert len(session.cookies) == 0
+
+def test_close_all():
+    pool = make_pool()
+    sessions = [pool.get(), pool.get({'https': 'http://a:1'})]
+    pool.close_all()
+    assert all(session.closed for session in sessions)
+    assert pool.stats()['sessions'] == 0
+
+class _RawResponse:
+    """Minimal stand-in for the urllib3 response extract_cookies_to_jar reads headers from"""
+
+    def __init__(self, headers):
+        self._original_response = self
+        self.msg = _Headers(headers)
+
+class _Headers:
+    def __init__(self, headers):
+        self.headers = headers
+
+    def get_all(self, name, default=None):
+        value = self.headers.get(name)
+        return [value] if value is not None else (default or [])
@@ -0,0 +1,126 @@
+import threading
+import time
+
+import pytest
+
+from single_flight import SingleFlight, CoalesceTimeout
+
+def start_leader(flight, key, fn):
+    """Run flight.do(key, fn) in a thread; returns the thread and its outcome dict"""
+    outcome = {}
+
+    def run():
+        try:
+            outcome['result'] = flight.do(key, fn)
+        except Exception as e:
+            outcome['error'] = e
+
+    thread = threading.Thread(target=run)
+    thread.start()
+    return thread, outcome
+
+def wait_for(condition, timeout=2):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, "condition not met in time"
+        time.sleep(0.005)
+
+def test_followers_share_the_leader_result():
+    flight = SingleFlight()
+    release = threading.Event()
+    calls = []
+
+    def work():
+        calls.append(1)
+        release.wait(2)
+        return 'audio'
+
+    leader, outcome = start_leader(flight, 'k', work)
+    wait_for(lambda: flight.stats()['in_flight'] == 1)
+
+    results = []
+    followers = [threading.Thread(target=lambda: results.append(flight.do('k', work))) for _ in range(3)]
+    for thread in followers:
+        thread.start()
+    wait_for(lambda: flight.stats()['waiting'] == 3)
+    release.set()
+    for thread in [leader] + followers:
+        thread.join(2)
+
+    assert calls == [1]
+    assert outcome['result'] == ('audio', False)
+    assert results == [('audio', True)] * 3
+    stats = flight.stats()
+    assert (stats['leaders'], stats['followers'], stats['in_flight']) == (1, 3, 0)
+
+def test_different_keys_are_not_coalesced():
+    flight = SingleFlight()
+    assert flight.do('a', lambda: 1) == (1, False)
+    assert flight.do('b', lambda: 2) == (2, False)
+    # Nothing is remembered once a call finishes
+    assert flight.do('a', lambda: 3) == (3, False)
+
+def test_unshared_error_makes_a_follower_retry_as_leader():
+    flight = SingleFlight()
+    release = threading.Event()
+
+    def failing():
+        release.wait(2)
+        raise TimeoutError("leader deadline")
+
+    leader, outcome = start_leader(flight, 'k', failing)
+    wait_for(lambda: flight.stats()['in_flight'] == 1)
+
+    results = []
+    follower = threading.Thread(target=lambda: results.append(
+        flight.do('k', lambda: 'retried', share_error=lambda e: not isinstance(e, TimeoutError))))
+    follower.start()
+    wait_for(lambda: flight.stats()['waiting'] == 1)
+    release.set()
+    leader.join(2)
+    follower.join(2)
+
+    assert isinstance(outcome['error'], TimeoutError)
+    assert results == [('retried', False)]
+    assert flight.stats()['retries'] == 1
+
+def test_shared_error_is_raised_to_followers():
+    flight = SingleFlight()
+    release = threading.Event()
+
+    def failing():
+        release.wait(2)
+        raise ValueError("bad text")
+
+    leader, outcome = start_leader(flight, 'k', failing)
+    wait_for(lambda: flight.stats()['in_flight'] == 1)
+
+    errors = []
+
+    def follow():
+        try:
+            flight.do('k', lambda: 'unused', share_error=lambda e: isinstance(e, ValueError))
+        except ValueError as e:
+            errors.append(e)
+
+    follower = threading.Thread(target=follow)
+    follower.start()
+    wait_for(lambda: flight.stats()['waiting'] == 1)
+    release.set()
+    leader.join(2)
+    follower.join(2)
+
+    assert errors and errors[0] is outcome['error']
+    assert flight.stats()['shared_errors'] == 1
+
+def test_follower_times_out_while_leader_runs():
+    flight = SingleFlight()
+    release = threading.Event()
+    leader, _ = start_leader(flight, 'k', lambda: release.wait(2))
+    wait_for(lambda: flight.stats()['in_flight'] == 1)
+
+    with pytest.raises(CoalesceTimeout):
+        flight.do('k', lambda: 'unused', timeout=0.05)
+    release.set()
+    leader.join(2)
+    assert flight.stats()['timeouts'] == 1
@@ -0,0 +1,18 @@
+import multiprocessing
+import os
+import runpy
+
+API_SERVER = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'api_server.py')
+
+def test_spawned_encoder_worker_skips_startup(tmp_path, monkeypatch):
+    """A spawned process re-runs the main script as __mp_main__; it must not init the app"""
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(multiprocessing.current_process(), 'name', 'SpawnProcess-1')
+    module = runpy.run_path(API_SERVER, run_name='__mp_main__')
+    assert not os.path.exists(tmp_path / 'voice_api.db')
+    assert not module['voice_jobs_started']
+
+def test_init_app_prepares_a_serving_process(server):
+    assert os.path.exists(server.db.db_path)
+    assert os.path.isdir(server.UPLOAD_FOLDER)
+    assert server.voice_jobs_started
@@ -0,0 +1,34 @@
+from text_chunker import split_text
+
+def test_short_and_empty_text():
+    assert split_text('Xin chào.', max_chars=400) == ['Xin chào.']
+    assert split_text('   ') == []
+    assert split_text(None) == []
+
+def test_packs_sentences_up_to_max_chars():
+    text = 'One two. Three four! Five six? Seven eight.'
+    chunks = split_text(text, max_chars=20)
+    assert chunks == ['One two. Three four!', 'Five six?', 'Seven eight.']
+    assert all(len(chunk) <= 20 for chunk in chunks)
+
+def test_splits_at_cjk_punctuation_and_line_breaks():
+    chunks = split_text('第一句。第二句！\nThird line', max_chars=5)
+    assert chunks == ['第一句。', '第二句！', 'Third', 'line']
+
+def test_long_sentence_splits_at_clauses_then_words():
+    sentence = 'alpha beta, gamma delta epsilon zeta eta theta; iota'
+    chunks = split_text(sentence, max_chars=16)
+    assert all(len(chunk) <= 16 for chunk in chunks)
+    assert chunks[0] == 'alpha beta,'
+    assert ' '.join(chunks).split() == sentence.split()
+
+def test_word_longer_than_max_chars_is_hard_split():
+    chunks = split_text('a' * 25, max_chars=10)
+    assert chunks == ['a' * 10, 'a' * 10, 'a' * 5]
+
+def test_chunks_reproduce_the_text():
+    text = ('Câu thứ nhất khá dài, có dấu phẩy; và dấu chấm phẩy. Câu thứ hai ngắn! '
+            'Câu thứ ba hỏi? "Câu trích dẫn." Hết.') * 5
+    chunks = split_text(text, max_chars=60)
+    assert all(len(chunk) <= 60 for chunk in chunks)
+    assert ''.join(chunks).replace(' ', '') == text.replace(' ', '')
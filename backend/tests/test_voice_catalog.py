@@ -0,0 +1,65 @@
+import shutil
+import threading
+
+from voice_catalog import VoiceCatalog
+
+VOICES = [{'name': 'Voice 1', 'code': 'kore'}, {'name': 'Voice 2', 'code': 'puck'}]
+
+def make_catalog(tmp_path, **kwargs):
+    sample_dir = tmp_path / 'voices'
+    sample_dir.mkdir(exist_ok=True)
+    (sample_dir / 'kore.mp3').write_bytes(b'kore sample')
+    return VoiceCatalog(VOICES, str(sample_dir), check_interval=0, **kwargs), sample_dir
+
+def test_body_and_etag_are_built_once(tmp_path):
+    catalog, _ = make_catalog(tmp_path)
+    body, etag = catalog.response_body('http://host')
+    assert catalog.response_body('http://host') == (body, etag)
+    assert catalog.builds == 1
+
+    voices = {entry['code']: entry for entry in catalog.entries()}
+    assert voices['kore']['sample_size'] == len(b'kore sample')
+    assert voices['puck']['sample_file'] is None
+    assert b'http://host/api/voice/play/kore.mp3?v=' in body
+
+    # Sample URLs are absolute, so another base URL has its own body and ETag
+    other_body, other_etag = catalog.response_body('https://other')
+    assert other_etag != etag and b'https://other/' in other_body
+
+def test_etag_changes_when_a_sample_changes(tmp_path):
+    catalog, sample_dir = make_catalog(tmp_path)
+    _, etag = catalog.response_body('http://host')
+    version = catalog.sample('kore.mp3')['version']
+
+    (sample_dir / 'kore.mp3').write_bytes(b'new kore sample')
+    _, new_etag = catalog.response_body('http://host')
+    assert new_etag != etag
+    assert catalog.sample('kore.mp3')['version'] != version
+    assert catalog.builds == 2
+
+def test_preview_variant(tmp_path):
+    def transcode(source, output):
+        shutil.copyfile(source, output)
+        with open(output, 'ab') as f:
+            f.write(b' preview')
+
+    catalog, _ = make_catalog(tmp_path, transcode=transcode)
+    catalog.refresh()
+    for thread in [t for t in threading.enumerate() if t.name == 'voice-previews']:
+        thread.join(5)
+
+    preview = catalog.sample('kore.mp3', preview=True)
+    assert preview['preview'] and preview['data'] == b'kore sample preview'
+    assert preview['etag'] != catalog.sample('kore.mp3')['etag']
+    assert catalog.sample('missing.mp3') is None
+
+def test_voice_list_revalidates_with_etag(server):
+    client = server.app.test_client()
+    response = client.get('/api/voice/list')
+    assert response.status_code == 200
+    etag = response.headers['ETag']
+    assert 'max-age' in response.headers['Cache-Control']
+
+    response = client.get('/api/voice/list', headers={'If-None-Match': etag})
+    assert response.status_code == 304
+    assert response.data == b''
@@ -0,0 +1,94 @@
+import sqlite3
+import threading
+
+import pytest
+
+from database import DatabaseManager
+from job_queue import VoiceJobQueue, QueueFullError
+
+@pytest.fixture
+def db(tmp_path):
+    return DatabaseManager(str(tmp_path / 'voice_api.db'))
+
+def set_heartbeat_age(db, job_id, seconds):
+    conn = sqlite3.connect(db.db_path)
+    conn.execute("UPDATE voice_jobs SET heartbeat_at = datetime('now', ?) WHERE id = ?",
+                 (f'-{seconds} seconds', job_id))
+    conn.commit()
+    conn.close()
+
+def test_a_job_is_claimed_only_once(db):
+    db.create_voice_job('job1', 1, {'text': 'hello'})
+    assert db.claim_voice_job('job1', 'worker-a')
+    assert not db.claim_voice_job('job1', 'worker-b')
+    job = db.get_voice_job('job1')
+    assert (job['status'], job['worker_id']) == ('running', 'worker-a')
+    assert job['request_data'] == {'text': 'hello'}
+
+def test_concurrent_claims_have_one_winner(db):
+    db.create_voice_job('job1', 1, {'text': 'hello'})
+    results = []
+    threads = [threading.Thread(target=lambda i=i: results.append(db.claim_voice_job('job1', f'worker-{i}')))
+               for i in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert results.count(True) == 1
+
+def test_finished_jobs_cannot_be_claimed(db):
+    db.create_voice_job('job1', 1, {'text': 'hello'})
+    db.claim_voice_job('job1', 'worker-a')
+    db.finish_voice_job('job1', 'abc.mp3', 1.5, samples=36000)
+    assert not db.claim_voice_job('job1', 'worker-b')
+    assert db.get_voice_job('job1')['status'] == 'succeeded'
+
+def test_stale_running_jobs_are_requeued(db):
+    db.create_voice_job('dead', 1, {'text': 'a'})
+    db.create_voice_job('alive', 1, {'text': 'b'})
+    db.create_voice_job('waiting', 1, {'text': 'c'})
+    db.claim_voice_job('dead', 'crashed-worker')
+    db.claim_voice_job('alive', 'live-worker')
+    set_heartbeat_age(db, 'dead', 900)
+    set_heartbeat_age(db, 'alive', 900)
+    db.heartbeat_voice_jobs('live-worker')
+
+    assert db.requeue_stale_voice_jobs(300) == 1
+    dead = db.get_voice_job('dead')
+    assert (dead['status'], dead['worker_id'], dead['heartbeat_at']) == ('queued', None, None)
+    assert db.get_voice_job('alive')['status'] == 'running'
+    assert db.get_queued_voice_job_ids() == ['dead', 'waiting']
+    # A requeued job can be claimed again
+    assert db.claim_voice_job('dead', 'new-worker')
+
+def test_queued_job_ids_respect_min_age(db):
+    db.create_voice_job('job1', 1, {'text': 'a'})
+    assert db.get_queued_voice_job_ids(min_age=60) == []
+    assert db.get_queued_voice_job_ids() == ['job1']
+
+def test_queue_runs_jobs_and_skips_duplicate_recovery():
+    ran = []
+    gate = threading.Event()
+
+    def handler(job_id):
+        gate.wait(2)
+        ran.append(job_id)
+
+    jobs = VoiceJobQueue(handler, workers=1)
+    jobs.submit('a')
+    # Already tracked, so a recovery scan must not queue it a second time
+    assert not jobs.recover('a')
+    assert jobs.recover('b')
+    jobs.start()
+    threading.Timer(0.05, gate.set).start()
+    assert jobs.wait('a', 2)
+    assert jobs.wait('b', 2) or 'b' in ran
+    assert ran == ['a', 'b']
+    # Finished jobs are no longer tracked
+    assert not jobs.wait('a', 0)
+
+def test_queue_rejects_when_full():
+    jobs = VoiceJobQueue(lambda job_id: None, max_queued=1)
+    jobs.submit('a')
+    with pytest.raises(QueueFullError):
+        jobs.submit('b')
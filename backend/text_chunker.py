@@ -0,0 +1,60 @@
+import re
+
+# Sentence ends: Latin/CJK terminal punctuation (optionally followed by closing quotes/brackets) or line breaks
+SENTENCE_PATTERN = re.compile(r'[^.!?…。！？\n]*(?:[.!?…。！？]+[\'"”’)\]]*|\n+|$)')
+CLAUSE_PATTERN = re.compile(r'[^,;:，；：]*(?:[,;:，；：]+|$)')
+
+def _pieces(pattern, text):
+    return [piece for piece in pattern.findall(text) if piece.strip()]
+
+def _split_long(sentence, max_chars):
+    """Split a sentence longer than max_chars at clause punctuation, then at whitespace"""
+    parts = []
+    for clause in _pieces(CLAUSE_PATTERN, sentence):
+        if len(clause) <= max_chars:
+            parts.append(clause)
+            continue
+
+        current = ''
+        for word in re.findall(r'\S+\s*', clause):
+            if current and len(current) + len(word) > max_chars:
+                parts.append(current)
+                current = ''
+            # A single word longer than max_chars is hard-split
+            while len(word) > max_chars:
+                parts.append(word[:max_chars])
+                word = word[max_chars:]
+            current += word
+        if current.strip():
+            parts.append(current)
+    return parts
+
+def split_text(text, max_chars=400):
+    """Split text into chunks of at most max_chars, preferring sentence boundaries.
+
+    Adjacent short sentences are packed together so chunks stay close to
+    max_chars; the chunks joined back together reproduce the original text
+    apart from surrounding whitespace.
+    """
+    text = (text or '').strip()
+    if len(text) <= max_chars:
+        return [text] if text else []
+
+    units = []
+    for sentence in _pieces(SENTENCE_PATTERN, text):
+        if len(sentence) <= max_chars:
+            units.append(sentence)
+        else:
+            units.extend(_split_long(sentence, max_chars))
+
+    chunks = []
+    current = ''
+    for unit in units:
+        if current and len(current) + len(unit) > max_chars:
+            chunks.append(current.strip())
+            current = ''
+        current += unit
+    if current.strip():
+        chunks.append(current.strip())
+
+    return chunks
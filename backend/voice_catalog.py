@@ -0,0 +1,191 @@
+import os
+import json
+import time
+import shutil
+import hashlib
+import tempfile
+import threading
+from mutagen import File as MutagenFile
+
+class VoiceCatalog:
+    """Voice list with sample metadata, built once and served as prebuilt JSON.
+
+    Sample files are read into memory, measured and hashed only when the
+    sample directory changes (checked at most every check_interval seconds),
+    so previews are served without touching the disk. When transcode is
+    given, a low-bitrate preview variant of every sample is produced in a
+    background thread and kept in memory as well. The JSON body and its ETag
+    are kept per base URL, since sample URLs are absolute; sample URLs carry
+    the content hash (?v=) so the audio behind them never changes.
+    """
+
+    def __init__(self, voices, sample_dir, sample_path='/api/voice/play/', check_interval=10, transcode=None):
+        self.voices = voices
+        self.sample_dir = sample_dir
+        self.sample_path = sample_path
+        self.check_interval = check_interval
+        self.transcode = transcode  # transcode(input_path, output_path) for the preview variant
+        self._lock = threading.Lock()
+        self._signature = None
+        self._checked_at = 0
+        self._entries = []
+        self._samples = {}  # filename -> {'data', 'etag', 'version', 'last_modified', 'preview'}
+        self._bodies = {}  # base_url -> (body bytes, etag)
+        self.builds = 0
+        self.previews_built = 0
+        self.preview_failures = 0
+
+    def _dir_signature(self):
+        try:
+            with os.scandir(self.sample_dir) as entries:
+                return tuple(sorted((entry.name, entry.stat().st_mtime_ns, entry.stat().st_size)
+                                    for entry in entries if entry.is_file()))
+        except FileNotFoundError:
+            return ()
+
+    @staticmethod
+    def _load_sample(file_path):
+        with open(file_path, 'rb') as f:
+            data = f.read()
+        digest = hashlib.sha256(data).hexdigest()
+        try:
+            duration = round(MutagenFile(file_path).info.length, 2)
+        except Exception as e:
+            print(f"[VOICES] Failed to read duration of {file_path}: {e}")
+            duration = None
+        sample = {
+            'data': data,
+            'etag': digest[:32],
+            'version': digest[:12],
+            'last_modified': os.path.getmtime(file_path),
+            'preview': None
+        }
+        info = {'sample_size': len(data), 'sample_duration': duration, 'sample_hash': digest}
+        return sample, info
+
+    def _build_locked(self, signature):
+        files = {name for name, _, _ in signature}
+        entries = []
+        samples = {}
+        for voice in self.voices:
+            entry = dict(voice)
+            filename = f"{voice['code']}.mp3"
+            entry['sample_file'] = None
+            if filename in files:
+                try:
+                    sample, info = self._load_sample(os.path.join(self.sample_dir, filename))
+                    samples[filename] = sample
+                    entry['sample_file'] = filename
+                    entry.update(info)
+                except OSError as e:
+                    print(f"[VOICES] Failed to load sample {filename}: {e}")
+            entries.append(entry)
+        self._entries = entries
+        self._samples = samples
+        self._bodies = {}
+        self._signature = signature
+        self.builds += 1
+        print(f"[VOICES] Built voice catalog ({len(samples)}/{len(entries)} samples, "
+              f"{sum(len(sample['data']) for sample in samples.values())} bytes in memory)")
+        if self.transcode and samples:
+            threading.Thread(target=self._build_previews, args=(signature,), daemon=True,
+                             name='voice-previews').start()
+
+    def _build_previews(self, signature):
+        with self._lock:
+            sources = {filename: sample['data'] for filename, sample in self._samples.items()}
+        work_dir = tempfile.mkdtemp(prefix='voice_previews_')
+        failures = []
+        try:
+            for filename, data in sources.items():
+                source_path = os.path.join(work_dir, 'source.mp3')
+                preview_path = os.path.join(work_dir, 'preview.mp3')
+                try:
+                    with open(source_path, 'wb') as f:
+                        f.write(data)
+                    self.transcode(source_path, preview_path)
+                    with open(preview_path, 'rb') as f:
+                        preview = f.read()
+                except Exception as e:
+                    self.preview_failures += 1
+                    failures.append((filename, e))
+                    continue
+                with self._lock:
+                    sample = self._samples.get(filename)
+                    if self._signature != signature or sample is None:
+                        return  # Samples changed meanwhile; the new build makes its own previews
+                    sample['preview'] = {'data': preview, 'etag': hashlib.sha256(preview).hexdigest()[:32]}
+                    self.previews_built += 1
+        finally:
+            shutil.rmtree(work_dir, ignore_errors=True)
+            if failures:
+                # Originals are served instead; one line is enough when e.g. ffmpeg is missing
+                print(f"[VOICES] Failed to build {len(failures)} previews, first {failures[0][0]}: {failures[0][1]}")
+
+    def refresh(self, force=False):
+        """Rebuild the catalog if the sample directory changed"""
+        with self._lock:
+            now = time.monotonic()
+            if not force and self._signature is not None and now - self._checked_at < self.check_interval:
+                return
+            self._checked_at = now
+            signature = self._dir_signature()
+            if force or signature != self._signature:
+                self._build_locked(signature)
+
+    def entries(self):
+        self.refresh()
+        with self._lock:
+            return [dict(entry) for entry in self._entries]
+
+    def sample(self, filename, preview=False):
+        """In-memory sample: dict with data, etag, version, last_modified and whether it is
+        the preview variant (falls back to the original until the preview is built); None if unknown"""
+        self.refresh()
+        with self._lock:
+            sample = self._samples.get(filename)
+            if sample is None:
+                return None
+            result = {'data': sample['data'], 'etag': sample['etag'], 'version': sample['version'],
+                      'last_modified': sample['last_modified'], 'preview': False}
+            if preview and sample['preview'] is not None:
+                result.update(data=sample['preview']['data'], etag=sample['preview']['etag'], preview=True)
+            return result
+
+    def response_body(self, base_url):
+        """(JSON bytes, ETag) of the catalog with sample URLs under base_url"""
+        self.refresh()
+        with self._lock:
+            cached = self._bodies.get(base_url)
+            if cached:
+                return cached
+            voices = []
+            for entry in self._entries:
+                voice = {key: value for key, value in entry.items() if key != 'sample_file'}
+                voice['sample_url'] = None
+                voice['preview_url'] = None
+                if entry['sample_file']:
+                    url = f"{base_url}{self.sample_path}{entry['sample_file']}?v={entry['sample_hash'][:12]}"
+                    voice['sample_url'] = url
+                    voice['preview_url'] = f"{url}&variant=preview" if self.transcode else url
+                voices.append(voice)
+            body = json.dumps({'success': True, 'voices': voices}, ensure_ascii=False).encode('utf-8')
+            etag = hashlib.sha256(body).hexdigest()[:32]
+            if len(self._bodies) >= 16:
+                self._bodies.clear()
+            self._bodies[base_url] = (body, etag)
+            return body, etag
+
+    def stats(self):
+        with self._lock:
+            return {
+                'voices': len(self._entries),
+                'samples': len(self._samples),
+                'sample_bytes': sum(len(sample['data']) for sample in self._samples.values()),
+                'previews': sum(1 for sample in self._samples.values() if sample['preview'] is not None),
+                'preview_bytes': sum(len(sample['preview']['data']) for sample in self._samples.values()
+                                     if sample['preview'] is not None),
+                'builds': self.builds,
+                'previews_built': self.previews_built,
+                'preview_failures': self.preview_failures
+            }
@@ -14,6 +14,7 @@ from functools import partial
 from proxy_manager import parse_proxy_line, check_and_filter_proxies
 import pandas as pd
 import json
+import hashlib
 from auth_guard import KeyLoginDialog, get_device_id
 from version_checker import check_for_update, CURRENT_VERSION
 import re
@@ -25,8 +26,86 @@ try:
     with open('config.json', 'r') as f:
         config = json.load(f)
         API_URL = config.get('api_url', 'http://localhost:5000')
+        STREAM_AUDIO = config.get('stream_audio', False)
+        BATCH_MODE = config.get('batch_mode', False)
+        REQUEST_TIMEOUT = config.get('request_timeout', 300)
 except:
     API_URL = "http://localhost:5000"
+    STREAM_AUDIO = False
+    BATCH_MODE = False
+    REQUEST_TIMEOUT = 300
+
+# Sent to the server so it stops working on a voice once we have given up waiting
+DEADLINE_HEADERS = {'X-Request-Timeout': str(REQUEST_TIMEOUT)}
+
+# Rows per /api/voice/batch request (the server's BATCH_MAX_ROWS); a lower limit in a 400 is followed
+BATCH_MAX_ROWS = 500
+
+# Voice list and sample audio kept locally; re-fetched only when the server's copy changes
+VOICE_CACHE_DIR = "voice_cache"
+VOICE_CATALOG_FILE = os.path.join(VOICE_CACHE_DIR, "catalog.json")
+
+def file_sha256(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+def cached_voice_sample(voice):
+    """Local copy of a voice sample, downloaded once and checked against the catalog hash; None if unavailable"""
+    sample_url = voice.get("sample_url")
+    sample_hash = voice.get("sample_hash")
+    if not sample_url or not sample_hash:
+        return None
+
+    local_path = os.path.join(VOICE_CACHE_DIR, f"{voice['code']}.mp3")
+    try:
+        if os.path.exists(local_path) and file_sha256(local_path) == sample_hash:
+            return local_path
+        os.makedirs(VOICE_CACHE_DIR, exist_ok=True)
+        download_file(sample_url, local_path)
+        if file_sha256(local_path) != sample_hash:
+            print(f"[⚠️ SAMPLE] Hash mismatch for {voice['code']}, playing from server")
+            os.remove(local_path)
+            return None
+        return local_path
+    except Exception as e:
+        print(f"[⚠️ SAMPLE] Could not cache sample {voice['code']}: {e}")
+        return None
+
+def download_file(file_url, save_path, max_retries=3):
+    """Download to save_path, resuming a partial download with a Range request on retry"""
+    part_path = save_path + ".part"
+    etag = None
+    for attempt in range(max_retries):
+        headers = {}
+        offset = os.path.getsize(part_path) if os.path.exists(part_path) else 0
+        if offset and etag:
+            # If-Range: the server sends the whole file again if it changed in between
+            headers = {"Range": f"bytes={offset}-", "If-Range": etag}
+        try:
+            with requests.get(file_url, headers=headers, stream=True, timeout=60) as r:
+                if r.status_code == 206:
+                    print(f"[🔄 RESUME] Tiếp tục tải từ byte {offset}")
+                    mode = "ab"
+                elif r.status_code == 200:
+                    mode = "wb"
+                else:
+                    print(f"[❌ HTTP ERROR] Status: {r.status_code}")
+                    if attempt == max_retries - 1:
+                        raise Exception(f"HTTP {r.status_code}")
+                    continue
+                etag = r.headers.get("ETag")
+                with open(part_path, mode) as f:
+                    for chunk in r.iter_content(chunk_size=64 * 1024):
+                        f.write(chunk)
+            os.replace(part_path, save_path)
+            return
+        except requests.exceptions.RequestException as e:
+            print(f"[❌ ERROR] Download attempt {attempt + 1}/{max_retries} failed: {e}")
+            if attempt == max_retries - 1:
+                raise Exception(f"Download failed after {max_retries} attempts: {e}")
 
 class ProxyCheckThread(QThread):
     result_ready = pyqtSignal(list)
@@ -50,6 +129,7 @@ class VoiceConvertThread(QThread):
     result_ready = pyqtSignal(int, bool, str, str, str, str, str, float)
     file_downloaded = pyqtSignal(int, str)
     progress_updated = pyqtSignal(int, int)
+    stream_started = pyqtSignal(int, str)
 
     def __init__(self, row, text, save_folder, file_name, user_key, speed, voice_name, proxies, stt):
         super().__init__()
@@ -80,8 +160,13 @@ class VoiceConvertThread(QThread):
 
             print(f"🔄 Gửi request tạo voice với key {self.user_key[:8]}... voice: {self.voice_name}")
             self.progress_updated.emit(self.row, 25)
+
+            if STREAM_AUDIO:
+                self.run_streaming(payload)
+                return
             
-            response = requests.post(f"{API_URL}/api/voice/create", json=payload)
+            response = requests.post(f"{API_URL}/api/voice/create", json=payload, headers=DEADLINE_HEADERS,
+                                     timeout=(10, REQUEST_TIMEOUT))
 
             try:
                 res = response.json()
@@ -109,62 +194,36 @@ class VoiceConvertThread(QThread):
                 print(f"[🔧 DEBUG] Downloading from: {file_url}")
                 print(f"[🔧 DEBUG] Saving file to: {save_path}")
                 
-                # Download with retry logic
-                max_retries = 3
-                for attempt in range(max_retries):
-                    try:
-                        print(f"[🔄 ATTEMPT] Download attempt {attempt + 1}/{max_retries}")
-                        r = requests.get(file_url, timeout=60)  # Increased timeout to 60 seconds
-                        
-                        if r.status_code == 200:
-                            break
-                        else:
-                            print(f"[❌ HTTP ERROR] Status: {r.status_code}")
-                            if attempt == max_retries - 1:
-                                raise Exception(f"HTTP {r.status_code}")
-                    except requests.exceptions.Timeout:
-                        print(f"[⏰ TIMEOUT] Attempt {attempt + 1} timed out")
-                        if attempt == max_retries - 1:
-                            raise Exception("Download timeout after 3 attempts")
-                    except Exception as e:
-                        print(f"[❌ ERROR] Attempt {attempt + 1} failed: {e}")
-                        if attempt == max_retries - 1:
-                            raise Exception(f"Download failed: {str(e)}")
-                
-                if r.status_code == 200:
-                    if os.path.exists(save_path):
-                        try:
-                            os.remove(save_path)
-                            print(f"[🧹 DELETE] Đã xóa file cũ: {save_path}")
-                        except Exception as e:
-                            print(f"[❌ ERROR] Không thể xóa file cũ: {e}")
-                            self.result_ready.emit(self.row, False, "", "", "", "", f"Lỗi xóa file cũ: {str(e)}", 0.0)
-                            return
-
-                    with open(save_path, 'wb') as f:
-                        f.write(r.content)
-
-                    self.progress_updated.emit(self.row, 75)
-                    print(f"[✅ SAVED] File saved successfully: {save_path}")
-                    
-                    duration_sec = res.get("duration", 0)
-                    if duration_sec == 0:
-                        try:
-                            audio = MP3(save_path)
-                            duration_sec = audio.info.length
-                        except:
-                            duration_sec = 0
-                    
-                    self.duration = duration_sec
-                    timing_str = f"{int(duration_sec // 60):02}:{int(duration_sec % 60):02}"
-                    
-                    self.progress_updated.emit(self.row, 100)
-                    self.result_ready.emit(self.row, True, timing_str, self.speed, "N/A", save_path, save_path, duration_sec)
-                    self.file_downloaded.emit(self.row, file_url)
+                # Download with retry logic; a retry resumes the partial file
+                try:
+                    download_file(file_url, save_path)
+                except Exception as e:
+                    print(f"[❌ ERROR] {e}")
+                    self.result_ready.emit(self.row, False, "", "", "", "", f"Tạo OK nhưng tải lỗi: {e}", 0.0)
                     return
+
+                self.progress_updated.emit(self.row, 75)
+                print(f"[✅ SAVED] File saved successfully: {save_path}")
+                
+                # Prefer the sample-accurate duration reported by the server
+                if res.get("samples") and res.get("sample_rate"):
+                    duration_sec = res["samples"] / res["sample_rate"]
                 else:
-                    self.result_ready.emit(self.row, False, "", "", "", "", f"Tạo OK nhưng tải lỗi: HTTP {r.status_code}", 0.0)
-                    return
+                    duration_sec = res.get("duration", 0)
+                if duration_sec == 0:
+                    try:
+                        audio = MP3(save_path)
+                        duration_sec = audio.info.length
+                    except:
+                        duration_sec = 0
+                
+                self.duration = duration_sec
+                timing_str = f"{int(duration_sec // 60):02}:{int(duration_sec % 60):02}"
+                
+                self.progress_updated.emit(self.row, 100)
+                self.result_ready.emit(self.row, True, timing_str, self.speed, "N/A", save_path, save_path, duration_sec)
+                self.file_downloaded.emit(self.row, file_url)
+                return
             else:
                 self.result_ready.emit(self.row, False, "", "", "", "", "Phản hồi không hợp lệ hoặc không phải file .mp3", 0.0)
                 return
@@ -173,6 +232,173 @@ class VoiceConvertThread(QThread):
             print(f"❌ Voice tạo thất bại: {e}")
             self.result_ready.emit(self.row, False, "", "", "", "", str(e), 0.0)
 
+    def run_streaming(self, payload):
+        """Create voice via the streaming endpoint, saving audio while it is generated"""
+        os.makedirs(self.save_folder, exist_ok=True)
+        save_path = os.path.join(self.save_folder, self.file_name)
+
+        with requests.post(f"{API_URL}/api/voice/create-stream", json=payload, stream=True, headers=DEADLINE_HEADERS,
+                           timeout=(10, REQUEST_TIMEOUT)) as response:
+            if not response.ok:
+                try:
+                    res = response.json()
+                except Exception:
+                    res = {}
+                error_msg = res.get("error") or res.get("message") or f"Lỗi HTTP: {response.status_code}"
+                print(f"❌ Voice tạo thất bại: {error_msg}")
+                self.result_ready.emit(self.row, False, "", "", "", "", error_msg, 0.0)
+                return
+
+            # The live URL can be played right away while the rest is still being generated
+            live_url = response.headers.get("X-Voice-Live-Url")
+            if live_url:
+                self.stream_started.emit(self.row, f"{API_URL}{live_url}")
+
+            self.progress_updated.emit(self.row, 50)
+            print(f"[🔧 DEBUG] Streaming to: {save_path}")
+            try:
+                with open(save_path, 'wb') as f:
+                    for chunk in response.iter_content(chunk_size=16 * 1024):
+                        if chunk:
+                            f.write(chunk)
+            except Exception as e:
+                # The server drops the connection if generation fails mid-stream
+                if os.path.exists(save_path):
+                    os.remove(save_path)
+                self.result_ready.emit(self.row, False, "", "", "", "", f"Stream bị gián đoạn: {e}", 0.0)
+                return
+
+        self.progress_updated.emit(self.row, 75)
+        print(f"[✅ SAVED] File saved successfully: {save_path}")
+
+        # The exact duration is in the headers for cached voices; for generated ones the
+        # server knows it once the stream has ended, so ask for the headers of the finished file
+        headers = response.headers
+        if not headers.get("X-Voice-Samples") and live_url:
+            try:
+                headers = requests.head(f"{API_URL}{live_url}", timeout=(10, 30)).headers
+            except Exception as e:
+                print(f"[⚠️ WARN] Không lấy được thời lượng từ server: {e}")
+        duration_sec = stream_duration(headers)
+        if not duration_sec:
+            try:
+                duration_sec = MP3(save_path).info.length
+            except:
+                duration_sec = 0
+
+        self.duration = duration_sec
+        timing_str = f"{int(duration_sec // 60):02}:{int(duration_sec % 60):02}"
+
+        self.progress_updated.emit(self.row, 100)
+        self.result_ready.emit(self.row, True, timing_str, self.speed, "N/A", save_path, save_path, duration_sec)
+        self.file_downloaded.emit(self.row, f"{API_URL}{response.headers.get('X-Voice-Download-Url', '')}")
+
+def stream_duration(headers):
+    """Duration in seconds from the server's X-Voice-* headers (sample-accurate when possible), or 0"""
+    try:
+        samples = headers.get("X-Voice-Samples")
+        sample_rate = headers.get("X-Voice-Sample-Rate")
+        if samples and sample_rate:
+            return int(samples) / int(sample_rate)
+        return float(headers.get("X-Voice-Duration") or 0)
+    except ValueError:
+        return 0
+
+class VoiceBatchThread(QThread):
+    """Submit the sheet to /api/voice/batch in parts of at most BATCH_MAX_ROWS rows and download
+    each row as its result arrives"""
+    result_ready = pyqtSignal(int, bool, str, str, str, str, str, float)
+    progress_updated = pyqtSignal(int, int)
+
+    def __init__(self, jobs, user_key, voice_name):
+        super().__init__()
+        self.jobs = jobs
+        self.user_key = user_key
+        self.voice_name = voice_name
+
+    def fail_all(self, rows, error_msg):
+        for row in rows:
+            self.result_ready.emit(row, False, "", "", "", "", error_msg, 0.0)
+
+    def run(self):
+        batch_size = BATCH_MAX_ROWS
+        start = 0
+        while start < len(self.jobs):
+            batch = self.jobs[start:start + batch_size]
+            server_limit = self.run_batch(batch)
+            if server_limit and server_limit < len(batch):
+                # The server takes fewer rows per batch than we assumed; resend in smaller parts
+                batch_size = server_limit
+                continue
+            start += len(batch)
+
+    def run_batch(self, jobs):
+        """Send one batch; returns the server's row limit if it rejected the batch as too large"""
+        jobs_by_row = {job["row"]: job for job in jobs}
+        payload = {
+            "api_key": self.user_key,
+            "voice_name": self.voice_name,
+            "rows": [{"row_id": job["row"], "text": job["text"]} for job in jobs]
+        }
+        remaining = set(jobs_by_row)
+
+        print(f"🔄 Gửi batch {len(jobs)} dòng với key {self.user_key[:8]}... voice: {self.voice_name}")
+        try:
+            with requests.post(f"{API_URL}/api/voice/batch", json=payload, headers=DEADLINE_HEADERS, stream=True,
+                               timeout=(10, 600)) as response:
+                if not response.ok:
+                    try:
+                        res = response.json()
+                    except Exception:
+                        res = {}
+                    error_msg = res.get("error") or res.get("message") or f"Lỗi HTTP: {response.status_code}"
+                    too_many = re.search(r"max (\d+)", error_msg) if response.status_code == 400 else None
+                    if too_many and int(too_many.group(1)) < len(jobs):
+                        return int(too_many.group(1))
+                    print(f"❌ Batch thất bại: {error_msg}")
+                    self.fail_all(remaining, error_msg)
+                    return None
+
+                for line in response.iter_lines():
+                    if not line:
+                        continue
+                    res = json.loads(line)
+                    row = res.get("row_id")
+                    if res.get("done") or row not in jobs_by_row:
+                        continue
+                    remaining.discard(row)
+
+                    if not res.get("success"):
+                        self.result_ready.emit(row, False, "", "", "", "", res.get("error", "Lỗi không xác định"), 0.0)
+                        continue
+
+                    job = jobs_by_row[row]
+                    try:
+                        os.makedirs(job["save_folder"], exist_ok=True)
+                        save_path = os.path.join(job["save_folder"], job["file_name"])
+                        self.progress_updated.emit(row, 50)
+                        download_file(f"{API_URL}{res['download_url']}", save_path)
+                    except Exception as e:
+                        self.result_ready.emit(row, False, "", "", "", "", f"Tạo OK nhưng tải lỗi: {e}", 0.0)
+                        continue
+
+                    if res.get("samples") and res.get("sample_rate"):
+                        duration_sec = res["samples"] / res["sample_rate"]
+                    else:
+                        duration_sec = res.get("duration", 0)
+                    timing_str = f"{int(duration_sec // 60):02}:{int(duration_sec % 60):02}"
+                    self.progress_updated.emit(row, 100)
+                    self.result_ready.emit(row, True, timing_str, job["speed"], "N/A", save_path, save_path, duration_sec)
+
+        except Exception as e:
+            print(f"❌ Batch thất bại: {e}")
+            self.fail_all(remaining, str(e))
+            return None
+
+        # Rows the server never reported (e.g. connection dropped)
+        self.fail_all(remaining, "Không nhận được kết quả từ server")
+        return None
+
 def centered_item(text):
     """Create centered table item"""
     item = QTableWidgetItem(text)
@@ -660,14 +886,34 @@ class VoiceToolUI(QWidget):
 
     def load_voices(self):
         try:
-            response = requests.get(f"{API_URL}/api/voice/list", timeout=10)
+            cached = None
+            headers = {}
+            try:
+                with open(VOICE_CATALOG_FILE, "r", encoding="utf-8") as f:
+                    cached = json.load(f)
+                headers["If-None-Match"] = cached["etag"]
+            except Exception:
+                cached = None
+
+            response = requests.get(f"{API_URL}/api/voice/list", headers=headers, timeout=10)
 
-            if response.status_code != 200:
-                raise Exception(f"Server trả về mã lỗi HTTP {response.status_code}")
+            if response.status_code == 304 and cached:
+                data = cached["data"]
+            else:
+                if response.status_code != 200:
+                    raise Exception(f"Server trả về mã lỗi HTTP {response.status_code}")
 
-            data = response.json()
-            if not data.get("success"):
-                raise Exception(data.get("message", "Không thành công"))
+                data = response.json()
+                if not data.get("success"):
+                    raise Exception(data.get("message", "Không thành công"))
+
+                if response.headers.get("ETag"):
+                    try:
+                        os.makedirs(VOICE_CACHE_DIR, exist_ok=True)
+                        with open(VOICE_CATALOG_FILE, "w", encoding="utf-8") as f:
+                            json.dump({"etag": response.headers["ETag"], "data": data}, f, ensure_ascii=False)
+                    except Exception as e:
+                        print(f"[⚠️ CACHE] Không thể lưu danh sách giọng nói: {e}")
 
             self.voice_data = data.get("voices", [])
             self.voice_combo.clear()
@@ -713,6 +959,12 @@ class VoiceToolUI(QWidget):
             QMessageBox.warning(self, "Voice Error", f"❌ Voice {voice_code} không có sample audio")
             return
         
+        local_sample = cached_voice_sample(selected_voice)
+        if local_sample:
+            print(f"🎧 Playing cached voice sample: {local_sample}")
+            self.play_audio(local_sample)
+            return
+
         print(f"🎧 Playing voice from server: {sample_url}")
         self.play_audio(sample_url, is_url=True)
 
@@ -808,7 +1060,8 @@ class VoiceToolUI(QWidget):
     def play_table_audio(self, button):
         """Play audio from table with pause/resume functionality"""
         file_path = button.property("file_path")
-        if not file_path:
+        stream_url = button.property("stream_url")
+        if not file_path and not stream_url:
             return
             
         # Check if this is the currently playing audio
@@ -844,8 +1097,11 @@ class VoiceToolUI(QWidget):
             # Set current playing button
             self.current_playing_button = button
             
-            # Play the audio
-            self.play_audio(file_path)
+            # Play the audio, following the live stream if the file is still being generated
+            if file_path:
+                self.play_audio(file_path)
+            else:
+                self.play_audio(stream_url, is_url=True)
             
             # Update button to show Pause state
             button.setText("⏸️ Pause")
@@ -1087,8 +1343,23 @@ class VoiceToolUI(QWidget):
 
             self.convert_queue.append(job)
 
+        if BATCH_MODE and self.convert_queue:
+            self.start_batch_convert()
+            return
+
         self.try_start_next_convert()
 
+    def start_batch_convert(self):
+        """Send all queued rows in one batch request"""
+        jobs = list(self.convert_queue)
+        self.convert_queue.clear()
+        thread = VoiceBatchThread(jobs, self.user_key, self.selected_voice_code)
+        thread.result_ready.connect(self.handle_convert_result)
+        thread.progress_updated.connect(self.handle_progress_update)
+        thread.finished.connect(partial(self.cleanup_thread, thread))
+        self.threads.append(thread)
+        thread.start()
+
     def try_start_next_convert(self):
         """Try to start the next conversion thread if the active threads are less than the limit"""
         while len(self.threads) < self.max_concurrent_threads and self.convert_queue:
@@ -1096,6 +1367,7 @@ class VoiceToolUI(QWidget):
             thread = VoiceConvertThread(**job)
             thread.result_ready.connect(self.handle_convert_result)
             thread.progress_updated.connect(self.handle_progress_update)
+            thread.stream_started.connect(self.handle_stream_started)
             thread.finished.connect(partial(self.cleanup_thread, thread))
             self.threads.append(thread)
             thread.start()
@@ -1104,6 +1376,19 @@ class VoiceToolUI(QWidget):
         """Handle progress update from conversion thread"""
         pass
 
+    def handle_stream_started(self, row, live_url):
+        """Enable the row's Play button so audio can be heard while it is still being generated"""
+        player_btn = self.table.cellWidget(row, 7)
+        if player_btn is None:
+            return
+        player_btn.setProperty("stream_url", live_url)
+        player_btn.setEnabled(True)
+        try:
+            player_btn.clicked.disconnect()
+        except TypeError:
+            pass
+        player_btn.clicked.connect(lambda checked, btn=player_btn: self.play_table_audio(btn))
+
     def handle_convert_result(self, row, success, timing, speed, proxy, unused_param1, real_file_path_or_error, duration):
         if success:
             self.table.setItem(row, 2, centered_item(timing))
@@ -1160,7 +1445,9 @@ class VoiceToolUI(QWidget):
             fail_item.setForeground(QColor("red"))
             self.table.setItem(row, 4, fail_item)
 
-        self.cleanup_thread(self.sender())
+        # A batch thread reports many rows; it is cleaned up when it finishes
+        if not isinstance(self.sender(), VoiceBatchThread):
+            self.cleanup_thread(self.sender())
 
     def cleanup_thread(self, thread):
         """Clean up the thread after it finishes"""